@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################       Benchmark Runner        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Drives a service's FastAPI app in-process over raw ASGI (no sockets, no HTTP parsing) at a fixed concurrency and
+# reports latency percentiles and throughput per scenario. Every service package is called api_microservice, so each
+# service is benchmarked in its own interpreter; --service all fans out to one subprocess per service.
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ------------------------------------------------
+#                  ASGI Client
+# ------------------------------------------------
+
+
+class AsgiClient(object):
+    """Minimal in-process HTTP client: builds an ASGI scope per request and collects the response messages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, url, payload=None, headers=None):
+        parts = urlsplit(url)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        raw_headers = [(b"host", b"bench"), (b"content-length", str(len(body)).encode())]
+        if payload is not None:
+            raw_headers.append((b"content-type", b"application/json"))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": parts.path,
+            "raw_path": parts.path.encode(),
+            "query_string": parts.query.encode(),
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+
+        finished = asyncio.Event()
+        request_sent = False
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+
+        content = b"".join(chunks)
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, content
+
+    async def get(self, url, headers=None):
+        return await self.request("GET", url, headers=headers)
+
+    async def post(self, url, payload, headers=None):
+        return await self.request("POST", url, payload, headers)
+
+
+# ------------------------------------------------
+#                   Statistics
+# ------------------------------------------------
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    rank = fraction * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    latencies holds successful iterations only: a failed request (a shed 503, say) returns early and would flatter both
+    the percentiles and the throughput.
+    """
+    ordered = sorted(latencies)
+    failed = sum(errors.values())
+    attempted = len(latencies) + failed
+    milliseconds = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "error_rate": round(failed / attempted, 4) if attempted else 0.0,
+        "p50_ms": milliseconds(percentile(ordered, 0.50)),
+        "p95_ms": milliseconds(percentile(ordered, 0.95)),
+        "p99_ms": milliseconds(percentile(ordered, 0.99)),
+        "mean_ms": milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+        "max_ms": milliseconds(ordered[-1]) if ordered else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+# ------------------------------------------------
+#                    Runner
+# ------------------------------------------------
+
+
+async def run_scenario(client, scenario, requests, concurrency, warmup):
+    for iteration in range(warmup):
+        try:
+            await scenario(client, -1 - iteration)
+        except Exception:
+            pass
+
+    latencies, errors = [], {}
+    iterations = iter(range(requests))
+
+    async def worker():
+        for iteration in iterations:
+            started = time.perf_counter()
+            try:
+                await scenario(client, iteration)
+            except Exception as e:
+                key = type(e).__name__ + (f" {e}" if str(e) else "")
+                errors[key] = errors.get(key, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def load_service(service, db_uri):
+    """
+    Imports backend/<service>/api_microservice against db_uri. The services read DB_ACCESS_URI at import time, so the
+    variable is set first; the app's startup events then create the schema exactly as they would in production.
+    """
+    os.environ["DB_ACCESS_URI"] = db_uri
+    sys.path.insert(0, os.path.join(BACKEND_DIR, service))
+    sys.path.insert(0, BENCHMARK_DIR)
+    main = importlib.import_module("api_microservice.main")
+    models = importlib.import_module("api_microservice.sqlmodels")
+    return main, models
+
+
+async def benchmark_service(service, db_uri, requests, concurrency, warmup, only):
+    import scenarios
+
+    main, models = load_service(service, db_uri)
+    await main.app.router.startup()
+    scenarios.SERVICES[service]["seed"](models, main.engine)
+
+    client = AsgiClient(main.app)
+    results = {}
+    for name, scenario in scenarios.SERVICES[service]["scenarios"].items():
+        if only and name not in only:
+            continue
+        results[name] = await run_scenario(client, scenario, requests, concurrency, warmup)
+        print(f"  {service:>9} {name:<20} {json.dumps(results[name])}", file=sys.stderr)
+
+    await main.app.router.shutdown()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short=8", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# ------------------------------------------------
+#                   Comparison
+# ------------------------------------------------
+
+
+def compare(baseline, current, threshold):
+    """
+    Lists every scenario whose error rate rose at all, or whose p95 latency rose, or throughput fell, by more than
+    threshold (a fraction) relative to the baseline run.
+    """
+    regressions = []
+    for service, endpoints in current["services"].items():
+        for name, stats in endpoints.items():
+            before = baseline.get("services", {}).get(service, {}).get(name)
+            if not before:
+                continue
+
+            error_rise = stats.get("error_rate", 0.0) > before.get("error_rate", 0.0)
+            slower = False
+            if before.get("p95_ms") and stats.get("p95_ms"):
+                latency_change = stats["p95_ms"] / before["p95_ms"] - 1
+                throughput_change = stats["throughput_rps"] / before["throughput_rps"] - 1
+                slower = latency_change > threshold or throughput_change < -threshold
+            elif before.get("p95_ms"):
+                slower = True       # nothing succeeded this time
+
+            if error_rise or slower:
+                regressions.append({
+                    "service": service,
+                    "endpoint": name,
+                    "error_rate": [before.get("error_rate", 0.0), stats.get("error_rate", 0.0)],
+                    "p95_ms": [before.get("p95_ms"), stats.get("p95_ms")],
+                    "throughput_rps": [before.get("throughput_rps"), stats.get("throughput_rps")],
+                })
+    return regressions
+
+
+# ------------------------------------------------
+#                Command Line Entry
+# ------------------------------------------------
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="In-process load benchmark for the Utopia FastAPI services.")
+    parser.add_argument("--service", default="all", choices=["all", "flights", "bookings", "users", "security"])
+    parser.add_argument("--db-uri", help="database to seed and benchmark against (default: a fresh SQLite file)")
+    parser.add_argument("--requests", type=int, default=1000, help="iterations per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed iterations per scenario")
+    parser.add_argument("--only", nargs="*", help="scenario names to run")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression fraction")
+    return parser.parse_args()
+
+
+def run_single(arguments):
+    workdir = None
+    db_uri = arguments.db_uri
+    if not db_uri:
+        workdir = tempfile.mkdtemp(prefix="utopia-bench-")
+        db_uri = f"sqlite:///{os.path.join(workdir, arguments.service)}.db?check_same_thread=false"
+
+    return asyncio.run(benchmark_service(
+        arguments.service, db_uri, arguments.requests, arguments.concurrency, arguments.warmup, arguments.only
+    ))
+
+
+def run_all(arguments):
+    services = {}
+    for service in ("flights", "bookings", "users", "security"):
+        command = [
+            sys.executable, os.path.abspath(__file__), "--service", service,
+            "--requests", str(arguments.requests), "--concurrency", str(arguments.concurrency),
+            "--warmup", str(arguments.warmup)
+        ]
+        if arguments.db_uri:
+            command += ["--db-uri", arguments.db_uri]
+        if arguments.only:
+            command += ["--only", *arguments.only]
+
+        completed = subprocess.run(command, stdout=subprocess.PIPE)
+        if completed.returncode != 0:
+            print(f"{service} benchmark failed", file=sys.stderr)
+            continue
+        services.update(json.loads(completed.stdout)["services"])
+    return services
+
+
+def main():
+    arguments = parse_arguments()
+    services = run_all(arguments) if arguments.service == "all" else {arguments.service: run_single(arguments)}
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "db": "custom" if arguments.db_uri else "sqlite",
+            "requests": arguments.requests,
+            "concurrency": arguments.concurrency,
+        },
+        "services": services,
+    }
+
+    if arguments.output:
+        with open(arguments.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if arguments.compare:
+        with open(arguments.compare) as handle:
+            regressions = compare(json.load(handle), results, arguments.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {json.dumps(regression)}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################           Scenarios           ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Each service gets a seed() that fills a fresh database through the service's own table models, and a list of
+# scenarios. A scenario is a named coroutine factory: given the ASGI client and the iteration number it performs one
+# unit of work (one request, or a short flow such as a booking checkout) and raises on an unexpected status.
+import datetime
+import itertools
+import random
+import string
+
+from sqlmodel import Session
+
+SEED_AIRPORTS = 2000
+SEED_ROUTES = 500
+SEED_FLIGHTS = 5000
+SEED_USERS = 2000
+SEED_BOOKINGS = 2000
+
+CODES = ["".join(letters) for letters in itertools.product(string.ascii_uppercase, repeat=3)]
+
+
+class UnexpectedStatus(Exception):
+    pass
+
+
+def expect(response, *statuses):
+    status = response[0]
+    if status not in (statuses or (200,)):
+        raise UnexpectedStatus(status)
+    return response
+
+
+# ------------------------------------------------
+#                     Flights
+# ------------------------------------------------
+
+
+def seed_flights(models, engine):
+    rng = random.Random(1)
+    with Session(engine) as session:
+        session.add_all([models.AirplaneType(max_capacity=capacity) for capacity in (150, 188, 247, 380)])
+        session.add_all([models.Airplane(type_id=rng.randint(1, 4)) for _ in range(200)])
+        session.add_all([
+            models.Airport(
+                iata_id=code, city=f"City {code}", name=f"{code} International",
+                latitude=rng.uniform(25, 49), longitude=rng.uniform(-124, -67), elevation=rng.randint(0, 5000)
+            )
+            for code in CODES[:SEED_AIRPORTS]
+        ])
+        session.commit()
+
+        session.add_all([
+            models.Route(origin_id=CODES[index], destination_id=CODES[index + 1], duration=rng.uniform(1, 6))
+            for index in range(SEED_ROUTES)
+        ])
+        session.commit()
+
+        departure = datetime.datetime(2030, 1, 1)
+        session.add_all([
+            models.Flight(
+                route_id=rng.randint(1, SEED_ROUTES), airplane_id=rng.randint(1, 200),
+                departure_time=str(departure + datetime.timedelta(hours=index)),
+                reserved_seats=rng.randint(0, 150), seat_price=round(rng.uniform(80, 600), 2)
+            )
+            for index in range(SEED_FLIGHTS)
+        ])
+        session.commit()
+
+
+async def flight_search(client, iteration):
+    expect(await client.get(f"/api/v2/flights/route/{iteration % SEED_ROUTES + 1}?limit=100"), 200, 404)
+
+
+async def flight_listing(client, iteration):
+    expect(await client.get(f"/api/v2/flights/?skip={(iteration * 100) % SEED_FLIGHTS}&limit=100"))
+
+
+async def flight_lookup(client, iteration):
+    expect(await client.get(f"/api/v2/flights/{iteration % SEED_FLIGHTS + 1}"))
+
+
+async def route_creation(client, iteration):
+    # Routes are created from successive seeded airports towards the far end of the seed range, so every pair is new.
+    origin = CODES[SEED_ROUTES + 1 + iteration % (SEED_AIRPORTS - SEED_ROUTES - 2)]
+    expect(await client.post("/api/v2/routes/", {"origin_id": origin, "destination_id": CODES[SEED_AIRPORTS - 1]}),
+           200, 400)
+
+
+# ------------------------------------------------
+#                     Bookings
+# ------------------------------------------------
+
+
+def seed_bookings(models, engine):
+    rng = random.Random(2)
+    with Session(engine) as session:
+        session.add_all([
+            models.Booking(id=index, confirmation_code=f"SEED{index:06d}") for index in range(1, SEED_BOOKINGS + 1)
+        ])
+        session.commit()
+        session.add_all([
+            models.Passenger(
+                booking_id=index, given_name="Seed", family_name=rng.choice(("Smith", "Jones", "Brown")),
+                dob=datetime.date(1980, 1, 1), gender="F", address="1 Seed St"
+            )
+            for index in range(1, SEED_BOOKINGS + 1)
+        ])
+        session.commit()
+
+
+async def booking_checkout(client, iteration):
+    code = f"B{iteration:09d}"
+    status, body = expect(await client.post("/api/v2/bookings/", {"confirmation_code": code}))
+    booking_id = body["id"]
+
+    expect(await client.post("/api/v2/booking_guests/", {
+        "booking_id": booking_id, "contact_email": f"guest{iteration}@example.com", "contact_phone": "555-000-0000"
+    }))
+    expect(await client.post("/api/v2/booking_payments/", {"booking_id": booking_id, "stripe_id": f"ch_{code}"}))
+    expect(await client.post("/api/v2/passengers/", {
+        "booking_id": booking_id, "given_name": "Bench", "family_name": "Mark", "dob": "1990-01-01",
+        "gender": "M", "address": "1 Bench St"
+    }))
+
+
+async def booking_lookup(client, iteration):
+    expect(await client.get(f"/api/v2/bookings/{iteration % SEED_BOOKINGS + 1}"))
+
+
+async def passenger_listing(client, iteration):
+    expect(await client.get(f"/api/v2/passengers/?skip={(iteration * 100) % SEED_BOOKINGS}&limit=100"))
+
+
+# ------------------------------------------------
+#                  Users / Security
+# ------------------------------------------------
+
+
+def seed_users(models, engine):
+    with Session(engine) as session:
+        session.add_all([models.UserRole(name=name) for name in ("admin", "agent", "user")])
+        session.commit()
+        # A pre-hashed password: hashing thousands of seed users would take longer than the benchmark.
+        session.add_all([
+            models.User(
+                role_id=3, given_name="Seed", family_name=f"User{index}", username=f"seed.user{index}",
+                password="pbkdf2:sha256:260000$seed$0", email=f"seed.user{index}@example.com", phone="555-000-0000"
+            )
+            for index in range(1, SEED_USERS + 1)
+        ])
+        session.commit()
+
+
+async def user_lookup(client, iteration):
+    expect(await client.get(f"/api/v2/users/{iteration % SEED_USERS + 1}"))
+
+
+async def user_listing(client, iteration):
+    expect(await client.get(f"/api/v2/users/?skip={(iteration * 100) % SEED_USERS}&limit=100"))
+
+
+async def user_login(client, iteration):
+    expect(await client.get(f"/api/v2/users/seed.user{iteration % SEED_USERS + 1}/auth"))
+
+
+async def security_user_lookup(client, iteration):
+    expect(await client.get(f"/api/v2/users/{iteration % SEED_USERS + 1}"))
+
+
+async def security_user_login(client, iteration):
+    expect(await client.get(f"/api/v2/users/seed.user{iteration % SEED_USERS + 1}/auth"))
+
+
+# ------------------------------------------------
+#                    Registry
+# ------------------------------------------------
+
+
+SERVICES = {
+    "flights": {
+        "seed": seed_flights,
+        "scenarios": {
+            "flight_search": flight_search,
+            "flight_listing": flight_listing,
+            "flight_lookup": flight_lookup,
+            "route_creation": route_creation,
+        },
+    },
+    "bookings": {
+        "seed": seed_bookings,
+        "scenarios": {
+            "booking_checkout": booking_checkout,
+            "booking_lookup": booking_lookup,
+            "passenger_listing": passenger_listing,
+        },
+    },
+    "users": {
+        "seed": seed_users,
+        "scenarios": {
+            "user_lookup": user_lookup,
+            "user_listing": user_listing,
+            "user_login": user_login,
+        },
+    },
+    "security": {
+        "seed": seed_users,
+        "scenarios": {
+            "user_lookup": security_user_lookup,
+            "user_login": security_user_login,
+        },
+    },
+}
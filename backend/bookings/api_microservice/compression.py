@@ -0,0 +1,206 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################          Compression          ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Content-negotiated response compression. gzip is always available; brotli and zstd are used when their packages are
+# installed and the client prefers them. Only compressible media types at or above COMPRESSION_MIN_SIZE bytes are
+# compressed, whole bodies in one call and streamed (more_body) bodies chunk by chunk with a sync flush, so a streamed
+# listing still reaches the client as it is produced. Levels are configurable but capped, keeping CPU per byte low.
+import gzip
+import os
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE') or 1024)
+GZIP_LEVEL = min(int(os.getenv('GZIP_LEVEL') or 5), 6)
+BROTLI_QUALITY = min(int(os.getenv('BROTLI_QUALITY') or 4), 6)
+ZSTD_LEVEL = min(int(os.getenv('ZSTD_LEVEL') or 3), 9)
+
+COMPRESSIBLE = re.compile(r"^(text/|application/(json|javascript|xml|[\w.+-]+\+json|[\w.+-]+\+xml)\b)")
+
+
+# ------------------------------------------------
+#                    Codecs
+# ------------------------------------------------
+
+
+class GzipStream(object):
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream(object):
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream(object):
+
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+# In order of server preference, for when the client rates several encodings equally.
+CODECS = {"gzip": (lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0), GzipStream)}
+if zstandard is not None:
+    CODECS = {"zstd": (lambda body: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), ZstdStream), **CODECS}
+if brotli is not None:
+    CODECS = {"br": (lambda body: brotli.compress(body, quality=BROTLI_QUALITY), BrotliStream), **CODECS}
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the supported encoding the client rates highest in its Accept-Encoding header, honouring q-values (q=0
+    refuses an encoding) and the * wildcard.
+    :return: the encoding name, or None to send the body uncompressed
+    """
+    ratings = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if name:
+            ratings[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in CODECS:
+        quality = ratings.get(encoding, ratings.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+class CompressionMiddleware(object):
+    """
+    Pure ASGI middleware. The response start is held back until the first body chunk shows whether the body is
+    complete (and big enough to be worth compressing) or streamed.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, CompressingSender(send, encoding, self.minimum_size).send)
+
+
+class CompressingSender(object):
+
+    def __init__(self, send, encoding, minimum_size):
+        self.downstream = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.stream = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if self.passthrough:
+            await self.downstream(message)
+            return
+
+        if message["type"] == "http.response.start":
+            headers = dict((name.lower(), value) for name, value in message.get("headers", []))
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            if (b"content-encoding" in headers or message["status"] in (204, 304)
+                    or not COMPRESSIBLE.match(content_type)):
+                self.passthrough = True
+                await self.downstream(message)
+            else:
+                self.start = message
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.downstream(self.with_headers(self.start, None, len(body)))
+                await self.downstream(message)
+                return
+
+            if not more_body:
+                compressed = CODECS[self.encoding][0](body)
+                await self.downstream(self.with_headers(self.start, self.encoding, len(compressed)))
+                await self.downstream({"type": "http.response.body", "body": compressed})
+                return
+
+            self.stream = CODECS[self.encoding][1]()
+            await self.downstream(self.with_headers(self.start, self.encoding, None))
+
+        chunk = self.stream.compress(body) if body else b""
+        if not more_body:
+            chunk += self.stream.finish()
+        await self.downstream({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    @staticmethod
+    def with_headers(start, encoding, length):
+        headers = [
+            (name, value) for name, value in start.get("headers", [])
+            if name.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [value for name, value in start.get("headers", []) if name.lower() == b"vary"]
+        if not any(b"accept-encoding" in value.lower() for value in vary):
+            vary.append(b"Accept-Encoding")
+        headers.append((b"vary", b", ".join(vary)))
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode()))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        return dict(start, headers=headers)
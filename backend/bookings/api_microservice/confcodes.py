@@ -0,0 +1,155 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################      Confirmation Codes       ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Server-side confirmation codes: six Crockford base-32 characters (digits and upper-case letters without I, L, O and
+# U), which is exactly 30 bits. Each code encodes a sequence number no other booking gets:
+#
+#   - Sequence numbers are handed out in blocks of CONFCODE_BLOCK_SIZE. A worker claims a block by inserting a row into
+#     confirmation_code_block; the row's auto-increment id numbers the block, so every replica and worker claims
+#     different blocks without any locking, and the worker then issues the block's numbers from memory. Only one code
+#     in CONFCODE_BLOCK_SIZE costs a database round trip.
+#   - The number is scrambled by a fixed Feistel permutation of the 30-bit space before encoding. A permutation never
+#     maps two numbers to one code, and consecutive bookings get unrelated looking codes that do not reveal the
+#     booking volume.
+#
+# Numbers left in a worker's block when it exits are never used; at the default block size the 2^30 codes still cover a
+# million worker restarts. ROUND_KEYS must never change once codes have been issued.
+#
+# Codes supplied by clients share the confirmation_code column, so any code of the generated shape (six characters of
+# the alphabet, in either case as MySQL compares them case-insensitively) is reserved for the allocator and refused.
+# The unique index settles every remaining clash: a client code already taken is a 400, and a generated code that hits
+# one stored before codes were generated is replaced by the next one.
+import datetime
+import hashlib
+import os
+import threading
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from .sqlmodels import ConfirmationCodeBlock
+
+CONFCODE_BLOCK_SIZE = int(os.getenv('CONFCODE_BLOCK_SIZE') or 1024)
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+CODE_LENGTH = 6
+CODE_BITS = 5 * CODE_LENGTH
+HALF_BITS = CODE_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+
+ROUND_KEYS = (b"utopia-confcode-1", b"utopia-confcode-2", b"utopia-confcode-3", b"utopia-confcode-4")
+
+
+# ------------------------------------------------
+#                    Encoding
+# ------------------------------------------------
+
+
+def round_function(half, key):
+    digest = hashlib.blake2b(half.to_bytes(2, "big"), digest_size=4, key=key).digest()
+    return int.from_bytes(digest, "big") & HALF_MASK
+
+
+def permute(number):
+    """
+    A balanced Feistel network over two 15-bit halves: a bijection of [0, 2^30) whatever the round function.
+    """
+    left, right = number >> HALF_BITS, number & HALF_MASK
+    for key in ROUND_KEYS:
+        left, right = right, left ^ round_function(right, key)
+    return (left << HALF_BITS) | right
+
+
+def encode(number):
+    characters = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, 32)
+        characters.append(ALPHABET[digit])
+    return "".join(reversed(characters))
+
+
+# ------------------------------------------------
+#                   Allocation
+# ------------------------------------------------
+
+
+class ConfirmationCodeAllocator(object):
+
+    def __init__(self, block_size=CONFCODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next = 0
+        self.end = 0
+
+    def claim_block(self, engine):
+        # Committed on its own connection, independent of the caller's transaction, so a block is never handed out
+        # twice even if the booking that needed it rolls back.
+        with engine.begin() as connection:
+            result = connection.execute(
+                insert(ConfirmationCodeBlock.__table__).values(allocated_at=datetime.datetime.utcnow())
+            )
+            block = result.inserted_primary_key[0] - 1
+
+        start = block * self.block_size
+        if start + self.block_size > 1 << CODE_BITS:
+            raise HTTPException(
+                status_code=503,
+                detail="Confirmation codes exhausted"
+            )
+        return start
+
+    def next_code(self, engine):
+        with self.lock:
+            if self.next >= self.end:
+                self.next = self.claim_block(engine)
+                self.end = self.next + self.block_size
+            number = self.next
+            self.next += 1
+        return encode(permute(number))
+
+
+allocator = ConfirmationCodeAllocator()
+
+
+def next_confirmation_code(db):
+    return allocator.next_code(db.get_bind())
+
+
+# ------------------------------------------------
+#                  Client Codes
+# ------------------------------------------------
+
+
+def generated_shape(code):
+    return len(code) == CODE_LENGTH and all(character in ALPHABET for character in code.upper())
+
+
+def reject_reserved_code(code):
+    if generated_shape(code):
+        raise HTTPException(
+            status_code=400,
+            detail="Six letter and digit confirmation codes are reserved for generated codes"
+        )
+
+
+def commit_booking(db, booking, generated=False, attempts=3):
+    """
+    Commits the session holding booking. A confirmation code clash is a 400 for a client code; a generated code is
+    replaced and the commit retried.
+    """
+    for attempt in range(attempts):
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            db.rollback()
+            if not generated or attempt == attempts - 1:
+                raise HTTPException(
+                    status_code=400,
+                    detail="A booking with that confirmation code already exists"
+                )
+            booking.confirmation_code = next_confirmation_code(db)
+            db.add(booking)
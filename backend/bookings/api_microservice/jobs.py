@@ -0,0 +1,244 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Background Jobs        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# A durable job queue in the job table, for side effects too slow to run inside a request (payment refunds,
+# confirmation emails). A handler calls enqueue() in its own session, so the job is committed together with the change
+# that caused it - or not at all - and the request returns without waiting for the side effect.
+#
+# Worker processes (worker.py) poll the table. A worker claims a job with a conditional UPDATE that only one worker can
+# win, and holds it for JOB_LEASE_SECONDS; a job whose worker died is claimed again once its lease runs out. The job's
+# handler runs in a fresh session whose commit also marks the job done, so its own writes and its completion land
+# together. A handler that raises is retried after an exponential, jittered backoff until max_attempts claims have been
+# made, after which the job is left failed for an operator to look at (and requeue through the API). A handler that
+# raises PermanentJobError fails the job at once: retrying cannot change the outcome. A kind registered
+# with on_failure(db, payload) has it called in the commit that leaves the job failed, to settle state it tracks itself.
+#
+# Each kind of job is registered with a concurrency limit: no worker claims a job of that kind while the limit's worth
+# are running across all workers. Two workers claiming at the same moment can overshoot it by one each, so treat the
+# limit as approximate. Handlers may be run more than once (a lease can expire under a slow handler), so they must be
+# idempotent; the payment provider calls carry idempotency keys for that reason. A handler that runs longer than a lease
+# calls extend_lease() as it goes, which raises LeaseLost once another worker has claimed the job; run_job then leaves
+# the job to that worker.
+import contextvars
+import datetime
+import json
+import os
+import random
+import traceback
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlmodel import Session
+
+from .sqlmodels import Job
+
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS') or 300)
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS') or 8)
+JOB_BACKOFF_SECONDS = float(os.getenv('JOB_BACKOFF_SECONDS') or 5)
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv('JOB_BACKOFF_MAX_SECONDS') or 3600)
+JOB_CLAIM_CANDIDATES = int(os.getenv('JOB_CLAIM_CANDIDATES') or 10)
+
+# kind -> (handler, concurrency). A handler is called as handler(db, payload).
+job_handlers = {}
+# kind -> on_failure(db, payload)
+failure_handlers = {}
+
+# (job id, worker id, attempts) of the job the current thread is running
+running_job = contextvars.ContextVar("running_job", default=None)
+
+
+class PermanentJobError(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def register_job(kind, concurrency=1, on_failure=None):
+    def decorator(handler):
+        job_handlers[kind] = (handler, concurrency)
+        if on_failure is not None:
+            failure_handlers[kind] = on_failure
+        return handler
+    return decorator
+
+
+def enqueue(db, kind, payload, delay=0, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Adds a job to the caller's session; it is queued when the caller commits.
+    """
+    if kind not in job_handlers:
+        raise ValueError(f"No job handler registered for {kind!r}")
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_after=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay),
+    )
+    db.add(job)
+    return job
+
+
+def requeue(job):
+    """
+    Gives a failed job a fresh set of attempts, due now.
+    """
+    job.status = "queued"
+    job.attempts = 0
+    job.run_after = datetime.datetime.utcnow()
+    job.finished_at = None
+
+
+def backoff(attempts):
+    """
+    :return: seconds to wait before attempt number attempts + 1, between half and all of the exponential delay
+    """
+    delay = min(JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ------------------------------------------------
+#                    Claiming
+# ------------------------------------------------
+
+
+def claimable(now):
+    return or_(
+        and_(Job.status == "queued", Job.run_after <= now),
+        and_(Job.status == "running", Job.locked_until <= now),
+    )
+
+
+def open_kinds(db, now):
+    """
+    :return: the registered kinds with fewer jobs running (on an unexpired lease) than their concurrency limit
+    """
+    running = dict(db.execute(
+        select(Job.kind, func.count())
+        .where(Job.status == "running", Job.locked_until > now)
+        .group_by(Job.kind)
+    ).all())
+    return [kind for kind, (_, concurrency) in job_handlers.items() if running.get(kind, 0) < concurrency]
+
+
+def claim(engine, worker_id, now=None):
+    """
+    :return: the id of the job this worker now holds, or None when there is nothing it may run
+    """
+    now = now or datetime.datetime.utcnow()
+    with Session(engine) as db:
+        kinds = open_kinds(db, now)
+        if not kinds:
+            return None
+        candidates = db.execute(
+            select(Job.id)
+            .where(Job.kind.in_(kinds), claimable(now))
+            .order_by(Job.run_after)
+            .limit(JOB_CLAIM_CANDIDATES)
+        ).scalars().all()
+
+        for job_id in candidates:
+            claimed = db.execute(
+                update(Job.__table__)
+                .where(Job.id == job_id, claimable(now))
+                .values(
+                    status="running",
+                    attempts=Job.attempts + 1,
+                    locked_by=worker_id,
+                    locked_until=now + datetime.timedelta(seconds=JOB_LEASE_SECONDS),
+                )
+            ).rowcount
+            db.commit()
+            if claimed:
+                return job_id
+    return None
+
+
+# ------------------------------------------------
+#                    Running
+# ------------------------------------------------
+
+
+def extend_lease(db, now=None):
+    """
+    Pushes the lease of the job this thread is running JOB_LEASE_SECONDS on from now, in the caller's transaction. Does
+    nothing outside a job.
+    :raises LeaseLost: when the lease ran out and another worker has claimed the job since
+    """
+    lease = running_job.get()
+    if lease is None:
+        return
+    job_id, worker_id, attempts = lease
+    now = now or datetime.datetime.utcnow()
+    extended = db.execute(
+        update(Job.__table__)
+        .where(Job.id == job_id, Job.status == "running", Job.locked_by == worker_id, Job.attempts == attempts)
+        .values(locked_until=now + datetime.timedelta(seconds=JOB_LEASE_SECONDS))
+    ).rowcount
+    if not extended:
+        raise LeaseLost(f"Job {job_id} was claimed by another worker")
+
+
+def call_handler(handler, db, job):
+    lease = running_job.set((job.id, job.locked_by, job.attempts))
+    try:
+        handler(db, json.loads(job.payload))
+    finally:
+        running_job.reset(lease)
+
+
+def run_job(engine, job_id, now=None):
+    """
+    Runs a claimed job and records the outcome.
+    :return: the job's status afterwards
+    """
+    with Session(engine) as db:
+        job = db.get(Job, job_id)
+        handler, _ = job_handlers.get(job.kind, (None, None))
+        try:
+            if handler is None:
+                raise LookupError(f"No job handler registered for {job.kind!r}")
+            call_handler(handler, db, job)
+        except LeaseLost:
+            # The job is another worker's now; its outcome is theirs to record.
+            db.rollback()
+            return db.get(Job, job_id).status
+        except Exception as exception:
+            db.rollback()
+            error = traceback.format_exc(limit=5)
+            permanent = isinstance(exception, PermanentJobError)
+        else:
+            job.status = "done"
+            job.finished_at = datetime.datetime.utcnow()
+            job.locked_by = job.locked_until = None
+            db.add(job)
+            db.commit()
+            return job.status
+
+        job = db.get(Job, job_id)
+        job.last_error = error
+        job.locked_by = job.locked_until = None
+        if permanent or job.attempts >= job.max_attempts:
+            job.status = "failed"
+            job.finished_at = datetime.datetime.utcnow()
+            if job.kind in failure_handlers:
+                failure_handlers[job.kind](db, json.loads(job.payload))
+        else:
+            job.status = "queued"
+            job.run_after = (now or datetime.datetime.utcnow()) + datetime.timedelta(seconds=backoff(job.attempts))
+        db.add(job)
+        db.commit()
+        return job.status
+
+
+def work_once(engine, worker_id, now=None):
+    """
+    Claims and runs one job.
+    :return: the id of the job run, or None when there was nothing to run
+    """
+    job_id = claim(engine, worker_id, now)
+    if job_id is not None:
+        run_job(engine, job_id, now)
+    return job_id
@@ -0,0 +1,206 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################            Metrics            ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Request metrics in the Prometheus text exposition format. Every update and every render happens on the event loop
+# thread (the middleware is pure ASGI and the /metrics endpoint is async), so the counters need no locks. Series are
+# keyed on the route template (/api/v2/flights/{flight_id}), never the raw path, which keeps their number bounded by
+# the number of routes rather than the number of distinct ids requested.
+from bisect import bisect_left
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+# ------------------------------------------------
+#                 Metric Types
+# ------------------------------------------------
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(object):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name + format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, labels=(), value=0):
+        self.values[labels] = value
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram. Each label set owns one flat list - a count per bucket plus the overflow bucket - along with
+    a running sum and total, so an observation is a bisect and three in-place additions.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield self.name + "_bucket" + format_labels(self.labelnames, labels, f'le="{le}"'), cumulative
+            yield self.name + "_sum" + format_labels(self.labelnames, labels), total
+            yield self.name + "_count" + format_labels(self.labelnames, labels), count
+
+
+# ------------------------------------------------
+#                    Registry
+# ------------------------------------------------
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Adds a metric to the exposition, or returns the one already registered under that name so that modules can
+        declare their metrics at import time without caring about import order.
+        :return: the registered metric
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{sample} {value}" for sample, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests handled, by route template and status code.",
+    ("method", "route", "status")
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled."
+))
+LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"), LATENCY_BUCKETS
+))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "http_response_size_bytes", "Response body size.",
+    ("method", "route", "status"), SIZE_BUCKETS
+))
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+ROUTE_TEMPLATES = {}
+
+
+def route_template(scope):
+    """
+    The path template of the route that handled a request. The router records the matched endpoint in the shared
+    scope, so this only works once the downstream app has been called.
+    :return: the template, or <unmatched> for requests no route matched
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    template = ROUTE_TEMPLATES.get(endpoint)
+    if template is None:
+        for route in scope["app"].router.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                template = ROUTE_TEMPLATES[endpoint] = route.path
+                break
+        else:
+            return UNMATCHED_ROUTE
+    return template
+
+
+class MetricsMiddleware(object):
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware, so no extra task or body buffering per request). The route template
+    is only known once the router has matched, so the labels are resolved after the downstream app returns.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            labels = (scope["method"], route_template(scope), status)
+            REQUESTS.inc(labels)
+            LATENCY.observe(labels, elapsed)
+            RESPONSE_SIZE.observe(labels, size)
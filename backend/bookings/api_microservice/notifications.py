@@ -0,0 +1,65 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################         Notifications         ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Booking confirmation emails, sent from background jobs. With SMTP_HOST set they go out through that server;
+# otherwise they are kept in the in-memory outbox below (and logged), which is what development and the tests use.
+import logging
+import os
+import smtplib
+from collections import deque
+from email.message import EmailMessage
+
+from .jobs import register_job
+from .sqlmodels import Booking
+
+SMTP_HOST = os.getenv('SMTP_HOST')
+SMTP_PORT = int(os.getenv('SMTP_PORT') or 587)
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+MAIL_FROM = os.getenv('MAIL_FROM') or "bookings@utopia-airlines.com"
+EMAIL_CONCURRENCY = int(os.getenv('EMAIL_CONCURRENCY') or 8)
+
+CONFIRMATION_JOB = "send_booking_confirmation"
+
+logger = logging.getLogger(__name__)
+
+# Messages "sent" without an SMTP server, newest last.
+outbox = deque(maxlen=100)
+
+
+def send_email(message):
+    if not SMTP_HOST:
+        logger.info("No SMTP_HOST set, keeping email to %s in the outbox", message["To"])
+        outbox.append(message)
+        return
+
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+        smtp.starttls()
+        if SMTP_USERNAME:
+            smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
+        smtp.send_message(message)
+
+
+# ------------------------------------------------
+#                      Jobs
+# ------------------------------------------------
+
+
+@register_job(CONFIRMATION_JOB, concurrency=EMAIL_CONCURRENCY)
+def send_booking_confirmation(db, payload):
+    booking = db.get(Booking, payload["booking_id"])
+    if booking is None:
+        # Deleted since; there is nothing left to confirm.
+        return
+
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = payload["contact_email"]
+    message["Subject"] = f"Your Utopia Airlines booking {booking.confirmation_code}"
+    message.set_content(
+        f"Thank you for booking with Utopia Airlines.\n\n"
+        f"Your confirmation code is {booking.confirmation_code}.\n"
+    )
+    send_email(message)
@@ -0,0 +1,117 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################       Payment Provider        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Calls to the payment provider, made from background jobs rather than from request handlers. PAYMENT_PROVIDER picks
+# the implementation: "stripe" (needs the stripe package and STRIPE_API_KEY) or, by default, "stub" - a local stand-in
+# that records refunds in memory, for development and tests.
+#
+# Every call carries an idempotency key derived from the payment (refund_key), so a job retried after a timeout, run
+# twice after its lease expired, or a bulk refund overlapping a single one, refunds a payment once. A refund the
+# provider refuses for good raises PaymentDeclined, which fails the job without retries; any other exception is
+# transient and worth retrying. A payment is only flagged refunded, in the job's own commit, once the provider has
+# confirmed the refund; should the job fail instead, the payment's refund request is withdrawn.
+import os
+import threading
+import time
+
+try:
+    import stripe
+except ImportError:
+    stripe = None
+
+from .jobs import PermanentJobError, register_job
+from .sqlmodels import BookingPayment
+
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER') or "stub"
+STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
+STUB_PAYMENT_LATENCY = float(os.getenv('STUB_PAYMENT_LATENCY_MS') or 0) / 1000
+REFUND_CONCURRENCY = int(os.getenv('REFUND_CONCURRENCY') or 4)
+
+REFUND_JOB = "refund_payment"
+
+
+class PaymentDeclined(PermanentJobError):
+    pass
+
+
+def refund_key(booking_id, stripe_id):
+    return f"refund-{booking_id}-{stripe_id}"
+
+
+class StubPaymentProvider(object):
+    """
+    Refunds every payment except those in declined, after STUB_PAYMENT_LATENCY to stand in for the network.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refunds = {}           # idempotency key -> refund
+        self.declined = set()       # stripe ids to refuse
+
+    def refund(self, stripe_id, idempotency_key):
+        if STUB_PAYMENT_LATENCY:
+            time.sleep(STUB_PAYMENT_LATENCY)
+        if stripe_id in self.declined:
+            raise PaymentDeclined(f"Refund of {stripe_id} declined")
+        with self.lock:
+            refund = self.refunds.get(idempotency_key)
+            if refund is None:
+                refund = self.refunds[idempotency_key] = {
+                    "id": f"re_stub_{len(self.refunds) + 1}", "payment": stripe_id, "status": "succeeded"
+                }
+            return refund
+
+
+class StripePaymentProvider(object):
+
+    def __init__(self, api_key):
+        if stripe is None:
+            raise RuntimeError("PAYMENT_PROVIDER=stripe needs the stripe package installed")
+        self.api_key = api_key
+
+    def refund(self, stripe_id, idempotency_key):
+        target = {"payment_intent": stripe_id} if stripe_id.startswith("pi_") else {"charge": stripe_id}
+        try:
+            return stripe.Refund.create(api_key=self.api_key, idempotency_key=idempotency_key, **target)
+        except (stripe.error.CardError, stripe.error.InvalidRequestError) as error:
+            raise PaymentDeclined(str(error)) from error
+
+
+provider = None
+provider_lock = threading.Lock()
+
+
+def payment_provider():
+    global provider
+    with provider_lock:
+        if provider is None:
+            if PAYMENT_PROVIDER == "stripe":
+                provider = StripePaymentProvider(STRIPE_API_KEY)
+            else:
+                provider = StubPaymentProvider()
+        return provider
+
+
+# ------------------------------------------------
+#                      Jobs
+# ------------------------------------------------
+
+
+def withdraw_refund_request(db, payload):
+    payment = db.get(BookingPayment, (payload["booking_id"], payload["stripe_id"]))
+    if payment is not None:
+        payment.refund_requested = False
+        db.add(payment)
+
+
+@register_job(REFUND_JOB, concurrency=REFUND_CONCURRENCY, on_failure=withdraw_refund_request)
+def refund_payment(db, payload):
+    payment_provider().refund(
+        payload["stripe_id"], idempotency_key=refund_key(payload["booking_id"], payload["stripe_id"])
+    )
+    payment = db.get(BookingPayment, (payload["booking_id"], payload["stripe_id"]))
+    if payment is not None:
+        payment.refunded = True
+        db.add(payment)
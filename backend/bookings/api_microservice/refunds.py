@@ -0,0 +1,235 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################         Bulk Refunds          ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Refunding every payment of a cancelled flight at once. Creating a refund run selects the affected payments (by
+# stripe_id, skipping those already refunded or with a single refund requested) into refund_item rows with one INSERT ... SELECT per chunk of ids, and
+# queues a background job that works through them:
+#
+#   - Pending items are read in id order, REFUND_PAGE_SIZE at a time, and refunded concurrently: at most
+#     REFUND_RUN_CONCURRENCY provider calls in flight (each on a thread, the provider clients being blocking) and no
+#     more than REFUND_RATE_PER_SECOND started per second.
+#   - Outcomes are written back every REFUND_FLUSH_SIZE completions in one transaction: a single UPDATE flags the
+#     refunded booking_payment rows, an executemany UPDATE records each still pending item's refund id or error, the
+#     run's counters move on by the items actually updated, and the job's lease is extended. A run that finds its job
+#     claimed by another worker (its lease having run out under it) stops there and leaves the rest to that worker.
+#
+# A run is resumable and idempotent. Should the worker die, the job is claimed again and carries on with the items
+# still pending; an item whose refund went through but was not yet written back is refunded again under the same
+# idempotency key as before, which the provider answers with the original refund. Transient provider errors leave
+# their items pending and fail the job, so it is retried with backoff while the run shows "retrying"; once the job
+# has no attempts left the run is "failed". Declined refunds mark their items failed. Resuming a failed run, or a
+# done one with failed items, puts those items back in the queue and queues the job again.
+import asyncio
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import bindparam, insert, literal, select, tuple_, update
+
+from .jobs import enqueue, extend_lease, register_job
+from .payments import PaymentDeclined, payment_provider, refund_key
+from .sqlmodels import BookingPayment, RefundItem, RefundRun
+
+REFUND_RUN_CONCURRENCY = int(os.getenv('REFUND_RUN_CONCURRENCY') or 16)
+REFUND_RATE_PER_SECOND = float(os.getenv('REFUND_RATE_PER_SECOND') or 25)
+REFUND_PAGE_SIZE = int(os.getenv('REFUND_PAGE_SIZE') or 1000)
+REFUND_FLUSH_SIZE = int(os.getenv('REFUND_FLUSH_SIZE') or 100)
+SELECT_CHUNK_SIZE = 1000
+
+REFUND_RUN_JOB = "process_refund_run"
+
+
+# ------------------------------------------------
+#                     Runs
+# ------------------------------------------------
+
+
+def start_refund_run(db, stripe_ids, reason=None):
+    """
+    Creates a run over the payments with the given stripe ids that are neither refunded nor waiting on a requested
+    refund, and queues its job. The caller commits.
+    """
+    run = RefundRun(reason=reason)
+    db.add(run)
+    db.flush()
+
+    stripe_ids = sorted(set(stripe_ids))
+    for start in range(0, len(stripe_ids), SELECT_CHUNK_SIZE):
+        db.execute(insert(RefundItem.__table__).from_select(
+            ["run_id", "booking_id", "stripe_id", "status"],
+            select(literal(run.id), BookingPayment.booking_id, BookingPayment.stripe_id, literal("pending"))
+            .where(BookingPayment.stripe_id.in_(stripe_ids[start:start + SELECT_CHUNK_SIZE]),
+                   BookingPayment.refunded.is_(False), BookingPayment.refund_requested.is_(False))
+        ))
+    run.requested = db.query(RefundItem).filter(RefundItem.run_id == run.id).count()
+    if run.requested:
+        enqueue(db, REFUND_RUN_JOB, {"run_id": run.id})
+    else:
+        run.status = "done"
+        run.finished_at = datetime.datetime.utcnow()
+    db.add(run)
+    return run
+
+
+def resume_refund_run(db, run):
+    """
+    Puts the run's failed items back in the queue and queues its job again. The caller commits.
+    :return: the number of items queued again
+    """
+    retried = db.execute(
+        update(RefundItem.__table__)
+        .where(RefundItem.run_id == run.id, RefundItem.status == "failed")
+        .values(status="pending", error=None)
+    ).rowcount
+    run.failed -= retried
+    run.status = "queued"
+    run.finished_at = None
+    db.add(run)
+    enqueue(db, REFUND_RUN_JOB, {"run_id": run.id})
+    return retried
+
+
+# ------------------------------------------------
+#                  Processing
+# ------------------------------------------------
+
+
+class RateLimiter(object):
+    """
+    Spaces acquisitions 1 / rate seconds apart. Used from one event loop, so it needs no lock.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next = 0.0
+
+    async def acquire(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next)
+        self.next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def refund_items(items, provider, executor, limiter, concurrency):
+    """
+    Refunds items (id, booking_id, stripe_id) concurrently, yielding each outcome as it completes:
+    (item id, booking id, stripe id, refund id or None, error or None, transient).
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def refund(item_id, booking_id, stripe_id):
+        async with slots:
+            await limiter.acquire()
+            try:
+                result = await loop.run_in_executor(
+                    executor, provider.refund, stripe_id, refund_key(booking_id, stripe_id)
+                )
+            except PaymentDeclined as error:
+                return item_id, booking_id, stripe_id, None, str(error), False
+            except Exception as error:
+                return item_id, booking_id, stripe_id, None, repr(error), True
+            return item_id, booking_id, stripe_id, result["id"], None, False
+
+    for outcome in asyncio.as_completed([refund(*item) for item in items]):
+        yield await outcome
+
+
+def write_outcomes(db, run_id, outcomes):
+    refunded = [(booking_id, stripe_id) for _, booking_id, stripe_id, refund_id, _, _ in outcomes if refund_id]
+    if refunded:
+        db.execute(
+            update(BookingPayment.__table__)
+            .where(tuple_(BookingPayment.booking_id, BookingPayment.stripe_id).in_(refunded))
+            .values(refunded=True)
+        )
+
+    # Only pending items are updated, and counted, so outcomes written twice for one item count once.
+    counts = {}
+    for new_status in ("refunded", "failed"):
+        items = [
+            {"item_id": item_id, "new_refund_id": refund_id, "new_error": error}
+            for item_id, _, _, refund_id, error, transient in outcomes
+            if not transient and bool(refund_id) == (new_status == "refunded")
+        ]
+        counts[new_status] = db.execute(
+            update(RefundItem.__table__)
+            .where(RefundItem.id == bindparam("item_id"), RefundItem.status == "pending")
+            .values(status=new_status, refund_id=bindparam("new_refund_id"), error=bindparam("new_error")),
+            items
+        ).rowcount if items else 0
+    if counts["refunded"] or counts["failed"]:
+        db.execute(
+            update(RefundRun.__table__)
+            .where(RefundRun.id == run_id)
+            .values(refunded=RefundRun.refunded + counts["refunded"], failed=RefundRun.failed + counts["failed"])
+        )
+    extend_lease(db)
+    db.commit()
+
+
+async def process_refund_run(db, run_id, provider=None):
+    """
+    Works through the run's pending items.
+    :return: the number of items left pending by transient errors
+    """
+    provider = provider or payment_provider()
+    limiter = RateLimiter(REFUND_RATE_PER_SECOND)
+    transient = 0
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=REFUND_RUN_CONCURRENCY, thread_name_prefix="refund") as executor:
+        while True:
+            items = db.execute(
+                select(RefundItem.id, RefundItem.booking_id, RefundItem.stripe_id)
+                .where(RefundItem.run_id == run_id, RefundItem.status == "pending", RefundItem.id > last_id)
+                .order_by(RefundItem.id)
+                .limit(REFUND_PAGE_SIZE)
+            ).all()
+            if not items:
+                break
+            last_id = items[-1][0]
+
+            outcomes = []
+            async for outcome in refund_items(items, provider, executor, limiter, REFUND_RUN_CONCURRENCY):
+                transient += outcome[5]
+                outcomes.append(outcome)
+                if len(outcomes) >= REFUND_FLUSH_SIZE:
+                    write_outcomes(db, run_id, outcomes)
+                    outcomes = []
+            write_outcomes(db, run_id, outcomes)
+    return transient
+
+
+def fail_refund_run(db, payload):
+    db.execute(
+        update(RefundRun.__table__)
+        .where(RefundRun.id == payload["run_id"])
+        .values(status="failed", finished_at=datetime.datetime.utcnow())
+    )
+
+
+def resumable(run):
+    return run.status == "failed" or (run.status == "done" and run.failed > 0)
+
+
+@register_job(REFUND_RUN_JOB, concurrency=1, on_failure=fail_refund_run)
+def run_refund_job(db, payload):
+    run_id = payload["run_id"]
+    db.execute(update(RefundRun.__table__).where(RefundRun.id == run_id).values(status="running"))
+    db.commit()
+
+    transient = asyncio.run(process_refund_run(db, run_id))
+    if transient:
+        db.execute(update(RefundRun.__table__).where(RefundRun.id == run_id).values(status="retrying"))
+        db.commit()
+        raise RuntimeError(f"{transient} refunds hit transient errors and are left pending for the retry")
+
+    db.execute(
+        update(RefundRun.__table__)
+        .where(RefundRun.id == run_id)
+        .values(status="done", finished_at=datetime.datetime.utcnow())
+    )
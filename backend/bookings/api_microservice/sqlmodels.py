@@ -1,6 +1,7 @@
 from typing import Optional, List
 import datetime
 
+from sqlalchemy import Column, Text
 from sqlmodel import Field, SQLModel, Relationship
 
 
@@ -20,10 +21,11 @@ class BookingBase(SQLModel):
 
 class Booking(BookingBase, table=True):
     id: Optional[int] = Field(primary_key=True)
+    confirmation_code: str = Field(index=True, sa_column_kwargs={"unique": True})
 
 
 class BookingCreate(BookingBase):
-    pass
+    confirmation_code: Optional[str] = None
 
 
 class BookingRead(BookingBase):
@@ -35,6 +37,17 @@ class BookingUpdate(SQLModel):
     confirmation_code: Optional[str] = None
 
 
+# ------------------------------------------------
+#            Confirmation Code Blocks
+# ------------------------------------------------
+
+
+class ConfirmationCodeBlock(SQLModel, table=True):
+    __tablename__ = "confirmation_code_block"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    allocated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, nullable=False)
+
+
 # ------------------------------------------------
 #                 Booking Guest
 # ------------------------------------------------
@@ -71,6 +84,7 @@ class BookingPayment(SQLModel, table=True):
     booking_id: Optional[int] = Field(foreign_key="booking.id", primary_key=True)
     stripe_id: str = Field(primary_key=True)
     refunded: bool = Field(default=False)
+    refund_requested: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"})
 
     booking: Booking = Relationship(back_populates="payment")
 
@@ -89,6 +103,46 @@ class BookingPaymentUpdate(SQLModel):
     refunded: Optional[bool] = None
 
 
+# ------------------------------------------------
+#                  Refund Runs
+# ------------------------------------------------
+
+
+class RefundRunCreate(SQLModel):
+    stripe_ids: List[str]
+    reason: Optional[str] = None
+
+
+class RefundRunBase(SQLModel):
+    status: str = Field(default="queued", max_length=16)
+    reason: Optional[str] = None
+    requested: int = Field(default=0)
+    refunded: int = Field(default=0)
+    failed: int = Field(default=0)
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    finished_at: Optional[datetime.datetime] = None
+
+
+class RefundRun(RefundRunBase, table=True):
+    __tablename__ = "refund_run"
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+
+class RefundRunRead(RefundRunBase):
+    id: int
+
+
+class RefundItem(SQLModel, table=True):
+    __tablename__ = "refund_item"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: int = Field(foreign_key="refund_run.id", index=True)
+    booking_id: int
+    stripe_id: str
+    status: str = Field(default="pending", index=True, max_length=16)
+    refund_id: Optional[str] = None
+    error: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+
 # ------------------------------------------------
 #                  Passenger
 # ------------------------------------------------
@@ -124,3 +178,76 @@ class PassengerUpdate(SQLModel):
     dob: Optional[datetime.date] = None
     gender: Optional[str] = None
     address: Optional[str] = None
+
+
+class PassengerMatchRead(PassengerRead):
+    similarity: float
+
+
+# ------------------------------------------------
+#              Passenger Name Trigrams
+# ------------------------------------------------
+
+
+class PassengerTrigram(SQLModel, table=True):
+    __tablename__ = "passenger_trigram"
+    trigram: str = Field(primary_key=True, max_length=3)
+    passenger_id: int = Field(primary_key=True, index=True)
+
+
+class PassengerTrigramFrequency(SQLModel, table=True):
+    __tablename__ = "passenger_trigram_frequency"
+    trigram: str = Field(primary_key=True, max_length=3)
+    passengers: int = Field(nullable=False)
+
+
+# ------------------------------------------------
+#                Background Jobs
+# ------------------------------------------------
+
+
+class JobBase(SQLModel):
+    kind: str = Field(index=True, max_length=64)
+    status: str = Field(default="queued", index=True, max_length=16)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=8)
+    run_after: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    finished_at: Optional[datetime.datetime] = None
+
+
+class Job(JobBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    payload: str = Field(default="{}", sa_column=Column(Text, nullable=False))
+    locked_by: Optional[str] = Field(default=None, max_length=64)
+    locked_until: Optional[datetime.datetime] = None
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+
+class JobRead(JobBase):
+    id: int
+    payload: str
+    last_error: Optional[str] = None
+
+
+# ------------------------------------------------
+#                 Outbox Events
+# ------------------------------------------------
+
+
+class OutboxEventBase(SQLModel):
+    entity: str = Field(index=True, max_length=64)
+    entity_id: str = Field(max_length=64)
+    action: str = Field(max_length=16)
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
+
+
+class OutboxEvent(OutboxEventBase, table=True):
+    __tablename__ = "bookings_outbox_event"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    payload: str = Field(default="{}", sa_column=Column(Text, nullable=False))
+
+
+class OutboxEventRead(OutboxEventBase):
+    id: int
+    payload: dict
@@ -1,14 +1,20 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import hashlib
+import re
+import time
 
 import pytest
 
 from .sqlmodels import (
-    Booking, BookingGuest, BookingPayment, Passenger
+    Booking, BookingGuest, BookingPayment, ConfirmationCodeBlock, Job, Passenger, PassengerRead,
+    PassengerTrigramFrequency, RefundItem
 )
 from .main import app, get_session
+from . import admission, confcodes, idempotency, jobs, main, notifications, outbox, payments, refunds, trigrams
 
 from fastapi.testclient import TestClient
 
+from sqlalchemy import insert, update
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
@@ -66,6 +72,47 @@ def test_health_check(client: TestClient):
     assert response.json() == {"msg": "Healthy"}
 
 
+def test_metrics(client: TestClient):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in response.text
+
+
+def test_admission_sheds_lower_priorities_first(client: TestClient):
+    controller = admission.admission_controller
+    controller.in_flight = controller.capacity("low")
+    try:
+        response = client.get("/api/v2/bookings/")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert response.json() == {"detail": "Service overloaded, retry later"}
+
+        assert client.get("/health").status_code == 200
+        assert client.post("/api/v2/bookings/", json={"is_active": True}).status_code == 200
+
+        controller.in_flight = controller.capacity("critical")
+        assert client.post("/api/v2/bookings/", json={"is_active": True}).status_code == 503
+    finally:
+        controller.in_flight = 0
+
+
+def test_admission_client_buckets():
+    controller = admission.AdmissionController(limit=10, rate=1, burst=2)
+    for _ in range(2):
+        assert controller.admit("critical", "client", now=0) is None
+        controller.release()
+    assert controller.admit("critical", "client", now=0) == (429, 1, "Too many requests from this client")
+    assert controller.admit("critical", "other", now=0) is None
+    assert controller.admit("critical", "client", now=1) is None
+
+    assert admission.classify("GET", "/api/v2/bookings/") == "low"
+    assert admission.classify("GET", "/api/v2/passengers/search") == "low"
+    assert admission.classify("GET", "/api/v2/bookings/7") == "normal"
+    assert admission.classify("POST", "/api/v2/booking_payments/") == "critical"
+    assert admission.classify("POST", "/api/v2/passengers/search/reindex") == "low"
+
+
 # ------------------------------------------------
 #                     Empty DB
 # ------------------------------------------------
@@ -81,8 +128,123 @@ def test_health_check(client: TestClient):
 # --------------------  Create  ------------------
 
 
+def test_booking_create_generates_code(client: TestClient):
+    codes = set()
+    for _ in range(3):
+        response = client.post("/api/v2/bookings/", json={"is_active": True})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["id"] is not None
+        assert re.fullmatch(r"[0-9A-HJKMNP-TV-Z]{6}", data["confirmation_code"])
+        codes.add(data["confirmation_code"])
+    assert len(codes) == 3
+
+
+def test_booking_create_with_taken_code(client: TestClient):
+    response = client.post("/api/v2/bookings/", json={"confirmation_code": "ABC-123"})
+    assert response.status_code == 200
+    assert response.json()["confirmation_code"] == "ABC-123"
+
+    response = client.post("/api/v2/bookings/", json={"confirmation_code": "ABC-123"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "A booking with that confirmation code already exists"}
+
+
+def test_booking_codes_of_the_generated_shape_are_reserved(client: TestClient, session: Session):
+    code = confcodes.encode(confcodes.permute(0))
+    for reserved in (code, code.lower()):
+        response = client.post("/api/v2/bookings/", json={"confirmation_code": reserved})
+        assert response.status_code == 400
+    assert client.post("/api/v2/bookings/", json={}).status_code == 200
+
+    booking_id = client.post("/api/v2/bookings/", json={"confirmation_code": "ABC-123"}).json()["id"]
+    response = client.patch(f"/api/v2/bookings/{booking_id}", json={"confirmation_code": "ZZZZZZ"})
+    assert response.status_code == 400
+    generated = client.post("/api/v2/bookings/", json={}).json()
+    response = client.patch(f"/api/v2/bookings/{booking_id}", json={"confirmation_code": "ABC-123"})
+    assert response.status_code == 200
+    response = client.patch(f"/api/v2/bookings/{generated['id']}", json={"confirmation_code": "ABC-123"})
+    assert response.status_code == 400
+
+
+def test_generated_code_skips_a_code_already_stored(client: TestClient, session: Session, monkeypatch):
+    # A code of the generated shape stored before codes were generated, then handed out by the allocator.
+    session.add(Booking(confirmation_code="ABC123"))
+    session.commit()
+    codes = iter(["ABC123", "ABC124"])
+    for module in (confcodes, main):
+        monkeypatch.setattr(module, "next_confirmation_code", lambda db: next(codes))
+
+    response = client.post("/api/v2/bookings/", json={})
+    assert response.status_code == 200
+    assert response.json()["confirmation_code"] == "ABC124"
 
 
+def test_booking_create_retried_with_idempotency_key(client: TestClient, session: Session):
+    headers = {"Idempotency-Key": "create-booking-1"}
+
+    first = client.post("/api/v2/bookings/", json={"is_active": True}, headers=headers)
+    retry = client.post("/api/v2/bookings/", json={"is_active": True}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert session.query(Booking).count() == 1
+
+    # Another caller's key of the same name is a different key.
+    other = client.post(
+        "/api/v2/bookings/", json={"is_active": True}, headers=dict(headers, Authorization="Bearer other")
+    )
+    assert other.json()["id"] != first.json()["id"]
+
+
+def test_idempotency_key_in_flight(client: TestClient):
+    key = hashlib.sha256(b"").hexdigest() + ":create-booking-2"
+    idempotency.idempotency_store.reserve(key, "in flight")
+    try:
+        response = client.post("/api/v2/bookings/", json={}, headers={"Idempotency-Key": "create-booking-2"})
+        assert response.status_code == 422
+
+        idempotency.idempotency_store.release(key)
+        response = client.post("/api/v2/bookings/", json={}, headers={"Idempotency-Key": "create-booking-2"})
+        assert response.status_code == 200
+        idempotency.idempotency_store.entries[key][1].pop("status")
+        response = client.post("/api/v2/bookings/", json={}, headers={"Idempotency-Key": "create-booking-2"})
+        assert response.status_code == 409
+        assert response.json() == {"detail": "A request with this Idempotency-Key is still in progress"}
+    finally:
+        idempotency.idempotency_store.release(key)
+
+
+def test_idempotency_store_bounds():
+    store = idempotency.MemoryStore(maxsize=2)
+    for key in ("a", "b", "c"):
+        assert store.reserve(key, key) is None
+        store.complete(key, {"fingerprint": key, "status": 200, "headers": [], "body": ""})
+    assert store.get("a") is None
+    assert store.get("c")["status"] == 200
+
+    store.put("b", store.get("b"), 0)
+    assert store.get("b") is None
+
+
+def test_confirmation_codes_never_collide(session: Session):
+    allocator = confcodes.ConfirmationCodeAllocator(block_size=64)
+    engine = session.get_bind()
+    codes = [allocator.next_code(engine) for _ in range(1000)]
+
+    assert len(set(codes)) == 1000
+    assert session.query(ConfirmationCodeBlock).count() == 16      # ceil(1000 / 64)
+    # Another worker claims its own blocks.
+    other = confcodes.ConfirmationCodeAllocator(block_size=64)
+    assert not set(codes) & {other.next_code(engine) for _ in range(100)}
+
+
+def test_confirmation_code_permutation():
+    numbers = range(0, 1 << 30, 4099)
+    assert len({confcodes.permute(number) for number in numbers}) == len(numbers)
+    assert confcodes.encode(0) == "000000"
+    assert confcodes.encode((1 << 30) - 1) == "ZZZZZZ"
+
 
 # --------------------   Read   ------------------
 
@@ -109,6 +271,20 @@ def test_health_check(client: TestClient):
 # --------------------  Create  ------------------
 
 
+def test_booking_guest_create_queues_confirmation(client: TestClient, session: Session):
+    booking = client.post("/api/v2/bookings/", json={"is_active": True}).json()
+    response = client.post("/api/v2/booking_guests/", json={
+        "booking_id": booking["id"], "contact_email": "guest@test.com", "contact_phone": "555-123-4567"
+    })
+    assert response.status_code == 200
+    assert response.json()["contact_email"] == "guest@test.com"
+    assert [job.kind for job in session.query(Job)] == ["send_booking_confirmation"]
+
+    jobs.work_once(session.get_bind(), "test-worker")
+    assert session.query(Job).one().status == "done"
+    message = notifications.outbox[-1]
+    assert message["To"] == "guest@test.com"
+    assert booking["confirmation_code"] in message["Subject"]
 
 
 
@@ -149,6 +325,54 @@ def test_health_check(client: TestClient):
 # --------------------  Update  ------------------
 
 
+def test_booking_payment_refund_runs_in_background(client: TestClient, session: Session):
+    client.post("/api/v2/bookings/", json={"is_active": True})
+    client.post("/api/v2/booking_payments/", json={"booking_id": 1, "stripe_id": "pi_refund_1"})
+
+    response = client.patch("/api/v2/booking_payments/1", json={"refunded": True})
+    assert response.status_code == 200
+    assert (response.json()["refunded"], response.json()["refund_requested"]) == (False, True)
+    response = client.patch("/api/v2/booking_payments/1", json={"refunded": True})
+    assert session.query(Job).count() == 1
+
+    assert jobs.work_once(session.get_bind(), "test-worker") == 1
+    assert jobs.work_once(session.get_bind(), "test-worker") is None
+    refunds = payments.payment_provider().refunds
+    assert refunds["refund-1-pi_refund_1"]["payment"] == "pi_refund_1"
+    session.expire_all()
+    assert session.query(BookingPayment).one().refunded is True
+
+    response = client.get("/api/v2/jobs/", params={"kind": "refund_payment"})
+    assert response.status_code == 200
+    assert [(job["status"], job["attempts"]) for job in response.json()] == [("done", 1)]
+    assert client.get("/api/v2/jobs/", params={"limit": 101}).status_code == 422
+
+
+def test_refund_run_includes_payments_written_outside_the_orm(client: TestClient, session: Session):
+    session.add(Booking(id=1, confirmation_code="ABC-123"))
+    session.commit()
+    session.execute(insert(BookingPayment.__table__).values(booking_id=1, stripe_id="ch_loaded_1", refunded=False))
+    session.commit()
+
+    response = client.post("/api/v2/refund_runs/", json={"stripe_ids": ["ch_loaded_1"]})
+    assert response.json()["requested"] == 1
+
+
+def test_declined_refund_fails_without_retries(client: TestClient, session: Session, monkeypatch):
+    monkeypatch.setattr(payments, "provider", payments.StubPaymentProvider())
+    client.post("/api/v2/bookings/", json={"is_active": True})
+    client.post("/api/v2/booking_payments/", json={"booking_id": 1, "stripe_id": "pi_declined_1"})
+    payments.payment_provider().declined.add("pi_declined_1")
+
+    client.patch("/api/v2/booking_payments/1", json={"refunded": True})
+    assert jobs.work_once(session.get_bind(), "test-worker") == 1
+
+    session.expire_all()
+    job = session.query(Job).one()
+    assert (job.status, job.attempts) == ("failed", 1)
+    assert "PaymentDeclined" in job.last_error
+    payment = session.query(BookingPayment).one()
+    assert (payment.refunded, payment.refund_requested) == (False, False)
 
 
 
@@ -158,6 +382,148 @@ def test_health_check(client: TestClient):
 
 
 
+# ------------------------------------------------
+#                   Refund Runs
+# ------------------------------------------------
+
+
+def create_paid_bookings(client, stripe_ids):
+    for stripe_id in stripe_ids:
+        booking = client.post("/api/v2/bookings/", json={"is_active": True}).json()
+        client.post("/api/v2/booking_payments/", json={"booking_id": booking["id"], "stripe_id": stripe_id})
+
+
+def test_refund_run(client: TestClient, session: Session):
+    stripe_ids = [f"ch_cancelled_{n}" for n in range(5)]
+    create_paid_bookings(client, stripe_ids)
+    client.patch("/api/v2/booking_payments/5", json={"refunded": True})
+    provider = payments.payment_provider()
+    provider.declined.add("ch_cancelled_1")
+
+    response = client.post("/api/v2/refund_runs/", json={"stripe_ids": stripe_ids + ["ch_unknown"]})
+    assert response.status_code == 202
+    assert (response.json()["requested"], response.json()["status"]) == (4, "queued")
+
+    engine = session.get_bind()
+    while jobs.work_once(engine, "test-worker"):
+        pass
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("done", 3, 1)
+    refunded = {payment.stripe_id for payment in session.query(BookingPayment).filter(BookingPayment.refunded)}
+    assert refunded == {"ch_cancelled_0", "ch_cancelled_2", "ch_cancelled_3", "ch_cancelled_4"}
+    assert session.query(RefundItem).filter(RefundItem.status == "failed").one().stripe_id == "ch_cancelled_1"
+
+    provider.declined.discard("ch_cancelled_1")
+    response = client.post("/api/v2/refund_runs/1/resume")
+    assert (response.status_code, response.json()["status"]) == (202, "queued")
+    while jobs.work_once(engine, "test-worker"):
+        pass
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("done", 4, 0)
+    assert client.post("/api/v2/refund_runs/1/resume").status_code == 400
+
+
+def test_refund_run_resumes_after_transient_errors(client: TestClient, session: Session, monkeypatch):
+    class FlakyProvider(payments.StubPaymentProvider):
+        calls = 0
+
+        def refund(self, stripe_id, idempotency_key):
+            self.calls += 1
+            if stripe_id == "ch_flaky_2" and self.calls <= 10:
+                raise ConnectionError("provider timed out")
+            return super().refund(stripe_id, idempotency_key)
+
+    provider = FlakyProvider()
+    monkeypatch.setattr(payments, "provider", provider)
+    monkeypatch.setattr(refunds, "REFUND_FLUSH_SIZE", 2)
+    monkeypatch.setattr(refunds, "REFUND_RATE_PER_SECOND", 200)
+    stripe_ids = [f"ch_flaky_{n}" for n in range(10)]
+    create_paid_bookings(client, stripe_ids)
+    client.post("/api/v2/refund_runs/", json={"stripe_ids": stripe_ids})
+
+    engine = session.get_bind()
+    started = time.perf_counter()
+    jobs.work_once(engine, "test-worker")
+    # Ten calls at 200 a second.
+    assert time.perf_counter() - started >= 9 / 200
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("retrying", 9, 0)
+    assert client.post("/api/v2/refund_runs/1/resume").status_code == 400
+    session.expire_all()
+    assert session.query(Job).filter(Job.kind == "process_refund_run").one().status == "queued"
+
+    jobs.work_once(engine, "test-worker", now=datetime.utcnow() + timedelta(hours=2))
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("done", 10, 0)
+    assert provider.calls == 11
+    assert len(provider.refunds) == 10
+
+
+def test_refund_run_stops_once_another_worker_holds_its_job(client: TestClient, session: Session, monkeypatch):
+    engine = session.get_bind()
+
+    class SlowProvider(payments.StubPaymentProvider):
+        def refund(self, stripe_id, idempotency_key):
+            if not self.refunds:
+                # The lease ran out under this worker and another one claimed the job.
+                with Session(engine) as db:
+                    db.execute(update(Job.__table__).values(locked_by="worker-b", attempts=Job.attempts + 1))
+                    db.commit()
+            return super().refund(stripe_id, idempotency_key)
+
+    monkeypatch.setattr(payments, "provider", SlowProvider())
+    monkeypatch.setattr(refunds, "REFUND_FLUSH_SIZE", 2)
+    monkeypatch.setattr(refunds, "REFUND_RUN_CONCURRENCY", 1)
+    stripe_ids = [f"ch_slow_{n}" for n in range(4)]
+    create_paid_bookings(client, stripe_ids)
+    client.post("/api/v2/refund_runs/", json={"stripe_ids": stripe_ids})
+
+    assert jobs.work_once(engine, "worker-a") == 1
+    session.expire_all()
+    job = session.query(Job).one()
+    assert (job.status, job.locked_by) == ("running", "worker-b")
+    assert session.query(RefundItem).filter(RefundItem.status == "pending").count() == 4
+
+    # Outcomes written twice, as by two workers, update and count each item once.
+    outcomes = [(1, 1, "ch_slow_0", "re_1", None, False), (2, 2, "ch_slow_1", None, "declined", False)]
+    refunds.write_outcomes(session, 1, outcomes)
+    refunds.write_outcomes(session, 1, outcomes)
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["refunded"], run["failed"]) == (1, 1)
+
+
+def test_refund_run_fails_with_its_job_and_resumes(client: TestClient, session: Session, monkeypatch):
+    class DownProvider(payments.StubPaymentProvider):
+        down = True
+
+        def refund(self, stripe_id, idempotency_key):
+            if stripe_id == "ch_down_1" and self.down:
+                raise ConnectionError("provider unreachable")
+            return super().refund(stripe_id, idempotency_key)
+
+    provider = DownProvider()
+    monkeypatch.setattr(payments, "provider", provider)
+    create_paid_bookings(client, ["ch_down_0", "ch_down_1"])
+    client.post("/api/v2/refund_runs/", json={"stripe_ids": ["ch_down_0", "ch_down_1"]})
+    session.query(Job).update({"max_attempts": 1})
+    session.commit()
+
+    engine = session.get_bind()
+    jobs.work_once(engine, "test-worker")
+    session.expire_all()
+    assert session.query(Job).one().status == "failed"
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("failed", 1, 0)
+
+    provider.down = False
+    response = client.post("/api/v2/refund_runs/1/resume")
+    assert (response.status_code, response.json()["status"]) == (202, "queued")
+    while jobs.work_once(engine, "test-worker"):
+        pass
+    run = client.get("/api/v2/refund_runs/1").json()
+    assert (run["status"], run["refunded"], run["failed"]) == ("done", 2, 0)
+
+
 # ------------------------------------------------
 #                     Passenger
 # ------------------------------------------------
@@ -171,6 +537,151 @@ def test_health_check(client: TestClient):
 # --------------------   Read   ------------------
 
 
+def test_passengers_read(client: TestClient, session: Session):
+    session.add(Booking(id=1, confirmation_code="ABC123"))
+    session.add_all([
+        Passenger(booking_id=1, given_name="Ada", family_name="Lovelace", dob=date(1815, 12, 10), gender="F",
+                  address="12 St James's Square"),
+        Passenger(booking_id=1, given_name="Charles", family_name="Babbage", dob=date(1791, 12, 26), gender="M",
+                  address="1 Dorset Street"),
+    ])
+    session.commit()
+
+    response = client.get("/api/v2/passengers/?limit=1&skip=1")
+    assert response.status_code == 200
+    # Same fields, order and date format as the PassengerRead response model.
+    assert response.json() == [{
+        "booking_id": 1, "given_name": "Charles", "family_name": "Babbage", "dob": "1791-12-26", "gender": "M",
+        "address": "1 Dorset Street", "id": 2
+    }]
+    assert list(response.json()[0]) == list(PassengerRead.__fields__)
+
+
+def test_passengers_read_empty(client: TestClient):
+    response = client.get("/api/v2/passengers/")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "No passengers found"}
+
+
+def search_names(client: TestClient, name):
+    response = client.get("/api/v2/passengers/search", params={"name": name})
+    assert response.status_code == 200
+    return [(passenger["given_name"], passenger["family_name"]) for passenger in response.json()]
+
+
+def test_passenger_name_search(client: TestClient, session: Session):
+    session.add_all([Booking(id=booking_id, confirmation_code=f"CODE{booking_id}") for booking_id in (1, 2, 3)])
+    session.add_all([
+        Passenger(booking_id=1, given_name="Ada", family_name="Lovelace", dob=date(1815, 12, 10), gender="F",
+                  address="12 St James's Square"),
+        Passenger(booking_id=2, given_name="Charles", family_name="Babbage", dob=date(1791, 12, 26), gender="M",
+                  address="1 Dorset Street"),
+    ])
+    session.commit()
+
+    response = client.post("/api/v2/passengers/search/reindex")
+    assert response.json() == {"passengers": 2}
+
+    client.post("/api/v2/passengers/", json={
+        "booking_id": 3, "given_name": "José", "family_name": "Núñez", "dob": "1990-01-01", "gender": "M",
+        "address": "Calle Mayor 1"
+    })
+
+    response = client.get("/api/v2/passengers/search", params={"name": "lovelase"})
+    assert response.json()[0]["family_name"] == "Lovelace"
+    assert 0.5 <= response.json()[0]["similarity"] < 1
+    assert search_names(client, "ada lovelace") == [("Ada", "Lovelace")]
+    assert search_names(client, "jose nunez") == [("José", "Núñez")]
+    assert search_names(client, "Babage") == [("Charles", "Babbage")]
+    assert search_names(client, "zzz") == []
+    assert search_names(client, "!!") == []
+
+
+def add_passengers(client: TestClient, session: Session, *names):
+    session.add_all([Booking(id=booking_id, confirmation_code=f"CODE{booking_id}")
+                     for booking_id in range(1, len(names) + 1)])
+    session.commit()
+    for booking_id, (given_name, family_name) in enumerate(names, 1):
+        client.post("/api/v2/passengers/", json={
+            "booking_id": booking_id, "given_name": given_name, "family_name": family_name, "dob": "1815-12-10",
+            "gender": "F", "address": "12 St James's Square"
+        })
+
+
+def test_passenger_reindex_keeps_answering_searches(client: TestClient, session: Session, monkeypatch):
+    add_passengers(client, session, ("Ada", "Lovelace"), ("Charles", "Babbage"), ("Mary", "Somerville"))
+    monkeypatch.setattr(trigrams, "REINDEX_BATCH_SIZE", 1)
+
+    # Midway through the first batch, passengers of later batches are still found, and one is renamed by its handler.
+    seen = []
+    name_trigrams = trigrams.name_trigrams
+    def searching_name_trigrams(given_name, family_name):
+        if not seen:
+            seen.append(None)
+            seen[0] = search_names(client, "babbage")
+            client.patch("/api/v2/passengers/3", json={"family_name": "Fairfax"})
+        return name_trigrams(given_name, family_name)
+    monkeypatch.setattr(trigrams, "name_trigrams", searching_name_trigrams)
+
+    assert client.post("/api/v2/passengers/search/reindex").json() == {"passengers": 3}
+    monkeypatch.setattr(trigrams, "name_trigrams", name_trigrams)
+    assert seen == [[("Charles", "Babbage")]]
+    assert search_names(client, "fairfax") == [("Mary", "Fairfax")]
+    assert search_names(client, "somerville") == []
+
+
+def test_passenger_search_finds_every_match_past_the_candidate_limit(client: TestClient, session: Session,
+                                                                     monkeypatch):
+    add_passengers(client, session, ("Ada", "Lovelace"), ("Ada", "Lovelace King"), ("Ada", "Byron"))
+    monkeypatch.setattr(trigrams, "SEARCH_CANDIDATE_LIMIT", 1)
+
+    # No frequencies yet: the probed lists are arbitrary ones, holding all three passengers.
+    assert search_names(client, "ada lovelace") == [("Ada", "Lovelace"), ("Ada", "Lovelace King")]
+
+    trigrams.prime_trigram_frequencies(session.get_bind())
+    session.expire_all()
+    assert session.query(PassengerTrigramFrequency).count() > 0
+    assert search_names(client, "ada lovelace") == [("Ada", "Lovelace"), ("Ada", "Lovelace King")]
+
+
+def test_passenger_search_keeps_the_best_candidates_past_the_candidate_limit(session: Session, monkeypatch):
+    session.add(Booking(id=1, confirmation_code="CODE1"))
+    for family_name in ("Byron", "Lovelace Byron", "Lovelace"):
+        passenger = Passenger(booking_id=1, given_name="Ada", family_name=family_name, dob=date(1815, 12, 10),
+                              gender="F", address="12 St James's Square")
+        session.add(passenger)
+        trigrams.index_passenger(session, passenger)
+    session.commit()
+    monkeypatch.setattr(trigrams, "SEARCH_CANDIDATE_LIMIT", 1)
+    monkeypatch.setattr(trigrams, "SEARCH_CANDIDATES_PER_RESULT", 2)
+
+    # Ada Byron shares the fewest trigrams with the query and is left out, though her id comes first.
+    matches = trigrams.search_passengers(session, "ada lovelace", threshold=0.1, limit=1)
+    assert [match["family_name"] for match in matches] == ["Lovelace"]
+
+
+def test_passenger_search_follows_updates(client: TestClient, session: Session):
+    session.add_all([Booking(id=booking_id, confirmation_code=f"CODE{booking_id}") for booking_id in (1, 2)])
+    session.commit()
+    client.post("/api/v2/passengers/", json={
+        "booking_id": 1, "given_name": "Ada", "family_name": "Lovelace", "dob": "1815-12-10", "gender": "F",
+        "address": "12 St James's Square"
+    })
+    client.post("/api/v2/passengers/", json={
+        "booking_id": 2, "given_name": "Charles", "family_name": "Babbage", "dob": "1791-12-26", "gender": "M",
+        "address": "1 Dorset Street"
+    })
+
+    response = client.patch("/api/v2/passengers/1", json={"family_name": "Byron"})
+    assert response.status_code == 200
+    assert response.json()["family_name"] == "Byron"
+    assert search_names(client, "lovelace") == []
+    assert search_names(client, "byron") == [("Ada", "Byron")]
+
+    client.delete("/api/v2/passengers/2")
+    assert search_names(client, "babbage") == []
+
+
 
 
 
@@ -183,3 +694,69 @@ def test_health_check(client: TestClient):
 # --------------------  Delete  ------------------
 
 
+# ------------------------------------------------
+#                 Background Jobs
+# ------------------------------------------------
+
+
+def test_job_retries_with_backoff_then_fails(client: TestClient, session: Session):
+    calls = []
+
+    @jobs.register_job("test_flaky")
+    def flaky(db, payload):
+        calls.append(payload)
+        raise ConnectionError("provider timed out")
+
+    engine = session.get_bind()
+    jobs.enqueue(session, "test_flaky", {"n": 1}, max_attempts=2)
+    session.commit()
+
+    now = datetime.utcnow()
+    assert jobs.work_once(engine, "test-worker", now=now) == 1
+    job = session.query(Job).one()
+    assert (job.status, job.attempts) == ("queued", 1)
+    assert "provider timed out" in job.last_error
+    assert job.run_after > now
+    # Not due yet.
+    assert jobs.work_once(engine, "test-worker", now=now) is None
+
+    assert jobs.work_once(engine, "test-worker", now=job.run_after) == 1
+    session.expire_all()
+    assert session.query(Job).one().status == "failed"
+    assert calls == [{"n": 1}, {"n": 1}]
+
+    assert client.post("/api/v2/jobs/1/retry").json()["status"] == "queued"
+    assert client.post("/api/v2/jobs/1/retry").status_code == 400
+
+
+def test_job_concurrency_limit_and_expired_leases(session: Session):
+    jobs.register_job("test_single", concurrency=1)(lambda db, payload: None)
+    engine = session.get_bind()
+    for n in range(2):
+        jobs.enqueue(session, "test_single", {"n": n})
+    session.commit()
+
+    now = datetime.utcnow()
+    first = jobs.claim(engine, "worker-a", now=now)
+    assert first is not None
+    # One is running, so the other must wait, however many workers ask.
+    assert jobs.claim(engine, "worker-b", now=now) is None
+
+    # worker-a died; once its lease is up either job may be claimed again.
+    later = now + timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+    assert jobs.claim(engine, "worker-b", now=later) is not None
+    assert jobs.claim(engine, "worker-c", now=later) is None
+
+
+# ------------------------------------------------
+#                 Change Events
+# ------------------------------------------------
+
+
+def test_events_stay_in_this_services_table_and_relay_waits_for_subscribers(client: TestClient, session: Session):
+    client.post("/api/v2/bookings/", json={"is_active": True})
+    assert outbox.OutboxEvent.__tablename__ == "bookings_outbox_event"
+    assert [event["entity"] for event in client.get("/api/v2/events/").json()] == ["booking"]
+
+    # Nothing in this service subscribes, so no relay thread polls the table.
+    assert outbox.start_relay(session.get_bind()) is None
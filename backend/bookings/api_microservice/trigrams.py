@@ -0,0 +1,223 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################     Passenger Name Search     ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Fuzzy passenger lookup by name, tolerant of typos and of accents dropped or kept. Every passenger's given and family
+# names are broken into trigrams (each word padded as "  word ", so word starts weigh in) stored in passenger_trigram,
+# an inverted index kept up to date by the passenger handlers in their own transactions.
+#
+# A passenger's similarity to a query is the share of the query's trigrams found in the passenger's name. Reaching a
+# similarity t over a query of n trigrams takes m = ceil(t * n) shared trigrams, so every match shares at least one of
+# any n - m + 1 query trigrams. The search therefore reads the posting lists of just the n - m + 1 rarest query
+# trigrams to collect candidates (passenger_trigram_frequency holds the list lengths), then scores the candidates
+# exactly. Common trigrams, whose lists run to millions of rows, are not read - unless those rarest lists still hold
+# more than SEARCH_CANDIDATE_LIMIT passengers, in which case the candidates are instead the passengers sharing at least
+# m of all the query trigrams. The database counts the shared trigrams - the numerator of the score - so it can rank
+# them too: just the best SEARCH_CANDIDATES_PER_RESULT per requested result are kept, which no result can miss beyond
+# ties in shared trigrams at the cut, settled by passenger id rather than by the finer tie-break.
+#
+# The frequencies only steer which lists are read - stale ones make a search slower, never wrong - so they are
+# recomputed by reindex_passengers() rather than on every write, and at startup while the table is empty. Reindex
+# after loading passengers around the API; searches keep being answered from the old rows while it runs.
+import math
+import os
+import re
+import unicodedata
+
+from sqlalchemy import delete, func, insert, select
+from sqlmodel import Session
+
+from .fastjson import project_rows
+from .sqlmodels import Passenger, PassengerRead, PassengerTrigram, PassengerTrigramFrequency
+from .warmup import register_warmup
+
+SEARCH_THRESHOLD = float(os.getenv('PASSENGER_SEARCH_THRESHOLD') or 0.5)
+SEARCH_CANDIDATE_LIMIT = int(os.getenv('PASSENGER_SEARCH_CANDIDATE_LIMIT') or 2000)
+SEARCH_CANDIDATES_PER_RESULT = int(os.getenv('PASSENGER_SEARCH_CANDIDATES_PER_RESULT') or 50)
+REINDEX_BATCH_SIZE = int(os.getenv('PASSENGER_REINDEX_BATCH_SIZE') or 10000)
+
+SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    text = text or ""
+    if not text.isascii():
+        text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return SEPARATORS.sub(" ", text).lower()
+
+
+def trigrams(text):
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def name_trigrams(given_name, family_name):
+    return trigrams(f"{given_name} {family_name}")
+
+
+def similarity(query_grams, grams):
+    """
+    :return: (share of the query trigrams in grams, Jaccard similarity) - the second breaks ties in favour of names
+             without much besides the query
+    """
+    shared = len(query_grams & grams)
+    return shared / len(query_grams), shared / len(query_grams | grams)
+
+
+# ------------------------------------------------
+#                  Maintenance
+# ------------------------------------------------
+
+
+def index_passenger(db, passenger):
+    """
+    Replaces the passenger's trigram rows; flushes first so a new passenger has its id. The caller commits.
+    """
+    db.flush()
+    db.execute(delete(PassengerTrigram.__table__).where(PassengerTrigram.passenger_id == passenger.id))
+    rows = [
+        {"trigram": gram, "passenger_id": passenger.id}
+        for gram in name_trigrams(passenger.given_name, passenger.family_name)
+    ]
+    if rows:
+        db.execute(insert(PassengerTrigram.__table__), rows)
+
+
+def unindex_passenger(db, passenger_id):
+    db.execute(delete(PassengerTrigram.__table__).where(PassengerTrigram.passenger_id == passenger_id))
+
+
+def reindex_passengers(db):
+    """
+    Rebuilds passenger_trigram in passenger id order, REINDEX_BATCH_SIZE passengers per transaction, then recounts the
+    trigram frequencies. Each transaction replaces the rows of one id range - deleting them before reading the names,
+    so a passenger handler indexing a passenger of the range either commits first or waits for the batch - and
+    searches see every passenger indexed throughout.
+    :return: number of passengers indexed
+    """
+    table = PassengerTrigram.__table__
+    indexed = 0
+    last_id = 0
+    while True:
+        upper = db.execute(
+            select(Passenger.id).where(Passenger.id > last_id).order_by(Passenger.id)
+            .offset(REINDEX_BATCH_SIZE - 1).limit(1)
+        ).scalar()
+        in_range = [PassengerTrigram.passenger_id > last_id]
+        if upper is not None:
+            in_range.append(PassengerTrigram.passenger_id <= upper)
+        db.execute(delete(table).where(*in_range))
+
+        statement = select(Passenger.id, Passenger.given_name, Passenger.family_name) \
+            .where(Passenger.id > last_id) \
+            .order_by(Passenger.id)
+        if upper is not None:
+            statement = statement.where(Passenger.id <= upper)
+        batch = db.execute(statement).all()
+
+        rows = [
+            {"trigram": gram, "passenger_id": passenger_id}
+            for passenger_id, given_name, family_name in batch
+            for gram in name_trigrams(given_name, family_name)
+        ]
+        if rows:
+            db.execute(insert(table), rows)
+        db.commit()
+        indexed += len(batch)
+        if upper is None:
+            break
+        last_id = upper
+
+    recount_frequencies(db)
+    return indexed
+
+
+def recount_frequencies(db):
+    db.execute(delete(PassengerTrigramFrequency.__table__))
+    db.execute(
+        insert(PassengerTrigramFrequency.__table__).from_select(
+            ["trigram", "passengers"],
+            select(PassengerTrigram.trigram, func.count()).group_by(PassengerTrigram.trigram)
+        )
+    )
+    db.commit()
+
+
+@register_warmup
+def prime_trigram_frequencies(engine):
+    # Without frequencies every trigram looks equally rare and searches probe arbitrary, possibly huge, lists.
+    with Session(engine) as db:
+        if db.execute(select(PassengerTrigramFrequency.trigram).limit(1)).first() is None  \
+                and db.execute(select(PassengerTrigram.trigram).limit(1)).first() is not None:
+            recount_frequencies(db)
+
+
+# ------------------------------------------------
+#                     Search
+# ------------------------------------------------
+
+
+def search_passengers(db, query, threshold=SEARCH_THRESHOLD, limit=20):
+    """
+    :return: passengers shaped like PassengerMatchRead, most similar first
+    """
+    query_grams = trigrams(query)
+    if not query_grams:
+        return []
+
+    required = max(1, math.ceil(threshold * len(query_grams) - 1e-9))
+    frequencies = dict(db.execute(
+        select(PassengerTrigramFrequency.trigram, PassengerTrigramFrequency.passengers)
+        .where(PassengerTrigramFrequency.trigram.in_(query_grams))
+    ).all())
+    # Trigrams missing from the frequency table were first seen after the last recount, so they are rare.
+    probe = sorted(query_grams, key=lambda gram: (frequencies.get(gram, 0), gram))[:len(query_grams) - required + 1]
+
+    candidate_ids = db.execute(
+        select(PassengerTrigram.passenger_id)
+        .where(PassengerTrigram.trigram.in_(probe))
+        .group_by(PassengerTrigram.passenger_id)
+        .limit(SEARCH_CANDIDATE_LIMIT + 1)
+    ).scalars().all()
+    if len(candidate_ids) > SEARCH_CANDIDATE_LIMIT:
+        # Too many to score one by one: let the database count each passenger's shared trigrams over every query
+        # trigram and keep the passengers with the most of them, enough of them being needed.
+        candidate_ids = db.execute(
+            select(PassengerTrigram.passenger_id)
+            .where(PassengerTrigram.trigram.in_(sorted(query_grams)))
+            .group_by(PassengerTrigram.passenger_id)
+            .having(func.count() >= required)
+            .order_by(func.count().desc(), PassengerTrigram.passenger_id)
+            .limit(limit * SEARCH_CANDIDATES_PER_RESULT)
+        ).scalars().all()
+    if not candidate_ids:
+        return []
+
+    scored = []
+    names = db.execute(
+        select(Passenger.id, Passenger.given_name, Passenger.family_name).where(Passenger.id.in_(candidate_ids))
+    )
+    for passenger_id, given_name, family_name in names:
+        score, tie_break = similarity(query_grams, name_trigrams(given_name, family_name))
+        if score >= threshold:
+            scored.append((-score, -tie_break, passenger_id))
+    scored.sort()
+    scored = scored[:limit]
+    if not scored:
+        return []
+
+    passengers = {
+        passenger["id"]: passenger
+        for passenger in project_rows(
+            db, Passenger, PassengerRead, Passenger.id.in_([passenger_id for _, _, passenger_id in scored]),
+            limit=len(scored)
+        )
+    }
+    return [
+        dict(passengers[passenger_id], similarity=round(-score, 4))
+        for score, _, passenger_id in scored if passenger_id in passengers
+    ]
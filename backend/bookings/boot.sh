@@ -51,4 +51,18 @@ export DB_ACCESS_URI="$DB_ACCESS_URI"
 echo " └─ DB_ACCESS_URI value exported."
 echo ""
 
+echo ""
+echo "Launching the service..."
+# SERVER_MODE=production runs gunicorn with one uvicorn worker per core available to the container, as configured in
+# gunicorn_conf.py; SERVER_MODE=worker runs the background job worker instead of the API; any other value keeps the
+# single-process development server.
+if [ "$SERVER_MODE" = "worker" ]; then
+  echo " └─ worker mode: background job worker."
+  exec python -m api_microservice.worker
+fi
+if [ "$SERVER_MODE" = "production" ]; then
+  echo " └─ production mode: gunicorn with uvicorn workers."
+  exec gunicorn api_microservice.main:app --config gunicorn_conf.py
+fi
+echo " └─ development mode: single uvicorn process."
 exec uvicorn api_microservice.main:app
\ No newline at end of file
@@ -0,0 +1,37 @@
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+
+# ------------------------------------------------
+#                  Table Mirrors
+# ------------------------------------------------
+# Column-for-column copies of the flights service's Airport and Route tables, which this service bulk-loads.
+
+
+class Airport(SQLModel, table=True):
+    iata_id: str = Field(nullable=False, primary_key=True)
+    city: str = Field(nullable=False)
+    name: str
+    longitude: float = Field(nullable=False)
+    latitude: float = Field(nullable=False)
+    elevation: int
+
+
+class Route(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    origin_id: str = Field(nullable=False, foreign_key="airport.iata_id")
+    destination_id: str = Field(nullable=False, foreign_key="airport.iata_id")
+    duration: Optional[float] = Field(nullable=False)
+
+
+# ------------------------------------------------
+#                  Load Requests
+# ------------------------------------------------
+
+
+class LoadRequest(SQLModel):
+    path: str
+    chunk_size: int = 5000
+    checkpoint: Optional[str] = None
+    use_load_data: bool = False
@@ -0,0 +1,151 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, select
+
+from . import main
+from .loader import load_airports, load_routes
+from .sqlmodels import Airport, Route
+
+client = TestClient(main.app)
+
+
+# ------------------------------------------------
+#                    Test Data
+# ------------------------------------------------
+
+airports_dat = [
+    '1,"John F Kennedy International Airport","New York","United States","JFK","KJFK",40.63980103,-73.77890015,13,-5,"A","America/New_York","airport","OurAirports"',
+    '2,"Los Angeles International Airport","Los Angeles","United States","LAX","KLAX",33.94250107,-118.4079971,125,-8,"A","America/Los_Angeles","airport","OurAirports"',
+    '3,"Cleveland Hopkins International Airport","Cleveland","United States","CLE","KCLE",41.4117012024,-81.8498001099,791,-5,"A","America/New_York","airport","OurAirports"',
+    '4,"No Code Field","Nowhere","United States",\\N,"XXXX",10.0,10.0,0,0,"A","\\N","airport","OurAirports"',
+    '5,"Bad Latitude","Nowhere","United States","BAD","XXXX",123.0,10.0,0,0,"A","\\N","airport","OurAirports"',
+    '6,"Duplicate JFK","New York","United States","JFK","KJFK",40.6,-73.7,13,-5,"A","America/New_York","airport","OurAirports"',
+]
+
+routes_dat = [
+    'AA,24,JFK,3797,LAX,3484,,0,738',
+    'DL,2009,JFK,3797,LAX,3484,,0,321',
+    'AA,24,LAX,3484,JFK,3797,,0,738',
+    'UA,5209,CLE,3486,JFK,3797,,0,E75',
+    'UA,5209,CLE,3486,ZZZ,9999,,0,E75',
+    'UA,5209,CLE,3486,CLE,3486,,0,E75',
+]
+
+
+# ------------------------------------------------
+#          Pytest Fixture: Loader Engine
+# ------------------------------------------------
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'loaded.db'}")
+
+
+def write_dataset(path, lines):
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+# ------------------------------------------------
+#                Generic Routes
+# ------------------------------------------------
+
+
+def test_presence():
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.json() == {"msg": "Data loader microservice is present and ready for action."}
+
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json() == {"msg": "Healthy"}
+
+
+def test_missing_dataset():
+    response = client.post("/api/v2/load/airports", json={"path": "/nonexistent/airports.dat"})
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Dataset file not found"}
+
+
+# ------------------------------------------------
+#                    Airports
+# ------------------------------------------------
+
+
+def test_airport_load(engine, tmp_path):
+    report = load_airports(engine, write_dataset(tmp_path / "airports.dat", airports_dat), chunk_size=2)
+
+    assert report["read"] == 6
+    assert report["loaded"] == 3
+    assert report["rejected"] == 3
+
+    with Session(engine) as session:
+        jfk = session.get(Airport, "JFK")
+        assert jfk.city == "New York, United States"
+        assert jfk.latitude == pytest.approx(40.63980103)
+        assert jfk.elevation == 13
+
+
+def test_airport_load_json_lines(engine, tmp_path):
+    path = tmp_path / "airports.jsonl"
+    path.write_text(json.dumps({
+        "iata_id": "JFK", "city": "New York, NY", "name": "John F. Kennedy International",
+        "latitude": 40.6398, "longitude": -73.7789, "elevation": 13
+    }) + "\n")
+
+    report = load_airports(engine, str(path))
+    assert report["loaded"] == 1
+
+
+def test_airport_load_resumes_from_checkpoint(engine, tmp_path):
+    dataset = tmp_path / "airports.dat"
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    first = load_airports(engine, write_dataset(dataset, airports_dat[:2]), chunk_size=1, checkpoint=checkpoint)
+    assert first["loaded"] == 2
+
+    # The dataset grows (or the previous run died) - only the unread tail is processed on the next run.
+    write_dataset(dataset, airports_dat)
+    second = load_airports(engine, str(dataset), chunk_size=1, checkpoint=checkpoint)
+    assert second["resumed_from"] == first["offset"]
+    assert second["read"] == 4
+    assert second["loaded"] == 1
+
+    third = load_airports(engine, str(dataset), chunk_size=1, checkpoint=checkpoint)
+    assert third["read"] == 0
+
+
+# ------------------------------------------------
+#                     Routes
+# ------------------------------------------------
+
+
+def test_route_load(engine, tmp_path):
+    load_airports(engine, write_dataset(tmp_path / "airports.dat", airports_dat))
+    report = load_routes(engine, write_dataset(tmp_path / "routes.dat", routes_dat), chunk_size=4)
+
+    assert report["read"] == 6
+    assert report["loaded"] == 3
+
+    with Session(engine) as session:
+        routes = session.exec(select(Route).order_by(Route.id)).all()
+        assert [(route.origin_id, route.destination_id) for route in routes] == [
+            ("JFK", "LAX"), ("LAX", "JFK"), ("CLE", "JFK")
+        ]
+        # JFK to LAX is roughly 2,470 miles, just under five hours at 500 mph.
+        assert routes[0].duration == pytest.approx(4.95, abs=0.05)
+        assert routes[0].duration == pytest.approx(routes[1].duration)
+
+
+def test_route_load_skips_existing_pairs(engine, tmp_path):
+    load_airports(engine, write_dataset(tmp_path / "airports.dat", airports_dat))
+    routes = write_dataset(tmp_path / "routes.dat", routes_dat)
+
+    load_routes(engine, routes)
+    report = load_routes(engine, routes)
+    assert report["loaded"] == 0
@@ -0,0 +1 @@
+# File empty, but necessary to treat api_microservice as a module
@@ -0,0 +1,277 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Row Generators         ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Every generator is a pure function of (seed, id range), so any chunk can be produced by any worker process, in any
+# order, and come out byte-for-byte identical. Foreign keys are never looked up, they are recomputed: an airport's
+# coordinates or an airplane's type are themselves pure functions of the seed and the row id.
+import datetime
+import math
+import random
+import string
+from itertools import product
+
+import names
+
+AIRPLANE_TYPES = [188, 215, 247, 274, 300, 380, 515]
+USER_ROLES = ["admin", "agent", "user"]
+
+STATES = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME",
+    "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA",
+    "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
+]
+CITY_SUFFIXES = ["", "ton", "ville", " City", "burg", " Falls", " Springs", "field", "port", " Heights"]
+AIRPORT_KINDS = ["International Airport", "Regional Airport", "Municipal Airport", "Airfield", "Field"]
+STREET_KINDS = ["St", "Ave", "Blvd", "Rd", "Ln", "Dr", "Ct", "Way"]
+
+AVERAGE_SPEED_MPH = 500
+EARTH_RADIUS_MILES = 3958.8
+GOLDEN_RATIO_MIX = 2654435761
+
+IATA_CODES = ["".join(letters) for letters in product(string.ascii_uppercase, repeat=3)]
+
+
+# ------------------------------------------------
+#                  Name Sampling
+# ------------------------------------------------
+
+
+def _load_names(path):
+    """
+    Reads one of the census frequency files bundled with the names package. names.get_full_name() re-reads and scans
+    the file on every call, which is far too slow for millions of rows, so the lists are loaded once per process and
+    sampled with random.choices() against the cumulative frequencies instead.
+    """
+    values, weights = [], []
+    with open(path) as census:
+        for line in census:
+            name, _, cumulative, _ = line.split()
+            values.append(name.capitalize())
+            weights.append(float(cumulative))
+    return values, weights
+
+
+_name_lists = {}
+
+
+def _names(kind):
+    if kind not in _name_lists:
+        _name_lists[kind] = _load_names(names.FILES[kind])
+    return _name_lists[kind]
+
+
+def sample_names(rng, kind, count):
+    values, weights = _names(kind)
+    return rng.choices(values, cum_weights=weights, k=count)
+
+
+# ------------------------------------------------
+#                     Helpers
+# ------------------------------------------------
+
+
+def chunk_rng(seed, table, start):
+    return random.Random(f"{seed}:{table}:{start}")
+
+
+def mix(seed, value):
+    return ((value ^ seed) * GOLDEN_RATIO_MIX) & 0xFFFFFFFF
+
+
+def iata_code(seed, index):
+    """Maps airport index 0..17575 onto a seed-dependent permutation of the 3-letter codes."""
+    count = len(IATA_CODES)
+    # 7919 is prime and so coprime with 26^3, which makes the stride a bijection over the code space.
+    return IATA_CODES[(index * 7919 + seed) % count]
+
+
+def airplane_type_id(seed, airplane_id):
+    return mix(seed, airplane_id) % len(AIRPLANE_TYPES) + 1
+
+
+def route_endpoints(seed, route_index, airport_count):
+    """
+    Maps route index 0..n*(n-1)-1 to a distinct (origin, destination) index pair. The index is first scattered with a
+    multiplicative bijection so consecutive route ids do not all leave from the same airport.
+    """
+    pair_count = airport_count * (airport_count - 1)
+    multiplier = 7919
+    while math.gcd(multiplier, pair_count) != 1:
+        multiplier += 2
+    scattered = (route_index * multiplier + seed) % pair_count
+
+    origin, offset = divmod(scattered, airport_count - 1)
+    destination = offset + 1 if offset >= origin else offset
+    return origin, destination
+
+
+def miles_between(origin, destination):
+    lat_1, lon_1 = math.radians(origin[0]), math.radians(origin[1])
+    lat_2, lon_2 = math.radians(destination[0]), math.radians(destination[1])
+    a = math.sin((lat_2 - lat_1) / 2) ** 2 + \
+        math.cos(lat_1) * math.cos(lat_2) * math.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def phone_number(rng):
+    return f"{rng.randint(201, 989)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"
+
+
+# ------------------------------------------------
+#               Reference Data Rows
+# ------------------------------------------------
+
+
+def user_role_rows():
+    return [{"id": index + 1, "name": name} for index, name in enumerate(USER_ROLES)]
+
+
+def airplane_type_rows():
+    return [{"id": index + 1, "max_capacity": capacity} for index, capacity in enumerate(AIRPLANE_TYPES)]
+
+
+def airport_row(seed, index):
+    rng = random.Random(f"{seed}:airport:{index}")
+    city = sample_names(rng, "last", 1)[0] + rng.choice(CITY_SUFFIXES)
+
+    return {
+        "iata_id": iata_code(seed, index),
+        "city": f"{city}, {rng.choice(STATES)}",
+        "name": f"{city} {rng.choice(AIRPORT_KINDS)}",
+        "longitude": round(rng.uniform(-124.7, -67.0), 6),
+        "latitude": round(rng.uniform(25.1, 49.3), 6),
+        "elevation": int(rng.triangular(0, 9000, 300))
+    }
+
+
+def airport_rows(seed, start, stop):
+    return [airport_row(seed, index) for index in range(start, stop)]
+
+
+# ------------------------------------------------
+#                Bulk Entity Rows
+# ------------------------------------------------
+
+
+def user_rows(seed, start, stop, password_hash):
+    rng = chunk_rng(seed, "user", start)
+    count = stop - start
+    given = sample_names(rng, "first:female", count // 2) + sample_names(rng, "first:male", count - count // 2)
+    rng.shuffle(given)
+    family = sample_names(rng, "last", count)
+
+    rows = []
+    for offset, user_id in enumerate(range(start + 1, stop + 1)):
+        handle = f"{given[offset].lower()}.{family[offset].lower()}.{user_id}"
+        rows.append({
+            "id": user_id,
+            "role_id": 3 if rng.random() < 0.98 else rng.randint(1, 2),
+            "given_name": given[offset],
+            "family_name": family[offset],
+            "username": handle,
+            "password": password_hash,
+            "email": f"{handle}@example.com",
+            "phone": phone_number(rng)
+        })
+    return rows
+
+
+def airplane_rows(seed, start, stop):
+    return [
+        {"id": airplane_id, "type_id": airplane_type_id(seed, airplane_id)}
+        for airplane_id in range(start + 1, stop + 1)
+    ]
+
+
+def route_rows(seed, start, stop, airports):
+    rows = []
+    for route_id in range(start + 1, stop + 1):
+        origin, destination = route_endpoints(seed, route_id - 1, len(airports))
+        origin, destination = airports[origin], airports[destination]
+        distance = miles_between(
+            (origin["latitude"], origin["longitude"]),
+            (destination["latitude"], destination["longitude"])
+        )
+        rows.append({
+            "id": route_id,
+            "origin_id": origin["iata_id"],
+            "destination_id": destination["iata_id"],
+            "duration": distance / AVERAGE_SPEED_MPH
+        })
+    return rows
+
+
+def flight_rows(seed, start, stop, route_count, airplane_count, start_date):
+    rng = chunk_rng(seed, "flight", start)
+    epoch = datetime.datetime.combine(start_date, datetime.time())
+
+    rows = []
+    for flight_id in range(start + 1, stop + 1):
+        airplane_id = rng.randint(1, airplane_count)
+        capacity = AIRPLANE_TYPES[airplane_type_id(seed, airplane_id) - 1]
+        departure = epoch + datetime.timedelta(minutes=5 * rng.randrange(365 * 24 * 12))
+        rows.append({
+            "id": flight_id,
+            "route_id": rng.randint(1, route_count),
+            "airplane_id": airplane_id,
+            "departure_time": str(departure),
+            "reserved_seats": int(capacity * rng.betavariate(5, 2)),
+            "seat_price": round(rng.lognormvariate(5.3, 0.4), 2)
+        })
+    return rows
+
+
+def confirmation_code(seed, booking_id):
+    alphabet = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    value = mix(seed, booking_id) << 32 | booking_id
+    code = []
+    while value:
+        value, digit = divmod(value, 32)
+        code.append(alphabet[digit])
+    return "".join(code)
+
+
+def booking_rows(seed, start, stop, max_passengers, start_date):
+    """
+    Produces a chunk of bookings together with their guest, payment and passenger rows. Children are generated
+    alongside their booking so the whole chunk can be committed as one unit without any cross-chunk lookups.
+    """
+    rng = chunk_rng(seed, "booking", start)
+    bookings, guests, payments, passengers = [], [], [], []
+
+    for booking_id in range(start + 1, stop + 1):
+        bookings.append({
+            "id": booking_id,
+            "is_active": rng.random() < 0.9,
+            "confirmation_code": confirmation_code(seed, booking_id)
+        })
+
+        party = rng.randint(1, max_passengers)
+        family = sample_names(rng, "last", 1)[0]
+        for _ in range(party):
+            gender = rng.choice(("F", "M"))
+            given = sample_names(rng, "first:female" if gender == "F" else "first:male", 1)[0]
+            passengers.append({
+                "booking_id": booking_id,
+                "given_name": given,
+                "family_name": family,
+                "dob": start_date - datetime.timedelta(days=rng.randint(365 * 2, 365 * 90)),
+                "gender": gender,
+                "address": f"{rng.randint(1, 9999)} {sample_names(rng, 'last', 1)[0]} {rng.choice(STREET_KINDS)}, "
+                           f"{rng.choice(STATES)}"
+            })
+
+        guests.append({
+            "booking_id": booking_id,
+            "contact_email": f"{family.lower()}.{booking_id}@example.com",
+            "contact_phone": phone_number(rng)
+        })
+        payments.append({
+            "booking_id": booking_id,
+            "stripe_id": f"ch_{mix(seed, booking_id):08x}{booking_id:012x}",
+            "refunded": rng.random() < 0.03
+        })
+
+    return bookings, guests, payments, passengers
@@ -0,0 +1,115 @@
+from typing import Optional
+import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+# ------------------------------------------------
+#                  Table Mirrors
+# ------------------------------------------------
+# The data producer writes straight into the tables owned by the users, flights and bookings services, so it keeps
+# column-for-column copies of their table models here (relationships are left out since nothing here navigates them).
+# Whichever of them starts first creates the tables, so the copies must match the owners exactly: the test suite
+# compares them.
+
+
+class UserRole(SQLModel, table=True):
+    __tablename__ = "user_role"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(nullable=False)
+
+
+class User(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    role_id: int = Field(nullable=False, foreign_key="user_role.id")
+    given_name: str
+    family_name: str
+    username: str = Field(nullable=False)
+    password: str = Field(nullable=False)
+    email: str = Field(nullable=False, index=True)
+    phone: str
+
+
+class Airport(SQLModel, table=True):
+    iata_id: str = Field(nullable=False, primary_key=True)
+    city: str = Field(nullable=False)
+    name: str
+    longitude: float = Field(nullable=False)
+    latitude: float = Field(nullable=False)
+    elevation: int
+
+
+class AirplaneType(SQLModel, table=True):
+    __tablename__ = "airplane_type"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    max_capacity: int = Field(nullable=False)
+
+
+class Airplane(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    type_id: int = Field(nullable=False, foreign_key="airplane_type.id")
+
+
+class Route(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    origin_id: str = Field(nullable=False, foreign_key="airport.iata_id")
+    destination_id: str = Field(nullable=False, foreign_key="airport.iata_id")
+    duration: Optional[float] = Field(nullable=False)
+
+
+class Flight(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    route_id: int = Field(foreign_key="route.id", nullable=False)
+    airplane_id: int = Field(foreign_key="airplane.id", nullable=False)
+    departure_time: str = Field(nullable=False)
+    reserved_seats: int = Field(nullable=False, default=0)
+    seat_price: float = Field(nullable=False, default=0.00)
+    price_dirty: int = Field(default=0, index=True, nullable=False, sa_column_kwargs={"server_default": "0"})
+
+
+class Booking(SQLModel, table=True):
+    id: Optional[int] = Field(primary_key=True)
+    is_active: bool = Field(default=True)
+    confirmation_code: str = Field(index=True, sa_column_kwargs={"unique": True})
+
+
+class BookingGuest(SQLModel, table=True):
+    booking_id: Optional[int] = Field(foreign_key="booking.id", primary_key=True)
+    contact_email: str = Field(primary_key=True)
+    contact_phone: str
+
+
+class BookingPayment(SQLModel, table=True):
+    booking_id: Optional[int] = Field(foreign_key="booking.id", primary_key=True)
+    stripe_id: str = Field(primary_key=True)
+    refunded: bool = Field(default=False)
+    refund_requested: bool = Field(default=False, nullable=False, sa_column_kwargs={"server_default": "0"})
+
+
+class Passenger(SQLModel, table=True):
+    id: Optional[int] = Field(primary_key=True)
+    booking_id: int = Field(foreign_key="booking.id")
+    given_name: str
+    family_name: str
+    dob: datetime.date
+    gender: str
+    address: str
+
+
+# ------------------------------------------------
+#                 Production Request
+# ------------------------------------------------
+
+
+class ProductionRequest(SQLModel):
+    seed: int = 0
+    start_date: Optional[datetime.date] = None
+    users: int = 10000
+    airports: int = 1000
+    airplanes: int = 2000
+    routes: int = 20000
+    flights: int = 1000000
+    bookings: int = 1000000
+    max_passengers_per_booking: int = 3
+    chunk_size: int = 10000
+    processes: Optional[int] = None
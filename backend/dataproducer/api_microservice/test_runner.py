@@ -0,0 +1,179 @@
+import datetime
+import io
+import json
+import pathlib
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine, select, func
+
+from . import generators, producer
+from .main import app
+from .producer import produce
+from .sqlmodels import (
+    Airport, Booking, BookingGuest, BookingPayment, Flight, Passenger, ProductionRequest, Route, User
+)
+
+client = TestClient(app)
+
+small_production = ProductionRequest(
+    seed=7,
+    start_date=datetime.date(2022, 6, 1),
+    users=50,
+    airports=20,
+    airplanes=10,
+    routes=60,
+    flights=200,
+    bookings=40,
+    chunk_size=16,
+    processes=1
+)
+
+
+# ------------------------------------------------
+#                Generic Routes
+# ------------------------------------------------
+
+
+def test_presence():
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.json() == {"msg": "Data producer microservice is present and ready for action."}
+
+
+def test_health_check():
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json() == {"msg": "Healthy"}
+
+
+# ------------------------------------------------
+#                   Generators
+# ------------------------------------------------
+
+
+def test_generators_are_deterministic():
+    first = generators.booking_rows(7, 0, 25, 3, datetime.date(2022, 6, 1))
+    second = generators.booking_rows(7, 0, 25, 3, datetime.date(2022, 6, 1))
+    assert first == second
+
+    other_seed = generators.booking_rows(8, 0, 25, 3, datetime.date(2022, 6, 1))
+    assert first != other_seed
+
+
+def test_route_endpoints_are_distinct_pairs():
+    pairs = {generators.route_endpoints(3, index, 12) for index in range(12 * 11)}
+    assert len(pairs) == 12 * 11
+    assert all(origin != destination for origin, destination in pairs)
+
+
+# ------------------------------------------------
+#                   Production
+# ------------------------------------------------
+
+
+def test_production_is_referentially_consistent(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'produced.db'}"
+    result = produce(db_uri, small_production)
+
+    assert result["rows"]["user"] == 50
+    assert result["rows"]["flight"] == 200
+    assert result["rows"]["bookingpayment"] == 40
+
+    with Session(create_engine(db_uri)) as session:
+        airports = set(session.exec(select(Airport.iata_id)).all())
+        assert len(airports) == 20
+
+        for origin, destination in session.exec(select(Route.origin_id, Route.destination_id)).all():
+            assert origin in airports and destination in airports
+
+        assert session.exec(select(func.max(Flight.route_id))).one() <= 60
+        assert session.exec(select(func.count(BookingGuest.booking_id))).one() == 40
+        assert session.exec(select(func.count(Booking.id))).one() == 40
+        assert session.exec(select(func.count(Passenger.id))).one() == result["rows"]["passenger"]
+        assert len(set(session.exec(select(User.username)).all())) == 50
+
+
+def test_production_is_repeatable(tmp_path):
+    first_uri = f"sqlite:///{tmp_path / 'first.db'}"
+    second_uri = f"sqlite:///{tmp_path / 'second.db'}"
+    produce(first_uri, small_production)
+    produce(second_uri, small_production)
+
+    def snapshot(db_uri):
+        with Session(create_engine(db_uri)) as session:
+            return (
+                session.exec(select(Flight).order_by(Flight.id)).all(),
+                session.exec(select(BookingPayment).order_by(BookingPayment.booking_id)).all()
+            )
+
+    assert snapshot(first_uri) == snapshot(second_uri)
+
+
+def test_production_rejects_impossible_routes(tmp_path):
+    production = small_production.copy(update={"airports": 3, "routes": 7})
+    try:
+        produce(f"sqlite:///{tmp_path / 'bad.db'}", production)
+    except ValueError as e:
+        assert "distinct routes" in str(e)
+    else:
+        assert False, "expected a ValueError"
+
+
+def test_production_rebuilds_read_side_tables(tmp_path, monkeypatch):
+    called = []
+
+    def fake_urlopen(request, timeout):
+        called.append((request.method, request.full_url))
+        return io.BytesIO(b'{"flights": 200}')
+
+    monkeypatch.setattr(producer, "urlopen", fake_urlopen)
+    monkeypatch.setenv("FLIGHTS_API", "http://flights:5000/api")
+    monkeypatch.delenv("BOOKINGS_API", raising=False)
+    result = produce(f"sqlite:///{tmp_path / 'rebuilt.db'}", small_production)
+
+    assert called == [("POST", "http://flights:5000/api/v2/flights/available/rebuild")]
+    assert result["rebuilt"] == {"http://flights:5000/api/v2/flights/available/rebuild": {"flights": 200}}
+
+
+# ------------------------------------------------
+#                  Table Mirrors
+# ------------------------------------------------
+
+
+DESCRIBE_TABLES = """
+import json
+from sqlmodel import SQLModel
+import api_microservice.sqlmodels
+
+print(json.dumps({
+    name: {
+        column.name: [
+            str(column.type), column.nullable, column.primary_key, bool(column.unique), bool(column.index),
+            None if column.server_default is None else str(column.server_default.arg),
+            sorted(key.target_fullname for key in column.foreign_keys)
+        ]
+        for column in table.columns
+    }
+    for name, table in SQLModel.metadata.tables.items()
+}))
+"""
+
+
+def describe_tables(service_dir):
+    output = subprocess.run(
+        [sys.executable, "-c", DESCRIBE_TABLES], cwd=service_dir, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def test_table_mirrors_match_the_owning_services():
+    backend = pathlib.Path(__file__).resolve().parents[2]
+    owned = {}
+    for service in ("users", "flights", "bookings"):
+        owned.update(describe_tables(backend / service))
+    mirrors = describe_tables(backend / "dataproducer")
+
+    for name in SQLModel.metadata.tables:
+        assert mirrors[name] == owned[name], name
@@ -0,0 +1,79 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Airport Indexes        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Base class for the in-memory airport lookups (nearby airports, autocomplete). Each keeps every airport row in memory
+# and an index built from them by its build() method. Airport writes in this process patch the rows and the index is
+# rebuilt from them on the next query. Writes handled by other workers arrive as outbox events, which invalidate() the
+# index so the next query reloads every row; the rows are also reloaded every AIRPORT_INDEX_MAX_AGE seconds, should an
+# event be missed.
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from .fastjson import read_columns
+from .sqlmodels import Airport, AirportRead
+
+AIRPORT_INDEX_MAX_AGE = float(os.getenv('AIRPORT_INDEX_MAX_AGE') or 300)
+
+
+def airport_row(airport):
+    return {name: getattr(airport, name) for name, _ in read_columns(Airport, AirportRead)}
+
+
+class AirportIndex(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.airports = {}
+        self.loaded_at = None
+        self.snapshot = None        # (airport rows, index), replaced as a whole so readers never need the lock
+
+    def build(self, rows):
+        raise NotImplementedError
+
+    def load(self, session):
+        columns = read_columns(Airport, AirportRead)
+        names = [name for name, _ in columns]
+        rows = session.execute(select(*[column for _, column in columns]))
+        airports = {row["iata_id"]: row for row in (dict(zip(names, values)) for values in rows)}
+        with self.lock:
+            self.airports = airports
+            self.loaded_at = time.monotonic()
+            self.snapshot = None
+
+    def put(self, airport, previous_iata_id=None):
+        row = airport_row(airport)
+        with self.lock:
+            if previous_iata_id is not None:
+                self.airports.pop(previous_iata_id, None)
+            self.airports[row["iata_id"]] = row
+            self.snapshot = None
+
+    def discard(self, iata_id):
+        with self.lock:
+            self.airports.pop(iata_id, None)
+            self.snapshot = None
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def current(self, session):
+        """
+        :return: (airport rows in IATA code order, index over them)
+        """
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > AIRPORT_INDEX_MAX_AGE:
+            self.load(session)
+
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    rows = sorted(self.airports.values(), key=lambda row: row["iata_id"])
+                    self.snapshot = (rows, self.build(rows))
+                snapshot = self.snapshot
+        return snapshot
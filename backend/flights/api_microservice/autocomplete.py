@@ -0,0 +1,117 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################     Airport Autocomplete      ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Type-ahead over airport IATA codes, cities and names. Every word of those fields is normalized (accents stripped,
+# lower-cased, split on anything not a letter or digit) into one sorted token list, so all tokens starting with a
+# prefix form a contiguous run found with two bisections. A query matches the airports that have, for each of its
+# words, a token starting with that word; they are ranked by which field matched (IATA code over city over name), with
+# a bonus for whole-word matches, then by IATA code.
+#
+# The index is built on warm-up and kept current with airport writes as described in airportindex.
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left
+
+from sqlmodel import Session
+
+from .airportindex import AirportIndex
+from .warmup import register_warmup
+
+FIELD_WEIGHTS = (("iata_id", 4.0), ("city", 2.0), ("name", 1.0))
+EXACT_BONUS = 0.5
+RESULT_CACHE_SIZE = 4096
+
+WORDS = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def words(text):
+    return WORDS.findall(normalize(text))
+
+
+class PrefixIndex(object):
+
+    def __init__(self, rows):
+        entries = sorted({
+            (token, position, weight)
+            for position, row in enumerate(rows)
+            for field, weight in FIELD_WEIGHTS
+            for token in words(row[field])
+        })
+        self.tokens = [token for token, _, _ in entries]
+        self.postings = [(position, weight) for _, position, weight in entries]
+        # Short and common prefixes match thousands of tokens but are also the most repeated queries. The index never
+        # changes once built, so their results are kept until it is replaced.
+        self.results = {}
+
+    def matches(self, prefix):
+        """
+        :return: {row position: best weight among its tokens starting with prefix}
+        """
+        best = {}
+        start = bisect_left(self.tokens, prefix)
+        end = bisect_left(self.tokens, prefix + "\U0010ffff", start)
+        exact_end = bisect_left(self.tokens, prefix + "\x00", start, end)
+        get = best.get
+        for index, (position, weight) in enumerate(self.postings[start:end], start):
+            if index < exact_end:
+                weight += EXACT_BONUS
+            if weight > get(position, 0.0):
+                best[position] = weight
+        return best
+
+    def search(self, query, limit):
+        """
+        :return: positions of the best matching rows, best first
+        """
+        key = (tuple(sorted(set(words(query)), key=len, reverse=True)), limit)
+        positions = self.results.get(key)
+        if positions is None:
+            positions = self.rank(key[0], limit)
+            if len(self.results) >= RESULT_CACHE_SIZE:
+                self.results.clear()
+            self.results[key] = positions
+        return positions
+
+    def rank(self, query_words, limit):
+        scores = None
+        # Longest words first: they match the fewest tokens and shrink the candidate set soonest.
+        for word in query_words:
+            found = self.matches(word)
+            if scores is None:
+                scores = found
+            else:
+                scores = {position: score + found[position] for position, score in scores.items() if position in found}
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [position for position, _ in ranked]
+
+
+class AirportAutocomplete(AirportIndex):
+
+    def build(self, rows):
+        return PrefixIndex(rows)
+
+    def complete(self, session, query, limit=10):
+        rows, index = self.current(session)
+        return [rows[position] for position in index.search(query, limit)]
+
+
+airport_autocomplete = AirportAutocomplete()
+
+
+@register_warmup
+def prime_airport_autocomplete(engine):
+    with Session(engine) as session:
+        airport_autocomplete.current(session)
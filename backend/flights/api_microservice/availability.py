@@ -0,0 +1,87 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################      Seat Availability        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# flight_availability keeps one row per flight with its capacity and seats remaining, so "flights with at least N free
+# seats" is a range scan of the seats_remaining index instead of a Flight -> Airplane -> AirplaneType join evaluated for
+# every flight. The rows are a projection of those three tables and are never written directly: the handlers that
+# change an input (reservations, the flight's airplane, an airplane's type, a type's capacity) call
+# refresh_availability() with a criterion selecting the affected flights, inside their own transaction, and the rows
+# are recomputed from the source tables. Handlers deleting a flight, an airplane or a type call remove_availability()
+# for the flights left without a capacity. rebuild_availability() recomputes everything, for data loaded around the API.
+from sqlalchemy import delete, insert, select
+from sqlmodel import Session
+
+from .sqlmodels import Airplane, AirplaneType, Flight, FlightAvailability
+from .warmup import register_warmup
+
+# Flight fields the projection is computed from.
+AVAILABILITY_INPUTS = {"reserved_seats", "airplane_id", "route_id", "departure_time"}
+
+
+def projected_flights(*criteria):
+    statement = select(
+        Flight.id,
+        Flight.route_id,
+        Flight.departure_time,
+        AirplaneType.max_capacity,
+        AirplaneType.max_capacity - Flight.reserved_seats
+    )   \
+        .join(Airplane, Flight.airplane_id == Airplane.id)  \
+        .join(AirplaneType, Airplane.type_id == AirplaneType.id)
+    return statement.where(*criteria) if criteria else statement
+
+
+def insert_projection(session, *criteria):
+    table = FlightAvailability.__table__
+    session.execute(
+        insert(table).from_select(
+            ["flight_id", "route_id", "departure_time", "capacity", "seats_remaining"],
+            projected_flights(*criteria)
+        )
+    )
+
+
+def refresh_availability(session, *criteria):
+    """
+    Recomputes the rows of the flights matching criteria (expressions over Flight and Airplane) as one DELETE and one
+    INSERT ... SELECT. Pending changes are flushed first so the SELECT sees them; the caller commits.
+    """
+    session.flush()
+    table = FlightAvailability.__table__
+    affected = select(Flight.id) \
+        .join(Airplane, Flight.airplane_id == Airplane.id)  \
+        .where(*criteria)
+    session.execute(delete(table).where(table.c.flight_id.in_(affected)))
+    insert_projection(session, *criteria)
+
+
+def remove_availability(session, *criteria):
+    """
+    Drops the rows of the flights matching criteria (expressions over Flight). Run it before deleting the rows the
+    criteria select by; the caller commits.
+    """
+    table = FlightAvailability.__table__
+    session.execute(delete(table).where(table.c.flight_id.in_(select(Flight.id).where(*criteria))))
+
+
+def rebuild_availability(session):
+    """
+    :return: number of flights projected
+    """
+    table = FlightAvailability.__table__
+    session.execute(delete(table))
+    insert_projection(session)
+    session.commit()
+    return session.query(FlightAvailability).count()
+
+
+@register_warmup
+def prime_availability(engine):
+    # A database created before the projection existed, or filled by the data loader, starts with an empty table.
+    with Session(engine) as session:
+        table = FlightAvailability.__table__
+        if session.execute(select(table.c.flight_id).limit(1)).first() is None  \
+                and session.execute(select(Flight.id).limit(1)).first() is not None:
+            rebuild_availability(session)
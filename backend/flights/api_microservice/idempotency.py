@@ -0,0 +1,262 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################         Idempotency           ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Safe retries for POST requests. A client that sends an Idempotency-Key header gets the response of the first request
+# made with that key for every retry made with it within IDEMPOTENCY_TTL seconds, replayed from a store without running
+# the endpoint again (so no duplicate-check SELECTs and no duplicate rows), marked with an Idempotent-Replayed header.
+#
+#   - Keys are scoped to the caller's Authorization header, so one client cannot replay another's responses.
+#   - The store keeps a fingerprint of the method, path, query string and body with each key. A retry whose request
+#     differs is refused with 422 instead of being answered with a response to some other request.
+#   - While the first request is still being handled its key is reserved, and a concurrent retry gets 409 rather than
+#     running the endpoint a second time. A reservation lapses after IDEMPOTENCY_LOCK_SECONDS should its worker die.
+#   - Server errors (5xx) and responses over IDEMPOTENCY_MAX_BODY bytes are not stored; their reservation is released
+#     so the retry runs the endpoint again.
+#
+# Each worker keeps up to IDEMPOTENCY_MAX_KEYS keys in memory, evicting the oldest first. Setting IDEMPOTENCY_REDIS_URL
+# (with the redis package installed) shares keys between workers and replicas; the in-memory store then caches the
+# finished responses in front of it. Requests without the header are passed straight through.
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL') or 24 * 60 * 60)
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv('IDEMPOTENCY_LOCK_SECONDS') or 60)
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS') or 10000)
+IDEMPOTENCY_MAX_BODY = int(os.getenv('IDEMPOTENCY_MAX_BODY') or 64 * 1024)
+IDEMPOTENCY_REDIS_URL = os.getenv('IDEMPOTENCY_REDIS_URL')
+
+IDEMPOTENT_METHODS = ("POST",)
+MAX_KEY_LENGTH = 255
+
+
+# ------------------------------------------------
+#                     Stores
+# ------------------------------------------------
+# A record is {"fingerprint": ...} while its request is in flight, and gains "status", "headers" (latin-1 decoded
+# [name, value] pairs) and "body" (base64) once the response is stored.
+
+
+class MemoryStore(object):
+
+    def __init__(self, maxsize=IDEMPOTENCY_MAX_KEYS):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.lookup(key)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, record = entry
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return None
+        return record
+
+    def put(self, key, record, ttl):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + ttl, record)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def reserve(self, key, fingerprint):
+        """
+        :return: None when the key was free and is now reserved, otherwise the record already held for it
+        """
+        with self.lock:
+            record = self.lookup(key)
+            if record is None:
+                self.put(key, {"fingerprint": fingerprint}, IDEMPOTENCY_LOCK_SECONDS)
+            return record
+
+    def complete(self, key, record):
+        with self.lock:
+            self.put(key, record, IDEMPOTENCY_TTL)
+
+    def release(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedStore(object):
+    """
+    Keys live in Redis, reserved with SET NX so one replica wins; finished records are also cached in memory.
+    """
+
+    def __init__(self, client, local):
+        self.client = client
+        self.local = local
+
+    @staticmethod
+    def name(key):
+        return "idempotency:" + key
+
+    def reserve(self, key, fingerprint):
+        record = self.local.get(key)
+        if record is not None:
+            return record
+
+        if self.client.set(self.name(key), json.dumps({"fingerprint": fingerprint}), nx=True,
+                           px=int(IDEMPOTENCY_LOCK_SECONDS * 1000)):
+            return None
+        stored = self.client.get(self.name(key))
+        if stored is None:
+            # Expired between the two calls; treat it as still in flight and let the client retry.
+            return {"fingerprint": fingerprint}
+        record = json.loads(stored)
+        if "status" in record:
+            self.local.complete(key, record)
+        return record
+
+    def complete(self, key, record):
+        self.client.set(self.name(key), json.dumps(record), px=int(IDEMPOTENCY_TTL * 1000))
+        self.local.complete(key, record)
+
+    def release(self, key):
+        self.client.delete(self.name(key))
+        self.local.release(key)
+
+    def clear(self):
+        self.local.clear()
+
+
+def make_store():
+    if IDEMPOTENCY_REDIS_URL and redis is not None:
+        return SharedStore(redis.Redis.from_url(IDEMPOTENCY_REDIS_URL), MemoryStore())
+    return MemoryStore()
+
+
+idempotency_store = make_store()
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+def error_record(status, detail):
+    body = json.dumps({"detail": detail}).encode()
+    return {
+        "status": status,
+        "headers": [["content-type", "application/json"], ["content-length", str(len(body))]],
+        "body": base64.b64encode(body).decode("ascii"),
+    }
+
+
+async def send_record(send, record, replayed=False):
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+    await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
+
+
+class IdempotencyMiddleware(object):
+    """
+    Pure ASGI middleware. It sits inside the compression middleware, so stored bodies are uncompressed and a replay
+    is encoded for whatever the retry accepts.
+    """
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store if store is not None else idempotency_store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await send_record(send, error_record(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"))
+            return
+
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(body)
+
+        caller = hashlib.sha256(headers.get(b"authorization", b"")).hexdigest()
+        key = caller + ":" + idempotency_key.decode("latin-1")
+        fingerprint = hashlib.sha256(b"\n".join(
+            (scope["method"].encode(), scope["path"].encode(), scope["query_string"], body)
+        )).hexdigest()
+
+        store = self.store
+        record = store.reserve(key, fingerprint)
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                await send_record(send, error_record(422, "Idempotency-Key was already used for a different request"))
+            elif "status" not in record:
+                await send_record(send, error_record(409, "A request with this Idempotency-Key is still in progress"))
+            else:
+                await send_record(send, record, replayed=True)
+            return
+
+        delivered = False
+
+        async def replay_body():
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        response = {"fingerprint": fingerprint, "status": None, "headers": [], "body": []}
+        size = 0
+
+        async def capture(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body" and response["body"] is not None:
+                size += len(message.get("body", b""))
+                if size > IDEMPOTENCY_MAX_BODY:
+                    response["body"] = None
+                else:
+                    response["body"].append(message.get("body", b""))
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, replay_body, capture)
+            if response["status"] is not None and response["status"] < 500 and response["body"] is not None:
+                response["body"] = base64.b64encode(b"".join(response["body"])).decode("ascii")
+                store.complete(key, response)
+                stored = True
+        finally:
+            if not stored:
+                store.release(key)
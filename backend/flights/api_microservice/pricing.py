@@ -0,0 +1,236 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Fare Repricing         ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Recomputes Flight.seat_price for every upcoming flight from two pricing curves:
+#
+#   price = (PRICING_BASE_FARE + PRICING_FARE_PER_HOUR * route duration)
+#           * load factor multiplier (reserved_seats / max_capacity of the plane's type)
+#           * days to departure multiplier
+#
+# Each curve is a set of breakpoints evaluated with linear interpolation. A pass reads the few columns it needs for all
+# upcoming flights in one joined SELECT (departure_time is stored in one sortable format, so the SQL can compare it), evaluates the curves over whole numpy arrays rather than flight by flight, and writes
+# back only the prices that moved by at least a cent, UPDATE_BATCH_SIZE flights per UPDATE ... SET seat_price = CASE
+# WHEN id = ... statement. (An executemany of single-row UPDATEs is not batched by the MySQL driver: it would still be one
+# round trip per flight.)
+#
+# create_flight and update_flight mark flights whose price inputs changed as dirty by bumping Flight.price_dirty in
+# their own transaction, so the mark is shared by every worker and survives restarts; an incremental pass reprices just
+# the marked flights. A pass clears each mark it read with a conditional UPDATE on the count it saw, so a flight changed
+# again while the pass ran stays marked for the next one. The column defaults to 0 in the schema as well, so rows
+# written outside the ORM can be marked too; a NULL left by an older schema counts as 0.
+#
+# One pass runs at a time across all workers: a pass holds the single repricing_lock row for up to
+# REPRICE_LOCK_SECONDS, claimed with a conditional UPDATE, so a worker that dies mid-pass frees it when the lease runs
+# out.
+import datetime
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import bindparam, case, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .sqlmodels import Airplane, AirplaneType, Flight, RepricingLock, Route, departure_string
+
+PRICING_BASE_FARE = float(os.getenv('PRICING_BASE_FARE') or 49.0)
+PRICING_FARE_PER_HOUR = float(os.getenv('PRICING_FARE_PER_HOUR') or 90.0)
+UPDATE_BATCH_SIZE = int(os.getenv('PRICING_UPDATE_BATCH_SIZE') or 1000)
+REPRICE_LOCK_SECONDS = float(os.getenv('REPRICE_LOCK_SECONDS') or 600)
+
+# (breakpoints, multipliers) - below the first breakpoint the first multiplier applies, above the last the last one.
+LOAD_FACTOR_CURVE = ([0.0, 0.5, 0.8, 0.95, 1.0], [0.8, 1.0, 1.3, 1.8, 2.2])
+DAYS_OUT_CURVE = ([0.0, 3.0, 7.0, 14.0, 30.0, 90.0], [1.6, 1.4, 1.2, 1.05, 1.0, 0.9])
+
+SECONDS_PER_DAY = 86400.0
+
+# Flight fields whose change moves the computed price.
+PRICE_INPUTS = {"reserved_seats", "route_id", "airplane_id", "departure_time"}
+
+
+
+def mark_dirty(flight):
+    """
+    Marks flight for the next incremental pass when the caller commits. The increment runs in SQL, so concurrent
+    marks of one flight all count.
+    """
+    flight.price_dirty = 1 if flight.id is None else func.coalesce(Flight.price_dirty, 0) + 1
+
+
+# ------------------------------------------------
+#                  Repricing Lock
+# ------------------------------------------------
+
+
+def claim_reprice_lock(session, now):
+    """
+    :return: whether this pass now holds the lock (committed)
+    """
+    held_until = now + datetime.timedelta(seconds=REPRICE_LOCK_SECONDS)
+    claimed = session.execute(
+        update(RepricingLock.__table__)
+        .where(RepricingLock.id == 1, or_(RepricingLock.locked_until.is_(None), RepricingLock.locked_until <= now))
+        .values(locked_until=held_until)
+    ).rowcount
+    if not claimed and session.get(RepricingLock, 1) is None:
+        try:
+            session.execute(insert(RepricingLock.__table__).values(id=1, locked_until=held_until))
+            claimed = 1
+        except IntegrityError:
+            # Another worker created the row, and holds the lock, first.
+            session.rollback()
+    session.commit()
+    return bool(claimed)
+
+
+def release_reprice_lock(session):
+    session.execute(update(RepricingLock.__table__).where(RepricingLock.id == 1).values(locked_until=None))
+    session.commit()
+
+
+# ------------------------------------------------
+#                 Vectorized Pass
+# ------------------------------------------------
+
+
+def parse_departures(departure_times):
+    """
+    departure_time is stored as a string; numpy parses ISO dates with a space or a T separator in one call. Should
+    any string be malformed the array is parsed again element by element, leaving NaT for the bad ones.
+    :return: datetime64[s] array
+    """
+    strings = np.asarray(departure_times, dtype=str)
+    try:
+        return strings.astype("datetime64[us]").astype("datetime64[s]")
+    except ValueError:
+        parsed = np.full(len(strings), np.datetime64("NaT"), dtype="datetime64[s]")
+        for index, value in enumerate(strings):
+            try:
+                parsed[index] = np.datetime64(value, "us")
+            except ValueError:
+                pass
+        return parsed
+
+
+def compute_prices(durations, reserved_seats, capacities, departures, now):
+    """
+    :return: (prices rounded to cents, mask of the flights that are upcoming and priceable)
+    """
+    durations = np.asarray(durations, dtype=float)
+    reserved_seats = np.asarray(reserved_seats, dtype=float)
+    capacities = np.asarray(capacities, dtype=float)
+
+    days_out = (departures - np.datetime64(now, "s")).astype(float) / SECONDS_PER_DAY
+    valid = ~np.isnat(departures) & (days_out >= 0) & ~np.isnan(durations)
+
+    load_factor = np.divide(reserved_seats, capacities, out=np.ones_like(reserved_seats), where=capacities > 0)
+    base = PRICING_BASE_FARE + PRICING_FARE_PER_HOUR * np.nan_to_num(durations)
+    prices = base \
+        * np.interp(load_factor, *LOAD_FACTOR_CURVE) \
+        * np.interp(np.where(valid, days_out, 0.0), *DAYS_OUT_CURVE)
+    return np.round(prices, 2), valid
+
+
+# ------------------------------------------------
+#                   Repricing
+# ------------------------------------------------
+
+
+def load_flights(session, incremental, now):
+    """
+    :return: the marked flights when incremental - past ones too, so their marks are cleared - else the upcoming ones
+    """
+    statement = select(
+        Flight.id, Flight.seat_price, Flight.reserved_seats, Flight.departure_time,
+        Route.duration, AirplaneType.max_capacity, Flight.price_dirty
+    )   \
+        .join(Route, Flight.route_id == Route.id)   \
+        .join(Airplane, Flight.airplane_id == Airplane.id)   \
+        .join(AirplaneType, Airplane.type_id == AirplaneType.id)
+
+    if incremental:
+        statement = statement.where(Flight.price_dirty > 0)
+    else:
+        statement = statement.where(Flight.departure_time >= departure_string(now))
+    return session.execute(statement).all()
+
+
+@lru_cache(maxsize=8)
+def price_update(size):
+    """
+    UPDATE flight SET seat_price = CASE id WHEN :i0 THEN :p0 ... END WHERE id IN (:i0 ...) for size flights, built from
+    bound parameters once per batch size: every full batch then reuses one compiled statement instead of building and
+    compiling a thousand-branch expression each time.
+    """
+    table = Flight.__table__
+    ids = [bindparam(f"i{n}") for n in range(size)]
+    return update(table)    \
+        .where(table.c.id.in_(ids))     \
+        .values(seat_price=case(*[(table.c.id == ids[n], bindparam(f"p{n}")) for n in range(size)]))
+
+
+def write_prices(session, ids, prices):
+    for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+        batch_ids = ids[start:start + UPDATE_BATCH_SIZE]
+        batch_prices = prices[start:start + UPDATE_BATCH_SIZE]
+        params = {f"i{n}": flight_id for n, flight_id in enumerate(batch_ids)}
+        params.update({f"p{n}": price for n, price in enumerate(batch_prices)})
+        session.execute(price_update(len(batch_ids)), params)
+
+
+def clear_marks(session, ids, marks):
+    seen = [{"flight_id": flight_id, "seen": mark} for flight_id, mark in zip(ids, marks) if mark]
+    if seen:
+        table = Flight.__table__
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("flight_id"), table.c.price_dirty == bindparam("seen"))
+            .values(price_dirty=0),
+            seen
+        )
+
+
+def reprice(session, incremental=False, now=None):
+    """
+    Reprices every flight, or only the flights marked dirty when incremental, and commits.
+    :return: summary of the pass
+    """
+    if not claim_reprice_lock(session, datetime.datetime.utcnow()):
+        raise HTTPException(
+            status_code=409,
+            detail="A repricing pass is already running"
+        )
+
+    try:
+        started = time.perf_counter()
+        now = now or datetime.datetime.utcnow()
+        rows = load_flights(session, incremental, now)
+        if rows:
+            ids, old_prices, reserved_seats, departure_times, durations, capacities, marks = zip(*rows)
+            prices, valid = compute_prices(
+                np.array(durations, dtype=float),
+                reserved_seats,
+                capacities,
+                parse_departures(departure_times),
+                now
+            )
+            old_prices = np.array(old_prices, dtype=float)
+            changed = valid & (np.abs(prices - old_prices) >= 0.005)
+            changed_ids = np.array(ids)[changed].tolist()
+            write_prices(session, changed_ids, prices[changed].tolist())
+            clear_marks(session, ids, marks)
+            session.commit()
+        else:
+            valid, changed_ids = [], []
+
+        return {
+            "evaluated": int(np.count_nonzero(valid)),
+            "changed": len(changed_ids),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    finally:
+        session.rollback()
+        release_reprice_lock(session)
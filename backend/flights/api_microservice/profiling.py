@@ -0,0 +1,261 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################           Profiling           ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Two ways to look inside a running service, both disabled unless PROFILING_TOKEN is set and both requiring that token
+# in an X-Profile-Token header:
+#
+#   GET /debug/profile?seconds=N   samples the stack of every thread (event loop and threadpool alike) every few
+#                                  milliseconds for N seconds and returns collapsed stacks, one "frame;frame;... count"
+#                                  line per distinct stack, ready for flamegraph.pl or speedscope.
+#   X-Profile: 1 on any request    runs that one request under cProfile; the response carries an X-Profile-Id whose
+#                                  report is served at /debug/profile/{id}.
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+
+import fastapi.dependencies.utils
+import fastapi.routing
+from fastapi import Header, HTTPException
+
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN') or None
+PROFILE_STORE_SIZE = int(os.getenv('PROFILE_STORE_SIZE') or 20)
+
+# Leaf frames of threads that are parked rather than working; their stacks are dropped unless idle stacks are asked for.
+# Matched by (file, function): blocking C calls such as select.epoll.poll leave no frame of their own, so the leaf is
+# the stdlib wrapper that made them, and the bare function name alone would also drop an endpoint's own get() or wait().
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("thread.py", "_worker"),
+    ("arbiter.py", "sleep"),
+}
+
+
+# ------------------------------------------------
+#                     Guard
+# ------------------------------------------------
+
+
+def token_matches(token):
+    # Compared as bytes: compare_digest raises on str holding non-ASCII characters, which any client can send.
+    return hmac.compare_digest(token, PROFILING_TOKEN.encode())
+
+
+def require_profiling_token(x_profile_token: str = Header(None)):
+    if PROFILING_TOKEN is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Not Found"
+        )
+    if not x_profile_token or not token_matches(x_profile_token.encode("latin-1")):
+        raise HTTPException(
+            status_code=403,
+            detail="Invalid profiling token"
+        )
+
+
+# ------------------------------------------------
+#                Sampling Profiler
+# ------------------------------------------------
+
+
+sampler_lock = threading.Lock()
+
+
+def idle_frame(code):
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval, idle=False):
+    """
+    Polls sys._current_frames() - a snapshot of every thread's current frame, taken without stopping the threads -
+    until the time is up. Overhead scales with the sampling rate, not with the request rate.
+    :return: {collapsed stack: sample count}
+    """
+    if not sampler_lock.acquire(blocking=False):
+        raise HTTPException(
+            status_code=409,
+            detail="A profile is already being taken"
+        )
+
+    try:
+        counts = {}
+        labels = {}
+        me = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not idle and idle_frame(frame.f_code)):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(interval)
+        return counts
+    finally:
+        sampler_lock.release()
+
+
+def collapse(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+# ------------------------------------------------
+#              Per-Request Profiling
+# ------------------------------------------------
+
+
+class RequestProfile(object):
+    """
+    cProfile only watches the thread that enabled it, and a sync endpoint hops between the event loop and threadpool
+    workers (the handler, its dependencies and the response_model validation each run as a separate threadpool job).
+    So every thread the request touches gets its own Profile and the results are merged at the end.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.profiles = []
+
+    def profile(self):
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        return profile
+
+    def runcall(self, func, *args, **kwargs):
+        return self.profile().runcall(func, *args, **kwargs)
+
+    def stats(self):
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+active_profile = ContextVar("active_profile", default=None)
+profile_lock = threading.Lock()
+profile_store = OrderedDict()
+
+
+def profiled_threadpool(run_in_threadpool):
+    async def run(func, *args, **kwargs):
+        profile = active_profile.get()
+        if profile is None:
+            return await run_in_threadpool(func, *args, **kwargs)
+        return await run_in_threadpool(profile.runcall, func, *args, **kwargs)
+    return run
+
+
+# FastAPI (pinned at 0.70.1) hands sync endpoints, sync dependencies and response validation to the threadpool through
+# these two module-level names; routing them through profiled_threadpool lets a profiled request follow itself there.
+# Requests without X-Profile pay one contextvar lookup per threadpool hop.
+fastapi.routing.run_in_threadpool = profiled_threadpool(fastapi.routing.run_in_threadpool)
+fastapi.dependencies.utils.run_in_threadpool = profiled_threadpool(fastapi.dependencies.utils.run_in_threadpool)
+
+
+def store_profile(profile):
+    profile_store[profile.id] = profile
+    while len(profile_store) > PROFILE_STORE_SIZE:
+        profile_store.popitem(last=False)
+
+
+def profile_report(profile_id, sort="cumulative", limit=60):
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Profile not found"
+        )
+    output = io.StringIO()
+    stats = profile.stats()
+    stats.stream = output
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+def profile_dump(profile_id):
+    """
+    :return: the merged profile in the binary pstats format read by snakeviz, gprof2dot and pstats.Stats
+    """
+    report = profile_store.get(profile_id)
+    if report is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Profile not found"
+        )
+    stats = report.stats()
+    return marshal.dumps(stats.stats)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles requests sent with X-Profile: 1 and a valid X-Profile-Token. The event loop thread's profiler also records
+    whatever other requests run on the loop meanwhile, so profile on a quiet instance where possible. Only one request
+    is profiled at a time; a second one is served normally with X-Profile-Id: busy.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or PROFILING_TOKEN is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-profile-token", b"")
+        if headers.get(b"x-profile") != b"1" or not token_matches(token):
+            await self.app(scope, receive, send)
+            return
+
+        if not profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, self.tag(send, b"busy"))
+            return
+
+        profile = RequestProfile()
+        context_token = active_profile.set(profile)
+        loop_profile = profile.profile()
+        try:
+            loop_profile.enable()
+            try:
+                await self.app(scope, receive, self.tag(send, profile.id.encode()))
+            finally:
+                loop_profile.disable()
+        finally:
+            active_profile.reset(context_token)
+            profile_lock.release()
+            store_profile(profile)
+
+    @staticmethod
+    def tag(send, profile_id):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", profile_id)])
+            await send(message)
+        return send_wrapper
@@ -0,0 +1,87 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################     Request Coalescing        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Concurrent identical reads share one database query. The first request for a key (endpoint name plus parameters)
+# runs the query; requests for the same key arriving while it is in flight wait for it and get its result, or its
+# exception, instead of issuing the query again. Once the query finishes the key is forgotten, so nothing is cached:
+# a request never sees a result that was already complete when it arrived. Database load on a hot key is then bounded
+# by one query per query time, however many clients ask.
+#
+# do() serves the threadpool (plain def endpoints), do_async() coroutines; both share the in-flight calls of one
+# SingleFlight. Results are handed to every waiter as they are, so they must be plain data (project_rows dicts), never
+# ORM objects bound to the leader's session.
+import asyncio
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+
+class Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.futures = {}
+
+    def do(self, key, fn):
+        """
+        Runs fn() unless a call for key is already in flight, in which case it waits for that call instead.
+        :return: the result of the call
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            call.done.wait()
+            return call.outcome()
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, fn):
+        """
+        As do(), for the event loop: the first coroutine for key runs fn() in the threadpool (joining a call do()
+        already has in flight) and the others await the same future without taking a thread each. The futures are
+        only touched on the event loop thread.
+        """
+        future = self.futures.get(key)
+        if future is None:
+            future = self.futures[key] = asyncio.ensure_future(run_in_threadpool(self.do, key, fn))
+            future.add_done_callback(lambda done: self.forget(key, done))
+        # A waiter that is cancelled (its client went away) must not cancel the call the others are waiting for.
+        return await asyncio.shield(future)
+
+    def forget(self, key, future):
+        if self.futures.get(key) is future:
+            del self.futures[key]
+        if not future.cancelled():
+            future.exception()          # marks the exception retrieved even if every waiter was cancelled
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,162 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Nearby Airports        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# An in-memory k-d tree over every airport, answering "the k nearest airports" and "airports within r miles" without
+# touching the database. Coordinates are mapped to points on the unit sphere, where the straight-line (chord) distance
+# between two points grows with their great-circle distance, so an ordinary 3-d tree over Euclidean distance finds the
+# same airports a Haversine scan would; the distances returned are then computed with Haversine itself.
+#
+# The tree is built on warm-up and kept current with airport writes as described in airportindex.
+import heapq
+import math
+
+from sqlmodel import Session
+
+from .airportindex import AirportIndex
+from .haversine import Haversine
+from .warmup import register_warmup
+
+# The radius Haversine uses, in miles.
+EARTH_RADIUS_MILES = 6371000 * 0.000621371
+
+
+def unit_vector(latitude, longitude):
+    phi = math.radians(latitude)
+    lam = math.radians(longitude)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def chord_for_miles(miles):
+    """
+    :return: the chord length on the unit sphere spanning a great-circle distance of miles
+    """
+    angle = min(miles / EARTH_RADIUS_MILES, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+# ------------------------------------------------
+#                    K-D Tree
+# ------------------------------------------------
+
+
+class KDTree(object):
+    """
+    A static 3-d tree stored as parallel lists indexed by point: each point is a node, split along the axis on which
+    its subtree is most spread out. Built in O(n log^2 n); a query visits O(log n) nodes for well spread points.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.axis = [0] * len(points)
+        self.left = [-1] * len(points)
+        self.right = [-1] * len(points)
+        self.root = self.build(list(range(len(points))))
+
+    def build(self, indices):
+        if not indices:
+            return -1
+
+        points = self.points
+        spreads = [
+            max(points[i][axis] for i in indices) - min(points[i][axis] for i in indices) for axis in range(3)
+        ]
+        axis = spreads.index(max(spreads))
+        indices.sort(key=lambda i: points[i][axis])
+
+        middle = len(indices) // 2
+        node = indices[middle]
+        self.axis[node] = axis
+        self.left[node] = self.build(indices[:middle])
+        self.right[node] = self.build(indices[middle + 1:])
+        return node
+
+    def nearest(self, target, k):
+        """
+        :return: [(squared chord distance, point index)] of the k closest points, closest first
+        """
+        heap = []
+        points, axes, left, right = self.points, self.axis, self.left, self.right
+
+        def visit(node):
+            point = points[node]
+            distance = (target[0] - point[0]) ** 2 + (target[1] - point[1]) ** 2 + (target[2] - point[2]) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, node))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, node))
+
+            difference = target[axes[node]] - point[axes[node]]
+            near, far = (left[node], right[node]) if difference < 0 else (right[node], left[node])
+            if near >= 0:
+                visit(near)
+            if far >= 0 and (len(heap) < k or difference * difference < -heap[0][0]):
+                visit(far)
+
+        if self.root >= 0 and k > 0:
+            visit(self.root)
+        return sorted((-distance, node) for distance, node in heap)
+
+    def within(self, target, radius):
+        """
+        :return: [(squared chord distance, point index)] of the points within radius, closest first
+        """
+        found = []
+        limit = radius * radius
+        points, axes, left, right = self.points, self.axis, self.left, self.right
+
+        def visit(node):
+            point = points[node]
+            distance = (target[0] - point[0]) ** 2 + (target[1] - point[1]) ** 2 + (target[2] - point[2]) ** 2
+            if distance <= limit:
+                found.append((distance, node))
+
+            difference = target[axes[node]] - point[axes[node]]
+            if left[node] >= 0 and difference - radius <= 0:
+                visit(left[node])
+            if right[node] >= 0 and difference + radius >= 0:
+                visit(right[node])
+
+        if self.root >= 0:
+            visit(self.root)
+        return sorted(found)
+
+
+# ------------------------------------------------
+#                 Airport Locator
+# ------------------------------------------------
+
+
+class AirportLocator(AirportIndex):
+
+    def build(self, rows):
+        return KDTree([unit_vector(row["latitude"], row["longitude"]) for row in rows])
+
+    def nearby(self, session, latitude, longitude, radius=None, k=None):
+        """
+        Airports within radius miles (all of them, or the k nearest of them), or the k nearest when no radius is
+        given, closest first and each with its distance_miles from the given point.
+        """
+        rows, tree = self.current(session)
+        target = unit_vector(latitude, longitude)
+        if radius is None:
+            matches = tree.nearest(target, k)
+        else:
+            matches = tree.within(target, chord_for_miles(radius))[:k]
+
+        return [
+            dict(rows[node], distance_miles=round(Haversine(
+                (longitude, latitude), (rows[node]["longitude"], rows[node]["latitude"])
+            ).miles, 2))
+            for _, node in matches
+        ]
+
+
+airport_locator = AirportLocator()
+
+
+@register_warmup
+def prime_airport_locator(engine):
+    with Session(engine) as session:
+        airport_locator.current(session)
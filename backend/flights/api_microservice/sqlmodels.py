@@ -1,9 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List
 
+from pydantic import validator
+from pydantic.datetime_parse import parse_datetime
+from sqlalchemy import Column, Text
 from sqlmodel import Field, SQLModel, Relationship
 
 
+def departure_string(value):
+    """
+    departure_time is stored as a string and compared as one (stats windows), so every write through the API stores the
+    same format: naive UTC, str(datetime) - a space between date and time. Offsets are converted to UTC.
+    """
+    if value is None:
+        return None
+    moment = parse_datetime(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return str(moment)
+
+
 # ------------------------------------------------
 #                   Airplane
 # ------------------------------------------------
@@ -85,6 +101,10 @@ class AirportRead(Airport):
     pass
 
 
+class AirportDistanceRead(AirportRead):
+    distance_miles: float
+
+
 class AirportUpdate(SQLModel):
     iata_id: Optional[str]
     city: Optional[str]
@@ -112,10 +132,11 @@ class FlightBase(SQLModel):
 
 class Flight(FlightBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    price_dirty: int = Field(default=0, index=True, nullable=False, sa_column_kwargs={"server_default": "0"})
 
 
 class FlightCreate(FlightBase):
-    pass
+    _departure_time = validator("departure_time", pre=True, allow_reuse=True)(departure_string)
 
 
 class FlightRead(FlightBase):
@@ -125,10 +146,24 @@ class FlightRead(FlightBase):
 class FlightUpdate(SQLModel):
     route_id: Optional[int] = None
     airplane_id: Optional[int] = None
-    departure_time: Optional[datetime] = None
+    departure_time: Optional[str] = None
     reserved_seats: Optional[int] = None
     seat_price: Optional[float] = None
 
+    _departure_time = validator("departure_time", pre=True, allow_reuse=True)(departure_string)
+
+
+class RepricingLock(SQLModel, table=True):
+    __tablename__ = "repricing_lock"
+    id: int = Field(primary_key=True)
+    locked_until: Optional[datetime] = None
+
+
+class DataMigration(SQLModel, table=True):
+    __tablename__ = "data_migration"
+    name: str = Field(primary_key=True, max_length=64)
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
+
 
 # ------------------------------------------------
 #                      Route
@@ -161,3 +196,71 @@ class RouteUpdate(SQLModel):
     origin_id: Optional[str] = None
     destination_id: Optional[str] = None
     duration: Optional[float] = None
+
+
+# ------------------------------------------------
+#               Flight Availability
+# ------------------------------------------------
+
+
+class FlightAvailabilityBase(SQLModel):
+    route_id: int = Field(nullable=False, index=True)
+    departure_time: str = Field(nullable=False)
+    capacity: int = Field(nullable=False)
+    seats_remaining: int = Field(nullable=False, index=True)
+
+
+class FlightAvailability(FlightAvailabilityBase, table=True):
+    __tablename__ = "flight_availability"
+    flight_id: int = Field(primary_key=True)
+
+
+class FlightAvailabilityRead(FlightAvailabilityBase):
+    flight_id: int
+
+
+# ------------------------------------------------
+#                   Statistics
+# ------------------------------------------------
+
+
+class RouteStatsRead(SQLModel):
+    route_id: int
+    origin_id: str
+    destination_id: str
+    flights: int
+    reserved_seats: int
+    average_load_factor: Optional[float]
+    revenue: float
+
+
+class AirportStatsRead(SQLModel):
+    iata_id: str
+    departures: int
+    arrivals: int
+    departing_passengers: int
+    arriving_passengers: int
+    departure_revenue: float
+
+
+# ------------------------------------------------
+#                 Outbox Events
+# ------------------------------------------------
+
+
+class OutboxEventBase(SQLModel):
+    entity: str = Field(index=True, max_length=64)
+    entity_id: str = Field(max_length=64)
+    action: str = Field(max_length=16)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class OutboxEvent(OutboxEventBase, table=True):
+    __tablename__ = "flights_outbox_event"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    payload: str = Field(default="{}", sa_column=Column(Text, nullable=False))
+
+
+class OutboxEventRead(OutboxEventBase):
+    id: int
+    payload: dict
@@ -0,0 +1,195 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################          Statistics           ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Network-wide aggregates computed by the database in a single GROUP BY query each, instead of paging every flight to
+# the client. Both reports take an optional departure window [start, end). departure_time is stored as an ISO string,
+# written in one format (sqlmodels.departure_string), so the bounds are compared as strings of that format. Rows
+# written before the format was enforced (a T separator, a Z or an offset) are rewritten by a one-off migration at
+# startup, recorded in data_migration so later startups skip it. Results are cached for STATS_CACHE_TTL seconds per
+# window.
+import datetime
+import os
+
+from sqlalchemy import bindparam, case, func, literal, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from .sqlmodels import Airplane, AirplaneType, DataMigration, Flight, Route, departure_string
+from .ttlcache import TTLCache
+from .warmup import register_warmup
+
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL') or 30)
+MIGRATION_BATCH_SIZE = 10000
+
+DEPARTURE_TIMES_MIGRATION = "normalize_departure_times"
+
+stats_cache = TTLCache(STATS_CACHE_TTL)
+
+
+def departure_window(start, end):
+    criteria = []
+    if start is not None:
+        criteria.append(Flight.departure_time >= departure_string(start))
+    if end is not None:
+        criteria.append(Flight.departure_time < departure_string(end))
+    return criteria
+
+
+def normalized_departure(value):
+    """
+    :return: value in the stored format, converted to UTC - or unchanged when it is not an ISO date and time
+    """
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return str(moment)
+
+
+@register_warmup
+def normalize_departure_times(engine):
+    """
+    Rewrites every departure_time not in the stored format, MIGRATION_BATCH_SIZE flights per transaction, once per
+    database. Workers starting together may each run it; it is idempotent.
+    """
+    with Session(engine) as session:
+        if session.get(DataMigration, DEPARTURE_TIMES_MIGRATION) is not None:
+            return
+
+        last_id = 0
+        while True:
+            rows = session.execute(
+                select(Flight.id, Flight.departure_time)
+                .where(Flight.id > last_id)
+                .order_by(Flight.id)
+                .limit(MIGRATION_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            changed = [
+                {"flight_id": flight_id, "normalized": normalized_departure(value)}
+                for flight_id, value in rows
+                if normalized_departure(value) != value
+            ]
+            if changed:
+                session.execute(
+                    update(Flight.__table__)
+                    .where(Flight.id == bindparam("flight_id"))
+                    .values(departure_time=bindparam("normalized")),
+                    changed
+                )
+            session.commit()
+
+        try:
+            session.add(DataMigration(name=DEPARTURE_TIMES_MIGRATION))
+            session.commit()
+        except IntegrityError:
+            # Another worker finished the same migration first.
+            session.rollback()
+
+
+def number(value):
+    # SUM and AVG come back as Decimal from MySQL; NULL when a group has no usable rows.
+    return float(value) if value is not None else None
+
+
+# ------------------------------------------------
+#                    Reports
+# ------------------------------------------------
+
+
+def route_stats(session, start=None, end=None):
+    load_factor = case(
+        (AirplaneType.max_capacity > 0, Flight.reserved_seats * 1.0 / AirplaneType.max_capacity),
+        else_=None
+    )
+    statement = select(
+        Route.id,
+        Route.origin_id,
+        Route.destination_id,
+        func.count(Flight.id),
+        func.sum(Flight.reserved_seats),
+        func.avg(load_factor),
+        func.sum(Flight.seat_price * Flight.reserved_seats)
+    )   \
+        .join(Flight, Flight.route_id == Route.id)  \
+        .join(Airplane, Flight.airplane_id == Airplane.id)  \
+        .join(AirplaneType, Airplane.type_id == AirplaneType.id)    \
+        .where(*departure_window(start, end))   \
+        .group_by(Route.id, Route.origin_id, Route.destination_id)  \
+        .order_by(Route.id)
+
+    return [
+        {
+            "route_id": route_id,
+            "origin_id": origin_id,
+            "destination_id": destination_id,
+            "flights": flights,
+            "reserved_seats": int(reserved_seats or 0),
+            "average_load_factor": number(average_load_factor),
+            "revenue": round(number(revenue) or 0.0, 2),
+        }
+        for route_id, origin_id, destination_id, flights, reserved_seats, average_load_factor, revenue
+        in session.execute(statement)
+    ]
+
+
+def airport_stats(session, start=None, end=None):
+    """
+    Each flight counts as a departure at its route's origin and an arrival at its destination; the two sides are
+    stacked with UNION ALL and aggregated per airport in the same query.
+    """
+    window = departure_window(start, end)
+    revenue = Flight.seat_price * Flight.reserved_seats
+    departures = select(
+        Route.origin_id.label("iata_id"),
+        literal(1).label("departure"),
+        literal(0).label("arrival"),
+        Flight.reserved_seats.label("departing"),
+        literal(0).label("arriving"),
+        revenue.label("revenue")
+    ).join(Flight, Flight.route_id == Route.id).where(*window)
+    arrivals = select(
+        Route.destination_id,
+        literal(0),
+        literal(1),
+        literal(0),
+        Flight.reserved_seats,
+        literal(0.0)
+    ).join(Flight, Flight.route_id == Route.id).where(*window)
+    movements = union_all(departures, arrivals).subquery()
+
+    statement = select(
+        movements.c.iata_id,
+        func.sum(movements.c.departure),
+        func.sum(movements.c.arrival),
+        func.sum(movements.c.departing),
+        func.sum(movements.c.arriving),
+        func.sum(movements.c.revenue)
+    )   \
+        .group_by(movements.c.iata_id)  \
+        .order_by(movements.c.iata_id)
+
+    return [
+        {
+            "iata_id": iata_id,
+            "departures": int(departures),
+            "arrivals": int(arrivals),
+            "departing_passengers": int(departing or 0),
+            "arriving_passengers": int(arriving or 0),
+            "departure_revenue": round(number(revenue) or 0.0, 2),
+        }
+        for iata_id, departures, arrivals, departing, arriving, revenue in session.execute(statement)
+    ]
+
+
+def cached_report(report, session, start=None, end=None):
+    return stats_cache.get_or_compute(
+        (report.__name__, start, end),
+        lambda: report(session, start, end)
+    )
@@ -1,14 +1,26 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import asyncio
+import gzip
+import threading
+import time
 
 import pytest
 
 from .sqlmodels import (
-    Airport, Airplane, AirplaneType, Flight, Route
+    Airport, Airplane, AirplaneType, Flight, FlightAvailability, OutboxEvent, Route
 )
-from .main import app, get_session
+from .main import app, get_session, invalidate_airport_indexes
+from . import dbstats
+from .dbstats import RequestQueryStats, normalize
+from . import autocomplete, outbox, pricing, profiling, spatial, stats, tracing, warmup
+from .compression import CompressionMiddleware, choose_encoding
+from .singleflight import SingleFlight
+from .ttlcache import TTLCache
 
 from fastapi.testclient import TestClient
 
+from sqlalchemy import insert, update
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
@@ -111,6 +123,24 @@ def test_health_check(client: TestClient):
     assert response.json() == {"msg": "Healthy"}
 
 
+def test_metrics(client: TestClient):
+    client.get("/api/v2/airports/JFK")
+    client.get("/api/v2/airports/LAX")
+    client.get("/no/such/route")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/api/v2/airports/{iata_id}",status="404"} 2' in text
+    assert 'route="<unmatched>"' in text
+    assert "/api/v2/airports/JFK" not in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/v2/airports/{iata_id}",status="404",' \
+           'le="+Inf"} 2' in text
+    assert "# TYPE http_requests_in_flight gauge" in text
+
+
 # ------------------------------------------------
 #                     Empty DB
 # ------------------------------------------------
@@ -485,6 +515,53 @@ def test_flight_read(client: TestClient):
     assert data["reserved_seats"] == flight_1["reserved_seats"]
 
 
+def test_concurrent_reads_share_one_query():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        release.wait(5)
+        return [{"id": 1}]
+
+    with ThreadPoolExecutor(max_workers=9) as pool:
+        results = [pool.submit(flight.do, ("get_flight", 1), query) for _ in range(8)]
+        other = pool.submit(flight.do, ("get_flight", 2), lambda: [{"id": 2}]).result(5)
+        while len(calls) < 1:
+            time.sleep(0.001)
+        time.sleep(0.05)                # let the other seven join the call in flight
+        release.set()
+        assert [result.result(5) for result in results] == [[{"id": 1}]] * 8
+
+    assert len(calls) == 1
+    assert other == [{"id": 2}]
+    assert flight.calls == {}
+    # Nothing is cached: the next request runs the query again.
+    flight.do(("get_flight", 1), query)
+    assert len(calls) == 2
+
+
+def test_async_reads_share_one_query():
+    flight = SingleFlight()
+    calls = []
+
+    def query():
+        calls.append(1)
+        time.sleep(0.05)
+        raise ValueError("database went away")
+
+    async def main():
+        return await asyncio.gather(
+            *[flight.do_async(("get_route", 1), query) for _ in range(20)], return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.futures == {} and flight.calls == {}
+
+
 def test_flights_read(client: TestClient):
     client.post("/api/v2/airports/", json=airport_1)
     client.post("/api/v2/airports/", json=airport_2)
@@ -704,3 +781,779 @@ def test_route_nonextant_delete(client: TestClient):
     assert response.status_code == 404
     assert response.json() == {"detail": "Route not found"}
 
+
+# ------------------------------------------------
+#                Query Statistics
+# ------------------------------------------------
+
+
+def test_query_stats_headers(client: TestClient):
+    response = client.get("/api/v2/airports/JFK")
+    assert response.headers["x-db-query-count"] == "1"
+    assert float(response.headers["x-db-time-ms"]) >= 0
+    assert "x-db-flags" not in response.headers
+
+
+def test_query_stats_flags_repeated_statements():
+    stats = RequestQueryStats()
+    stats.record("SELECT * FROM airport WHERE iata_id = ?", 0.001)
+    for flight_id in range(dbstats.REPEATED_STATEMENT_LIMIT):
+        stats.record(f"SELECT * FROM route WHERE route.id = {flight_id}", 0.001)
+
+    assert stats.flags() == ["repeated"]
+    assert stats.most_repeated() == ("SELECT * FROM route WHERE route.id = ?", dbstats.REPEATED_STATEMENT_LIMIT)
+
+
+def test_query_stats_flags_budget(client: TestClient, monkeypatch):
+    monkeypatch.setattr(dbstats, "QUERY_BUDGET", 2)
+    client.post("/api/v2/airports/", json=airport_1)
+
+    response = client.delete("/api/v2/airports/JFK")
+    assert response.status_code == 200
+    assert response.headers["x-db-flags"] == "budget"
+
+    metrics = client.get("/metrics").text
+    assert 'db_flagged_requests_total{method="DELETE",route="/api/v2/airports/{iata_id}",reason="budget"} 1' in metrics
+
+
+def test_statement_normalization():
+    assert normalize("SELECT * FROM airport\n  WHERE iata_id = 'JFK' AND elevation > 13") == \
+           "SELECT * FROM airport WHERE iata_id = ? AND elevation > ?"
+    assert normalize("DELETE FROM flight WHERE flight.id IN (?, ?, ?)") == "DELETE FROM flight WHERE flight.id IN (?)"
+    assert normalize("SELECT * FROM route WHERE id = %(id_1)s") == normalize("SELECT * FROM route WHERE id = %s")
+
+
+# ------------------------------------------------
+#                     Tracing
+# ------------------------------------------------
+
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+
+
+def test_tracing_continues_sampled_parent(client: TestClient):
+    exporter = tracing.set_exporter(tracing.MemoryExporter())
+    try:
+        response = client.get("/api/v2/airports/JFK", headers={"traceparent": f"00-{TRACE_ID}-b7ad6b7169203331-01"})
+    finally:
+        tracing.set_exporter(tracing.NoopExporter())
+
+    spans = list(exporter.spans)
+    server = spans[-1]
+    assert server["name"] == "GET /api/v2/airports/{iata_id}"
+    assert server["trace_id"] == TRACE_ID
+    assert server["parent_id"] == "b7ad6b7169203331"
+    assert server["attributes"]["http.status_code"] == 404
+    assert response.headers["traceresponse"] == f"00-{TRACE_ID}-{server['span_id']}-01"
+
+    statements = [span for span in spans if span["name"] == "db.query"]
+    assert len(statements) == 1
+    assert statements[0]["parent_id"] == server["span_id"]
+    assert statements[0]["attributes"]["db.statement"].startswith("SELECT airport.iata_id")
+
+
+def test_tracing_respects_unsampled_parent(client: TestClient):
+    exporter = tracing.set_exporter(tracing.MemoryExporter())
+    try:
+        response = client.get("/api/v2/airports/JFK", headers={"traceparent": f"00-{TRACE_ID}-b7ad6b7169203331-00"})
+    finally:
+        tracing.set_exporter(tracing.NoopExporter())
+
+    assert "traceresponse" not in response.headers
+    assert not exporter.spans
+
+
+def test_traceparent_parsing():
+    assert tracing.parse_traceparent(f"00-{TRACE_ID}-b7ad6b7169203331-01") == (TRACE_ID, "b7ad6b7169203331", True)
+    assert tracing.parse_traceparent(f"00-{TRACE_ID}-b7ad6b7169203331-00")[2] is False
+    assert tracing.parse_traceparent(f"00-{'0' * 32}-b7ad6b7169203331-01") is None
+    assert tracing.parse_traceparent("garbage") is None
+
+
+# ------------------------------------------------
+#                    Profiling
+# ------------------------------------------------
+
+
+def test_profiling_disabled_without_token(client: TestClient):
+    response = client.get("/debug/profile?seconds=0.01", headers={"X-Profile-Token": "anything"})
+    assert response.status_code == 404
+
+    response = client.get("/api/v2/airports/JFK", headers={"X-Profile": "1", "X-Profile-Token": "anything"})
+    assert "x-profile-id" not in response.headers
+
+
+def test_profiling_rejects_wrong_token(client: TestClient, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    response = client.get("/debug/profile?seconds=0.01", headers={"X-Profile-Token": "guess"})
+    assert response.status_code == 403
+
+
+def test_profiling_rejects_non_ascii_token(client: TestClient, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    response = client.get("/debug/profile?seconds=0.01", headers={"X-Profile-Token": "s\u00e9cret"})
+    assert response.status_code == 403
+
+    response = client.get("/", headers={"X-Profile": "1", "X-Profile-Token": "s\u00e9cret"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+
+def test_slow_queries_need_profiling_token(client: TestClient, monkeypatch):
+    assert client.get("/debug/slow_queries").status_code == 404
+
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    assert client.get("/debug/slow_queries").status_code == 403
+    assert client.get("/debug/slow_queries", headers={"X-Profile-Token": "guess"}).status_code == 403
+    response = client.get("/debug/slow_queries", headers={"X-Profile-Token": "secret"})
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+
+
+def write_cgroup_files(root, files):
+    for name, content in files.items():
+        path = root.joinpath(*name.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content + "\n")
+    return str(root)
+
+
+@pytest.mark.parametrize("files, limit", [
+    ({"cpu.max": "150000 100000"}, 1.5),
+    ({"cpu.max": "max 100000"}, None),
+    ({"cpu.max": "max 100000", "cpu/cpu.cfs_quota_us": "200000", "cpu/cpu.cfs_period_us": "100000"}, None),
+    ({"cpu/cpu.cfs_quota_us": "200000", "cpu/cpu.cfs_period_us": "100000"}, 2),
+    ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, None),
+    ({"cpu/cpu.cfs_quota_us": "200000"}, None),
+    ({}, None),
+])
+def test_cgroup_cpu_limit(tmp_path, files, limit):
+    import gunicorn_conf
+
+    assert gunicorn_conf.cgroup_cpu_limit(write_cgroup_files(tmp_path, files)) == limit
+
+
+@pytest.mark.parametrize("files, cores", [
+    ({"cpu.max": "150000 100000"}, 2),
+    ({"cpu.max": "50000 100000"}, 1),
+    ({"cpu.max": "1600000 100000"}, 8),
+    ({"cpu.max": "max 100000"}, 8),
+    ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, 8),
+    ({}, 8),
+])
+def test_available_cores(tmp_path, monkeypatch, files, cores):
+    import gunicorn_conf
+
+    monkeypatch.setattr(gunicorn_conf.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    assert gunicorn_conf.available_cores(write_cgroup_files(tmp_path, files)) == cores
+
+
+def test_sampling_profile(client: TestClient, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    response = client.get("/debug/profile?seconds=0.05&interval_ms=1&idle=true", headers={"X-Profile-Token": "secret"})
+    assert response.status_code == 200
+
+    lines = response.text.splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert ";" in stack
+
+
+def test_sampling_profile_drops_parked_threads_but_not_busy_functions_named_like_them():
+    import queue
+
+    stop = []
+
+    def get():
+        while not stop:
+            pass
+
+    parked = threading.Thread(target=queue.Queue().get, kwargs={"timeout": 5}, name="parked", daemon=True)
+    busy = threading.Thread(target=get, name="busy", daemon=True)
+    parked.start()
+    busy.start()
+    try:
+        counts = profiling.sample_stacks(0.05, 0.001)
+    finally:
+        stop.append(True)
+        busy.join()
+
+    assert any(stack.startswith("busy;") for stack in counts)
+    assert not any(stack.startswith("parked;") for stack in counts)
+
+
+def test_request_profile(client: TestClient, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    client.post("/api/v2/airports/", json=airport_1)
+
+    response = client.get("/api/v2/airports/JFK", headers={"X-Profile": "1", "X-Profile-Token": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    report = client.get(f"/debug/profile/{profile_id}", headers={"X-Profile-Token": "secret"})
+    assert report.status_code == 200
+    # The handler runs on a threadpool worker, yet it shows up in the request's profile.
+    assert "get_airport" in report.text
+
+    raw = client.get(f"/debug/profile/{profile_id}?raw=true", headers={"X-Profile-Token": "secret"})
+    assert raw.headers["content-type"] == "application/octet-stream"
+
+    missing = client.get("/debug/profile/0000", headers={"X-Profile-Token": "secret"})
+    assert missing.status_code == 404
+
+
+# ------------------------------------------------
+#                   Compression
+# ------------------------------------------------
+
+
+def test_compression_of_large_listing(client: TestClient, session: Session):
+    session.add_all([Flight(**dict(flight_1, reserved_seats=index)) for index in range(100)])
+    session.commit()
+
+    plain = client.get("/api/v2/flights/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    response = client.get("/api/v2/flights/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    # requests transparently decodes the body; the wire size is in content-length.
+    assert response.json() == plain.json()
+    assert int(response.headers["content-length"]) * 5 < len(plain.content)
+
+
+def test_compression_skips_small_responses(client: TestClient):
+    response = client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"msg": "Healthy"}
+
+
+def test_accept_encoding_negotiation():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("*") is not None
+    assert choose_encoding("deflate") is None
+
+
+def test_streamed_response_compression():
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        for index in range(50):
+            await send({"type": "http.response.body", "body": b'{"row": %d, "city": "New York, NY"}\n' % index,
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    raw = TestClient(CompressionMiddleware(streaming_app)).get(
+        "/", headers={"Accept-Encoding": "gzip"}, stream=True
+    ).raw.read(decode_content=False)
+
+    lines = gzip.decompress(raw).splitlines()
+    assert len(lines) == 50
+    assert lines[-1] == b'{"row": 49, "city": "New York, NY"}'
+
+
+# ------------------------------------------------
+#                     Warm-Up
+# ------------------------------------------------
+
+
+def test_readiness_follows_warmup(client: TestClient, session: Session, monkeypatch):
+    monkeypatch.setattr(warmup, "state", warmup.WarmupState())
+    monkeypatch.setattr(warmup, "warmup_hooks", [])
+    primed = []
+    warmup.register_warmup(primed.append)
+
+    assert client.get("/health").status_code == 200
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Warming up"
+
+    engine = session.get_bind()
+    warmup.run_warmup(app, engine)
+    assert primed == [engine]
+    assert warmup.exercise_response_models(app) >= 10
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["msg"] == "Ready"
+
+
+# ------------------------------------------------
+#                     Pricing
+# ------------------------------------------------
+
+
+def test_pricing_curves():
+    now = datetime(2030, 1, 1)
+    departures = pricing.parse_departures([
+        "2030-06-01 12:00:00", "2030-06-01T12:00:00", "2030-01-02 00:00:00.5", "2029-12-31 00:00:00", "not a date"
+    ])
+    prices, valid = pricing.compute_prices(
+        [2.0, 2.0, 2.0, 2.0, 2.0], [10, 140, 10, 10, 10], [150, 150, 150, 150, 150], departures, now
+    )
+
+    assert valid.tolist() == [True, True, True, False, False]
+    assert prices[1] > prices[0]    # fuller flight
+    assert prices[2] > prices[0]    # sooner departure
+
+
+def test_reprice_full_and_incremental(client: TestClient):
+    departure = str(datetime.utcnow() + timedelta(days=200))
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/flights/", json=dict(flight_1, departure_time=departure))
+    client.post("/api/v2/flights/", json=flight_2)      # already departed: left alone
+
+    response = client.post("/api/v2/pricing/reprice")
+    assert response.status_code == 200
+    assert response.json()["evaluated"] == 1
+    assert response.json()["changed"] == 1
+    price = client.get("/api/v2/flights/1").json()["seat_price"]
+    assert price != flight_1["seat_price"]
+    assert client.get("/api/v2/flights/2").json()["seat_price"] == flight_2["seat_price"]
+
+    assert client.post("/api/v2/pricing/reprice").json()["changed"] == 0
+
+    client.patch("/api/v2/flights/1", json={"reserved_seats": 145})
+    response = client.post("/api/v2/pricing/reprice?incremental=true")
+    assert response.json()["evaluated"] == 1
+    assert response.json()["changed"] == 1
+    assert client.get("/api/v2/flights/1").json()["seat_price"] > price
+
+    assert client.post("/api/v2/pricing/reprice?incremental=true").json()["evaluated"] == 0
+
+
+def test_reprice_reads_upcoming_flights_and_marks_rows_written_outside_the_orm(client: TestClient, session: Session):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    session.execute(insert(Flight.__table__).values(
+        route_id=1, airplane_id=1, departure_time=str(datetime.utcnow() + timedelta(days=30)), seat_price=1
+    ))
+    session.commit()
+    client.post("/api/v2/flights/", json=flight_2)      # already departed
+
+    flight = session.get(Flight, 1)
+    assert flight.price_dirty == 0
+    flight.reserved_seats = 100
+    pricing.mark_dirty(flight)
+    session.commit()
+    assert session.get(Flight, 1).price_dirty == 1
+
+    upcoming = pricing.load_flights(session, False, datetime.utcnow())
+    assert [row.id for row in upcoming] == [1]
+
+
+def test_reprice_marks_are_shared_and_locked_in_the_database(client: TestClient, session: Session, monkeypatch):
+    departure = str(datetime.utcnow() + timedelta(days=200))
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/flights/", json=dict(flight_1, departure_time=departure))
+
+    # Marked by another worker: the mark is in the row, not in this process.
+    flight = session.get(Flight, 1)
+    assert flight.price_dirty == 1
+    flight.reserved_seats = 100
+    pricing.mark_dirty(flight)
+    session.commit()
+    assert session.get(Flight, 1).price_dirty == 2
+
+    # A mark added after the pass read the flight survives the pass.
+    loaded = pricing.load_flights
+    def load_then_mark(db, *args):
+        rows = loaded(db, *args)
+        db.execute(update(Flight.__table__).values(price_dirty=Flight.price_dirty + 1))
+        return rows
+    monkeypatch.setattr(pricing, "load_flights", load_then_mark)
+    assert client.post("/api/v2/pricing/reprice?incremental=true").json()["evaluated"] == 1
+    monkeypatch.setattr(pricing, "load_flights", loaded)
+    session.expire_all()
+    assert session.get(Flight, 1).price_dirty == 3
+    assert client.post("/api/v2/pricing/reprice?incremental=true").json()["evaluated"] == 1
+    assert client.post("/api/v2/pricing/reprice?incremental=true").json()["evaluated"] == 0
+
+    # Held by a pass in another worker, then its lease runs out.
+    now = datetime.utcnow()
+    assert pricing.claim_reprice_lock(session, now)
+    assert client.post("/api/v2/pricing/reprice").status_code == 409
+    assert not pricing.claim_reprice_lock(session, now)
+    assert pricing.claim_reprice_lock(session, now + timedelta(seconds=pricing.REPRICE_LOCK_SECONDS))
+    pricing.release_reprice_lock(session)
+    assert client.post("/api/v2/pricing/reprice").status_code == 200
+
+
+# ------------------------------------------------
+#                Seat Availability
+# ------------------------------------------------
+
+
+def available_ids(client: TestClient, seats):
+    response = client.get(f"/api/v2/flights/available?seats={seats}")
+    return sorted(flight["flight_id"] for flight in response.json()) if response.status_code == 200 else []
+
+
+def test_availability_follows_changes(client: TestClient):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 50})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})      # plane 1
+    client.post("/api/v2/airplanes/", json={"type_id": 1})      # plane 2
+    client.post("/api/v2/flights/", json=flight_1)              # 122 seats left
+    client.post("/api/v2/flights/", json=flight_2)              # 38 seats left
+
+    response = client.get("/api/v2/flights/available?seats=100")
+    assert response.status_code == 200
+    assert response.json() == [{
+        "route_id": 1,
+        "departure_time": flight_1["departure_time"],
+        "capacity": 150,
+        "seats_remaining": 122,
+        "flight_id": 1
+    }]
+    assert available_ids(client, 30) == [1, 2]
+    assert client.get("/api/v2/flights/available?seats=1&limit=101").status_code == 422
+
+    client.patch("/api/v2/flights/1", json={"reserved_seats": 140})
+    assert available_ids(client, 30) == [2]
+
+    client.patch("/api/v2/airplane_types/1", json={"max_capacity": 300})
+    assert available_ids(client, 150) == [1, 2]
+
+    client.patch("/api/v2/airplanes/2", json={"type_id": 2})
+    assert available_ids(client, 150) == [1]
+
+    client.patch("/api/v2/flights/1", json={"airplane_id": 2})
+    assert available_ids(client, 1) == []
+
+    client.delete("/api/v2/flights/2")
+    response = client.get("/api/v2/flights/available?seats=1")
+    assert response.status_code == 404
+
+
+def test_availability_follows_plane_and_type_deletes(client: TestClient):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 200})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})      # plane 1
+    client.post("/api/v2/airplanes/", json={"type_id": 2})      # plane 2
+    client.post("/api/v2/flights/", json=dict(flight_1, airplane_id=1))
+    client.post("/api/v2/flights/", json=dict(flight_2, airplane_id=2))
+    assert available_ids(client, 1) == [1, 2]
+
+    client.delete("/api/v2/airplanes/1")
+    assert available_ids(client, 1) == [2]
+
+    client.delete("/api/v2/airplane_types/2")
+    assert available_ids(client, 1) == []
+
+
+def test_availability_rebuild(client: TestClient, session: Session):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/flights/", json=flight_1)
+    session.query(FlightAvailability).delete()
+    session.commit()
+    assert available_ids(client, 1) == []
+
+    response = client.post("/api/v2/flights/available/rebuild")
+    assert response.status_code == 200
+    assert response.json() == {"flights": 1}
+    assert available_ids(client, 1) == [1]
+
+
+# ------------------------------------------------
+#                   Statistics
+# ------------------------------------------------
+
+
+def test_route_and_airport_stats(client: TestClient, monkeypatch):
+    monkeypatch.setattr(stats, "stats_cache", TTLCache(60))
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/flights/", json=dict(flight_1, departure_time="2030-01-10 08:00:00"))
+    client.post("/api/v2/flights/", json=dict(flight_2, departure_time="2030-02-10 08:00:00"))
+
+    response = client.get("/api/v2/stats/routes")
+    assert response.status_code == 200
+    assert response.json() == [{
+        "route_id": 1,
+        "origin_id": "JFK",
+        "destination_id": "LAX",
+        "flights": 2,
+        "reserved_seats": 140,
+        "average_load_factor": pytest.approx((28 / 150 + 112 / 150) / 2),
+        "revenue": round(28 * 121.47 + 112 * 289.34, 2),
+    }]
+
+    response = client.get("/api/v2/stats/airports?start=2030-01-01T00:00:00&end=2030-02-01T00:00:00")
+    assert response.status_code == 200
+    assert response.json() == [
+        {"iata_id": "JFK", "departures": 1, "arrivals": 0, "departing_passengers": 28, "arriving_passengers": 0,
+         "departure_revenue": round(28 * 121.47, 2)},
+        {"iata_id": "LAX", "departures": 0, "arrivals": 1, "departing_passengers": 0, "arriving_passengers": 28,
+         "departure_revenue": 0.0},
+    ]
+
+
+def test_departure_times_are_normalized_for_windows(client: TestClient, session: Session, monkeypatch):
+    monkeypatch.setattr(stats, "stats_cache", TTLCache(0))
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    response = client.post("/api/v2/flights/", json=dict(flight_1, departure_time="2030-01-10T08:00:00"))
+    assert response.json()["departure_time"] == "2030-01-10 08:00:00"
+    response = client.post("/api/v2/flights/", json=dict(flight_2, departure_time="2030-01-10T20:00:00-05:00"))
+    assert response.json()["departure_time"] == "2030-01-11 01:00:00"
+    assert client.post("/api/v2/flights/", json=dict(flight_1, departure_time="soon")).status_code == 422
+
+    def departures(start, end):
+        response = client.get("/api/v2/stats/routes", params={"start": start, "end": end})
+        return response.json()[0]["flights"] if response.json() else 0
+
+    assert departures("2030-01-10 08:00:00", "2030-01-10 09:00:00") == 1
+    assert departures("2030-01-10T00:00:00", "2030-01-11T00:00:00") == 1
+    assert departures("2030-01-11T00:00:00+00:00", "2030-01-12T00:00:00+00:00") == 1
+
+    client.patch("/api/v2/flights/2", json={"departure_time": "2030-01-10T12:00:00Z"})
+    assert departures("2030-01-10 00:00:00", "2030-01-11 00:00:00") == 2
+
+    # Written before the format was enforced.
+    session.execute(update(Flight.__table__).where(Flight.id == 1).values(departure_time="2030-01-10T23:00:00"))
+    session.execute(update(Flight.__table__).where(Flight.id == 2).values(departure_time="2030-01-10T20:00:00-05:00"))
+    session.commit()
+    assert departures("2030-01-10 00:00:00", "2030-01-10 23:30:00") == 0
+    stats.normalize_departure_times(session.get_bind())
+    assert departures("2030-01-10 00:00:00", "2030-01-10 23:30:00") == 1
+    assert departures("2030-01-11 00:00:00", "2030-01-12 00:00:00") == 1
+    session.expire_all()
+    assert [flight.departure_time for flight in session.query(Flight).order_by(Flight.id)] == [
+        "2030-01-10 23:00:00", "2030-01-11 01:00:00"
+    ]
+
+    # Applied once: later startups leave the table alone.
+    session.execute(update(Flight.__table__).where(Flight.id == 1).values(departure_time="2030-01-10T23:00:00"))
+    session.commit()
+    stats.normalize_departure_times(session.get_bind())
+    session.expire_all()
+    assert session.get(Flight, 1).departure_time == "2030-01-10T23:00:00"
+
+
+def test_stats_are_cached(client: TestClient, monkeypatch):
+    monkeypatch.setattr(stats, "stats_cache", TTLCache(60))
+    assert client.get("/api/v2/stats/routes").json() == []
+
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/airplane_types/", json={"max_capacity": 150})
+    client.post("/api/v2/airplanes/", json={"type_id": 1})
+    client.post("/api/v2/flights/", json=flight_1)
+    assert client.get("/api/v2/stats/routes").json() == []
+
+    stats.stats_cache.clear()
+    assert len(client.get("/api/v2/stats/routes").json()) == 1
+
+
+# ------------------------------------------------
+#                 Nearby Airports
+# ------------------------------------------------
+
+
+def test_nearby_airports(client: TestClient, session: Session):
+    spatial.airport_locator.load(session)
+    client.post("/api/v2/airports/", json=dict(airport_1, latitude=40.639801, longitude=-73.7789))
+    client.post("/api/v2/airports/", json=dict(airport_2, latitude=33.942501, longitude=-118.407997))
+    client.post("/api/v2/airports/", json={
+        "iata_id": "EWR", "city": "Newark, NJ", "name": "Newark Liberty International",
+        "latitude": 40.6925, "longitude": -74.168701, "elevation": 18
+    })
+
+    # Times Square
+    response = client.get("/api/v2/airports/nearby?lat=40.758&lon=-73.9855&k=2")
+    assert response.status_code == 200
+    data = response.json()
+    assert [airport["iata_id"] for airport in data] == ["EWR", "JFK"]
+    assert data[0]["distance_miles"] == pytest.approx(10.61, abs=0.01)
+
+    response = client.get("/api/v2/airports/nearby?lat=40.758&lon=-73.9855&radius=150")
+    assert [airport["iata_id"] for airport in response.json()] == ["EWR", "JFK"]
+
+    client.delete("/api/v2/airports/EWR")
+    client.patch("/api/v2/airports/LAX", json={"iata_id": "LGA", "latitude": 40.7769, "longitude": -73.874})
+    response = client.get("/api/v2/airports/nearby?lat=40.758&lon=-73.9855")
+    assert [airport["iata_id"] for airport in response.json()] == ["LGA", "JFK"]
+
+    assert client.get("/api/v2/airports/nearby?lat=91&lon=0").status_code == 422
+
+
+def test_kd_tree_matches_brute_force():
+    import random
+    random.seed(7)
+    points = [spatial.unit_vector(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(2000)]
+    tree = spatial.KDTree(points)
+
+    for _ in range(20):
+        target = spatial.unit_vector(random.uniform(-90, 90), random.uniform(-180, 180))
+        distances = sorted(
+            (sum((a - b) ** 2 for a, b in zip(target, point)), index) for index, point in enumerate(points)
+        )
+        assert [index for _, index in tree.nearest(target, 5)] == [index for _, index in distances[:5]]
+        radius = spatial.chord_for_miles(500)
+        assert [index for _, index in tree.within(target, radius)] == \
+               [index for distance, index in distances if distance <= radius * radius]
+
+
+# ------------------------------------------------
+#              Airport Autocomplete
+# ------------------------------------------------
+
+
+def autocomplete_ids(client: TestClient, query):
+    response = client.get("/api/v2/airports/autocomplete", params={"q": query})
+    assert response.status_code == 200
+    return [airport["iata_id"] for airport in response.json()]
+
+
+def test_airport_autocomplete(client: TestClient, session: Session):
+    autocomplete.airport_autocomplete.load(session)
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/airports/", json={
+        "iata_id": "SJO", "city": "San José", "name": "Juan Santamaría International",
+        "latitude": 9.99, "longitude": -84.2, "elevation": 3021
+    })
+
+    assert autocomplete_ids(client, "j") == ["JFK", "SJO"]      # IATA code before city/name words
+    assert autocomplete_ids(client, "jfk") == ["JFK"]
+    assert autocomplete_ids(client, "LOS ang") == ["LAX"]
+    assert autocomplete_ids(client, "santamaria") == ["SJO"]
+    assert autocomplete_ids(client, "san jose") == ["SJO"]
+    assert autocomplete_ids(client, "international") == ["JFK", "LAX", "SJO"]
+    assert autocomplete_ids(client, "new angeles") == []
+    assert autocomplete_ids(client, " - ") == []
+
+    client.patch("/api/v2/airports/LAX", json={"iata_id": "BUR", "name": "Hollywood Burbank"})
+    client.delete("/api/v2/airports/JFK")
+    assert autocomplete_ids(client, "los") == ["BUR"]
+    assert autocomplete_ids(client, "jfk") == []
+
+
+def test_airports_read_by_city(client: TestClient):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=dict(airport_2, iata_id="LGA", city=airport_1["city"]))
+
+    response = client.get("/api/v2/airports/city/New York, NY")
+    assert response.status_code == 200
+    assert [airport["iata_id"] for airport in response.json()] == ["JFK", "LGA"]
+
+
+def test_airport_delete_removes_routes_both_ways(client: TestClient):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.post("/api/v2/airports/", json=airport_2)
+    client.post("/api/v2/routes/", json=route_1)
+    client.post("/api/v2/routes/", json=route_2)
+
+    client.delete("/api/v2/airports/JFK")
+    assert client.get("/api/v2/routes/1").status_code == 404
+    assert client.get("/api/v2/routes/2").status_code == 404
+
+
+# ------------------------------------------------
+#                 Change Events
+# ------------------------------------------------
+
+
+def test_changes_record_events_in_their_transaction(client: TestClient, session: Session):
+    client.post("/api/v2/airports/", json=airport_1)
+    client.patch("/api/v2/airports/JFK", json={"name": "Kennedy", "elevation": 13})
+    client.delete("/api/v2/airports/JFK")
+
+    response = client.get("/api/v2/events/")
+    assert response.status_code == 200
+    events = response.json()
+    assert [(event["entity"], event["entity_id"], event["action"]) for event in events] == [
+        ("airport", "JFK", "created"), ("airport", "JFK", "updated"), ("airport", "JFK", "deleted")
+    ]
+    assert events[1]["payload"] == {"changed": ["name"]}        # elevation was set to what it already was
+
+    session.add(Airport(**airport_2))
+    session.flush()
+    session.rollback()
+    assert client.get("/api/v2/events/latest").json() == {"id": events[-1]["id"]}
+
+    assert client.get("/api/v2/events/", params={"after": events[0]["id"]}).json() == events[1:]
+    assert client.get("/api/v2/events/", params={"entity": "route"}).json() == []
+    assert client.get("/api/v2/events/", params={"entity": ["route", "airport"]}).json() == events
+    assert client.get("/api/v2/events/", params={"limit": 1001}).status_code == 422
+
+
+def test_relay_publishes_events_and_invalidates_airport_indexes(session: Session):
+    relay = outbox.OutboxRelay(outbox.LocalTransport())
+    received = []
+    relay.transport.subscribe(received.extend)
+    relay.transport.subscribe(invalidate_airport_indexes)
+
+    assert relay.poll(session) == 0                             # starts at the newest event
+    spatial.airport_locator.load(session)
+    session.add(Airport(**airport_1))                           # as written by another worker
+    session.commit()
+    assert spatial.airport_locator.loaded_at is not None
+
+    assert relay.poll(session) == 1
+    assert [(event["entity"], event["action"]) for event in received] == [("airport", "created")]
+    assert spatial.airport_locator.loaded_at is None
+    assert relay.poll(session) == 0
+
+
+def test_event_readers_wait_for_gaps_to_fill_or_age_out(client: TestClient, session: Session):
+    def add_event(event_id, age=0):
+        session.add(OutboxEvent(id=event_id, entity="airport", entity_id=str(event_id), action="created",
+                                created_at=datetime.utcnow() - timedelta(seconds=age)))
+        session.commit()
+
+    relay = outbox.OutboxRelay(outbox.LocalTransport())
+    received = []
+    relay.transport.subscribe(received.extend)
+    add_event(1)
+    assert relay.poll(session) == 0
+
+    # Event 3 commits while the transaction that took id 2 is still open.
+    add_event(3)
+    response = client.get("/api/v2/events/", params={"after": 1})
+    assert (response.json(), response.headers["X-Events-Cursor"]) == ([], "1")
+    assert client.get("/api/v2/events/latest").json() == {"id": 1}
+    assert relay.poll(session) == 0
+
+    add_event(2)
+    assert relay.poll(session) == 2
+    assert [event["id"] for event in received] == [2, 3]
+
+    # Id 4 was rolled back: once the event after it is old enough the gap is skipped.
+    add_event(5, age=outbox.OUTBOX_GAP_SECONDS + 1)
+    response = client.get("/api/v2/events/", params={"after": 3, "entity": "route"})
+    assert (response.json(), response.headers["X-Events-Cursor"]) == ([], "5")
+    assert relay.poll(session) == 1
+    assert [event["id"] for event in received] == [2, 3, 5]
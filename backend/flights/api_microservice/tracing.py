@@ -0,0 +1,241 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################            Tracing            ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# W3C trace context (https://www.w3.org/TR/trace-context/) for the FastAPI services. An incoming traceparent header
+# continues the caller's trace - the admin frontend sends one on every backend call - and each request becomes a server
+# span with a child span per SQL statement. Sampling is parent based: a sampled caller is always followed, and requests
+# without a sampled parent are sampled at TRACE_SAMPLE_RATE. Unsampled requests create no span objects at all.
+#
+# Finished spans go to the exporter picked by TRACE_EXPORTER:
+#   none    drop everything (the default)
+#   memory  keep the most recent spans in process, for tests
+#   file    append one JSON object per span to TRACE_FILE, for a local collector to tail
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .dbstats import normalize
+from .metrics import route_template
+
+SERVICE_NAME = os.getenv('SERVICE_NAME') or 'flights'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE') or 0.01)
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER') or 'none'
+TRACE_FILE = os.getenv('TRACE_FILE') or 'traces.jsonl'
+
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+SAMPLED_FLAG = 0x01
+
+
+# ------------------------------------------------
+#                     Spans
+# ------------------------------------------------
+
+
+class Span(object):
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "status")
+
+    def __init__(self, trace_id, parent_id, name, kind="internal", attributes=None):
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.status = "ok"
+
+    def child(self, name, kind="internal", attributes=None):
+        return Span(self.trace_id, self.span_id, name, kind, attributes)
+
+    def finish(self):
+        self.end = time.time_ns()
+        exporter.export(self)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "service": SERVICE_NAME,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start,
+            "duration_ms": round((self.end - self.start) / 1e6, 3) if self.end else None,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+# The active span of the current request, or None when the request is not sampled. Starlette copies the context into
+# the threadpool, so sync handlers and the statements they run see the request's span.
+current_span = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header):
+    """
+    :return: (trace_id, parent span_id, sampled) from a traceparent header, or None when it is missing or malformed
+    """
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+def should_sample(parent):
+    if parent is not None:
+        return parent[2]
+    return random.random() < TRACE_SAMPLE_RATE
+
+
+# ------------------------------------------------
+#                   Exporters
+# ------------------------------------------------
+
+
+class NoopExporter(object):
+
+    def export(self, span):
+        pass
+
+
+class MemoryExporter(object):
+
+    def __init__(self, size=10000):
+        # deque.append is atomic, so spans finished on threadpool workers need no lock.
+        self.spans = deque(maxlen=size)
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+    def clear(self):
+        self.spans.clear()
+
+
+class FileExporter(object):
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self.lock = Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self.lock:
+            with open(self.path, "a") as handle:
+                handle.write(line)
+
+
+EXPORTERS = {"none": NoopExporter, "memory": MemoryExporter, "file": FileExporter}
+
+exporter = EXPORTERS[TRACE_EXPORTER]()
+
+
+def set_exporter(new_exporter):
+    global exporter
+    exporter = new_exporter
+    return new_exporter
+
+
+# ------------------------------------------------
+#                Statement Spans
+# ------------------------------------------------
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+    parent = current_span.get()
+    if parent is not None:
+        conn.info.setdefault("statement_spans", []).append(parent.child("db.query", "client", {
+            "db.system": conn.dialect.name,
+            "db.statement": normalize(statement),
+        }))
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def finish_statement_span(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("statement_spans")
+    if spans:
+        spans.pop().finish()
+
+
+@event.listens_for(Engine, "handle_error")
+def fail_statement_span(exception_context):
+    spans = exception_context.connection.info.get("statement_spans") if exception_context.connection else None
+    if spans:
+        span = spans.pop()
+        span.status = "error"
+        span.finish()
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+class TracingMiddleware(object):
+    """
+    Pure ASGI middleware opening the server span of each sampled request. The span is named after the route template
+    once routing has happened, and its context is returned in a traceresponse header so callers can find the trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+
+        if not should_sample(parent):
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id = (parent[0], parent[1]) if parent else ("%032x" % random.getrandbits(128), None)
+        span = Span(trace_id, parent_id, scope["method"], "server", {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        })
+        token = current_span.set(span)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.status = "error"
+                headers = list(message.get("headers", []))
+                headers.append((b"traceresponse", span.traceparent().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            span.status = "error"
+            raise
+        finally:
+            current_span.reset(token)
+            span.attributes["http.route"] = route_template(scope)
+            span.name = f"{scope['method']} {span.attributes['http.route']}"
+            span.finish()
@@ -0,0 +1,53 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################           TTL Cache           ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# A small thread-safe cache whose entries expire ttl seconds after they were stored, for results that are expensive to
+# compute and may be slightly stale. The least recently stored entry is dropped once maxsize is reached. Each worker
+# process has its own cache.
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+
+    def __init__(self, ttl, maxsize=128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Concurrent misses on the same key may each compute the value; the last one stored wins.
+        :return: the cached value, or the value just computed by compute()
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,158 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################            Warm-Up            ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Pays the one-off costs of a fresh process before it takes traffic: opens WARMUP_CONNECTIONS pool connections,
+# configures every SQLAlchemy mapper, pushes a sample object through each route's response_model validation and JSON
+# encoding, and runs the cache primers other modules register with register_warmup(). It runs on a background thread
+# started by the startup hook, so /health answers at once while /ready stays 503 until the warm-up has succeeded. A
+# failed attempt (typically the database not accepting connections yet) is logged and retried.
+import datetime
+import logging
+import os
+import threading
+import time
+import typing
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS') or 5)
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS') or 5)
+
+logger = logging.getLogger(__name__)
+
+warmup_hooks = []
+
+
+class WarmupState(object):
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.attempts = 0
+        self.seconds = None
+        self.error = None
+
+
+state = WarmupState()
+
+
+def register_warmup(hook):
+    """
+    Adds a callable taking the engine to the warm-up, for caches that should be filled before the first request.
+    Usable as a decorator.
+    :return: the hook
+    """
+    warmup_hooks.append(hook)
+    return hook
+
+
+# ------------------------------------------------
+#                     Steps
+# ------------------------------------------------
+
+
+def open_connections(engine, count):
+    """
+    Checks out up to count connections at once (bounded by the pool size, so nothing overflows) and returns them to
+    the pool, each having made one round trip to the database.
+    """
+    size = getattr(engine.pool, "size", None)
+    count = min(count, size()) if callable(size) else count
+
+    connections = []
+    try:
+        for _ in range(max(count, 1)):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+SAMPLE_VALUES = {
+    int: 0,
+    float: 0.0,
+    str: "",
+    bool: False,
+    datetime.date: datetime.date(2000, 1, 1),
+    datetime.datetime: datetime.datetime(2000, 1, 1),
+}
+
+
+def sample_for(field):
+    if not field.required:
+        return field.get_default()
+    return SAMPLE_VALUES.get(field.outer_type_, SAMPLE_VALUES.get(field.type_))
+
+
+def sample_payload(model):
+    return {name: sample_for(field) for name, field in model.__fields__.items()}
+
+
+def exercise_response_models(app):
+    """
+    Validates and encodes one sample per response_model, the same work FastAPI does per response, so the first real
+    response does not pay for building validators and encoders.
+    :return: number of routes exercised
+    """
+    exercised = 0
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or route.response_field is None:
+            continue
+
+        model = route.response_model
+        is_list = typing.get_origin(model) in (list, typing.List)
+        item_model = typing.get_args(model)[0] if is_list else model
+        if not hasattr(item_model, "__fields__"):
+            continue
+
+        payload = sample_payload(item_model)
+        value, errors = route.response_field.validate([payload] if is_list else payload, {}, loc=("response",))
+        if not errors:
+            jsonable_encoder(value)
+            exercised += 1
+    return exercised
+
+
+def run_warmup(app, engine):
+    started = time.perf_counter()
+    connections = open_connections(engine, WARMUP_CONNECTIONS)
+    configure_mappers()
+    models = exercise_response_models(app)
+    for hook in warmup_hooks:
+        hook(engine)
+
+    state.seconds = time.perf_counter() - started
+    state.error = None
+    state.ready.set()
+    logger.info(
+        "Warm-up finished in %.2fs: %d connections, %d response models, %d cache primers",
+        state.seconds, connections, models, len(warmup_hooks)
+    )
+
+
+def warmup_loop(app, engine):
+    while not state.ready.is_set():
+        state.attempts += 1
+        try:
+            run_warmup(app, engine)
+        except Exception as e:
+            state.error = repr(e)
+            logger.warning("Warm-up attempt %d failed, retrying in %ss: %r", state.attempts, WARMUP_RETRY_SECONDS, e)
+            time.sleep(WARMUP_RETRY_SECONDS)
+
+
+def is_ready():
+    return state.ready.is_set()
+
+
+def start_warmup(app, engine):
+    thread = threading.Thread(target=warmup_loop, args=(app, engine), name="warmup", daemon=True)
+    thread.start()
+    return thread
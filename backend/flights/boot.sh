@@ -56,4 +56,13 @@ export FLIGHTS_API="http://flights:5000/api"
 export BOOKINGS_API="http://bookings:5000/api"
 export USERS_API="http://users:5000/api"
 
+echo ""
+echo "Launching the service..."
+# SERVER_MODE=production runs gunicorn with one uvicorn worker per core available to the container, as configured in
+# gunicorn_conf.py; any other value keeps the single-process development server.
+if [ "$SERVER_MODE" = "production" ]; then
+  echo " └─ production mode: gunicorn with uvicorn workers."
+  exec gunicorn api_microservice.main:app --config gunicorn_conf.py
+fi
+echo " └─ development mode: single uvicorn process."
 exec uvicorn api_microservice.main:app
\ No newline at end of file
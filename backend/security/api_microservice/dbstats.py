@@ -0,0 +1,191 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################        Query Statistics       ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Counts every SQL statement a request issues and the time spent in the database driver, using SQLAlchemy's cursor
+# events on the Engine class (so every engine in the process is covered, the tests' included). The numbers travel back
+# in X-DB-Query-Count / X-DB-Time-ms response headers and into the /metrics histograms, and requests that blow the
+# query budget or repeat one statement shape over and over (the classic N+1 lazy-load or delete loop) are flagged.
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import REGISTRY, Counter, Histogram, route_template
+
+QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET') or 20)
+REPEATED_STATEMENT_LIMIT = int(os.getenv('DB_REPEATED_STATEMENT_LIMIT') or 5)
+SLOW_QUERY_SECONDS = float(os.getenv('DB_SLOW_QUERY_MS') or 100) / 1000
+SLOW_QUERY_LOG_SIZE = int(os.getenv('DB_SLOW_QUERY_LOG_SIZE') or 200)
+
+logger = logging.getLogger(__name__)
+
+QUERIES = REGISTRY.register(Histogram(
+    "db_queries_per_request", "SQL statements issued while handling one request.",
+    ("method", "route"), (1, 2, 3, 5, 10, 20, 50, 100)
+))
+DB_TIME = REGISTRY.register(Histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL while handling one request.",
+    ("method", "route")
+))
+FLAGGED = REGISTRY.register(Counter(
+    "db_flagged_requests_total", "Requests over the query budget or repeating one statement shape too often.",
+    ("method", "route", "reason")
+))
+
+# Statements slower than DB_SLOW_QUERY_MS, newest last. deque.append is atomic, so worker threads can record into it.
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+# ------------------------------------------------
+#               Statement Shapes
+# ------------------------------------------------
+
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+PARAMETERS = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+")
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(statement):
+    """
+    Reduces a statement to its shape: literals and bind parameters become ?, IN lists collapse to a single (?), and
+    whitespace is squeezed. Two lazy loads of different rows therefore produce the same shape.
+    :return: the normalized statement
+    """
+    shape = WHITESPACE.sub(" ", statement).strip()
+    shape = LITERALS.sub("?", shape)
+    shape = PARAMETERS.sub("?", shape)
+    return PLACEHOLDER_LISTS.sub("(?)", shape)
+
+
+# ------------------------------------------------
+#               Per-Request Stats
+# ------------------------------------------------
+
+
+class RequestQueryStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = {}
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.seconds += elapsed
+        shape = normalize(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def flags(self):
+        reasons = []
+        if self.count > QUERY_BUDGET:
+            reasons.append("budget")
+        if self.shapes and max(self.shapes.values()) >= REPEATED_STATEMENT_LIMIT:
+            reasons.append("repeated")
+        return reasons
+
+    def most_repeated(self):
+        return max(self.shapes.items(), key=lambda item: item[1]) if self.shapes else (None, 0)
+
+
+# The stats object is created on the event loop; starlette copies the context into the threadpool worker that runs a
+# sync endpoint, so the handler's statements land on the same object.
+current_stats = ContextVar("current_query_stats", default=None)
+
+
+# ------------------------------------------------
+#                 Engine Events
+# ------------------------------------------------
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+    if elapsed >= SLOW_QUERY_SECONDS:
+        shape = normalize(statement)
+        slow_queries.append({"statement": shape, "ms": round(elapsed * 1000, 3), "at": time.time()})
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, shape)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time so the stack stays balanced.
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+class QueryStatsMiddleware(object):
+    """
+    Pure ASGI middleware installing a fresh RequestQueryStats for each request. The handler has finished its queries
+    by the time the response starts, so the totals are written into the response headers there.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = current_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.3f}".encode()))
+                flags = stats.flags()
+                if flags:
+                    headers.append((b"x-db-flags", ",".join(flags).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_stats.reset(token)
+            self.observe(scope, stats)
+
+    @staticmethod
+    def observe(scope, stats):
+        labels = (scope["method"], route_template(scope))
+        QUERIES.observe(labels, stats.count)
+        DB_TIME.observe(labels, stats.seconds)
+
+        flags = stats.flags()
+        for reason in flags:
+            FLAGGED.inc(labels + (reason,))
+        if flags:
+            shape, repeats = stats.most_repeated()
+            logger.warning(
+                "%s %s issued %d statements in %.1f ms (%s); most repeated x%d: %s",
+                labels[0], labels[1], stats.count, stats.seconds * 1000, ",".join(flags), repeats, shape
+            )
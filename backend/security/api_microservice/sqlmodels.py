@@ -60,6 +60,7 @@ class UserRoleBase(SQLModel):
 
 
 class UserRole(UserRoleBase, table=True):
+    __tablename__ = "user_role"
     id: Optional[int] = Field(default=None, primary_key=True)
 
 
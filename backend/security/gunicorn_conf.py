@@ -0,0 +1,85 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################     Gunicorn Configuration    ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Production server settings, used by boot.sh when SERVER_MODE=production. Gunicorn manages one uvicorn worker per
+# core the container may actually use; each worker runs uvloop and httptools when they are installed (uvicorn[standard])
+# and falls back to asyncio and h11 otherwise. Workers are recycled after a jittered number of requests so they never
+# restart in lockstep, and a worker that stops heartbeating for GUNICORN_TIMEOUT seconds is replaced.
+#
+# The app is deliberately not preloaded: every worker imports it after the fork and so opens its own database pool.
+# Each worker also keeps its own /metrics counters, so scrape the pod often enough to catch every worker.
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def read_file(path):
+    try:
+        with open(path) as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """
+    The CPU limit of the container, from cgroup v2 (cpu.max: "<quota> <period>" or "max <period>") or else cgroup v1
+    (cpu.cfs_quota_us / cpu.cfs_period_us, where a quota of -1 means unlimited).
+    :return: the limit in cores, possibly fractional, or None when unlimited or unknown
+    """
+    cpu_max = read_file(os.path.join(root, "cpu.max"))
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+
+    quota = read_file(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+    period = read_file(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0 and int(period) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cores(root=CGROUP_ROOT):
+    """
+    The cores this process may run on (its CPU affinity, not the host's core count), further bounded by the cgroup
+    quota rounded up - a 1.5 core limit still benefits from a second worker.
+    :return: the core count, at least 1
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit(root)
+    if limit:
+        cores = min(cores, math.ceil(limit))
+    return max(1, cores)
+
+
+# ------------------------------------------------
+#                    Settings
+# ------------------------------------------------
+
+
+bind = f"{os.getenv('HOST') or '0.0.0.0'}:{os.getenv('PORT') or 8000}"
+workers = int(os.getenv('WEB_CONCURRENCY') or available_cores())
+worker_class = "uvicorn.workers.UvicornWorker"
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT') or 60)
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE') or 5)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS') or 10000)
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER') or 1000)
+
+# Heartbeat files on tmpfs: a container's overlay filesystem can stall the fchmod heartbeat long enough to get healthy
+# workers killed.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+loglevel = os.getenv('LOG_LEVEL') or "info"
+errorlog = "-"
+accesslog = "-" if os.getenv('ACCESS_LOG') else None
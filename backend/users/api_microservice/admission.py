@@ -0,0 +1,210 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################       Admission Control       ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Load shedding in front of the database pool. A request only gets in while fewer than the concurrency limit are being
+# handled, the limit defaulting to what the engine's pool can serve at once (pool size plus overflow). Anything beyond
+# that would only wait in the threadpool and then for a connection, holding memory and making every caller slower, so
+# it is refused straight away with 503 and Retry-After and the client backs off.
+#
+# Requests are ranked into priority classes, and the lower classes may only fill part of the limit:
+#
+#   - critical: writes to bookings, their guests, payments and passengers (checkout) - the whole limit
+#   - normal:   single-item reads and every other write - NORMAL_SHARE of it
+#   - low:      list views, searches, reports, rebuilds and debug endpoints - LOW_SHARE of it
+#
+# so under overload the list views are shed first and checkout keeps the headroom left above them. On top of that each
+# client (its Authorization header, else its address) has a token bucket of ADMISSION_CLIENT_BURST requests refilled
+# at ADMISSION_CLIENT_RATE per second; a client that empties it gets 429 with Retry-After, whatever the load. The
+# defaults leave room for the admin frontend, which calls from one address for all of its users; set the rate to 0
+# to turn the buckets off.
+#
+# The counters are only touched on the event loop thread (pure ASGI middleware), so they need no locks. Health,
+# readiness and metrics endpoints are never shed.
+import hashlib
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+
+from .metrics import REGISTRY, Counter, Gauge
+
+ADMISSION_CONCURRENCY = int(os.getenv('ADMISSION_CONCURRENCY') or 0)
+ADMISSION_NORMAL_SHARE = float(os.getenv('ADMISSION_NORMAL_SHARE') or 0.8)
+ADMISSION_LOW_SHARE = float(os.getenv('ADMISSION_LOW_SHARE') or 0.5)
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER') or 1)
+ADMISSION_CLIENT_RATE = float(os.getenv('ADMISSION_CLIENT_RATE') or 200)
+ADMISSION_CLIENT_BURST = float(os.getenv('ADMISSION_CLIENT_BURST') or 400)
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS') or 10000)
+
+# Used when the pool cannot tell its size, as with the StaticPool and NullPool.
+DEFAULT_CONCURRENCY = 15
+
+EXEMPT_PATHS = ("/", "/health", "/ready", "/metrics")
+CRITICAL_WRITES = re.compile(r"^/api/v2/(bookings|booking_guests|booking_payments|passengers)/")
+LOW_PRIORITY = re.compile(r"/(search|stats|autocomplete|nearby|available|reindex|rebuild|reprice)\b|^/debug/")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+SHED = REGISTRY.register(Counter(
+    "admission_shed_total", "Requests refused by admission control, by priority class and reason.",
+    ("priority", "reason")
+))
+ADMITTED = REGISTRY.register(Gauge(
+    "admission_in_flight", "Requests admitted and not yet finished."
+))
+
+
+def pool_capacity(engine):
+    """
+    :return: the most connections the engine's pool hands out at once, or DEFAULT_CONCURRENCY if it cannot say
+    """
+    pool = getattr(engine, "pool", None)
+    try:
+        return pool.size() + max(pool._max_overflow, 0)
+    except (AttributeError, TypeError):
+        return DEFAULT_CONCURRENCY
+
+
+def classify(method, path):
+    """
+    :return: "critical", "normal" or "low"
+    """
+    if LOW_PRIORITY.search(path) or (method == "GET" and path.endswith("/")):
+        return "low"
+    if method in WRITE_METHODS and CRITICAL_WRITES.match(path):
+        return "critical"
+    return "normal"
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """
+        :return: 0 when a token was taken, otherwise the seconds until one is available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# ------------------------------------------------
+#                   Controller
+# ------------------------------------------------
+
+
+class AdmissionController(object):
+
+    def __init__(self, limit=None, rate=ADMISSION_CLIENT_RATE, burst=ADMISSION_CLIENT_BURST):
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst
+        self.in_flight = 0
+        self.buckets = OrderedDict()
+
+    def configure(self, engine):
+        if self.limit is None:
+            self.limit = ADMISSION_CONCURRENCY or pool_capacity(engine)
+
+    def capacity(self, priority):
+        limit = self.limit or DEFAULT_CONCURRENCY
+        if priority == "critical":
+            return limit
+        share = ADMISSION_NORMAL_SHARE if priority == "normal" else ADMISSION_LOW_SHARE
+        return max(1, int(limit * share))
+
+    def bucket(self, client, now):
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.rate, self.burst, now)
+            while len(self.buckets) > ADMISSION_MAX_CLIENTS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+        return bucket
+
+    def admit(self, priority, client, now=None):
+        """
+        Takes a slot for the request when it may run; release() must follow once it has finished.
+        :return: None when admitted, otherwise (status code, Retry-After seconds, reason)
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self.bucket(client, now) if self.rate > 0 else None
+        wait = bucket.take(now) if bucket is not None else 0
+        if wait:
+            SHED.inc((priority, "client_rate"))
+            return 429, math.ceil(wait), "Too many requests from this client"
+
+        if self.in_flight >= self.capacity(priority):
+            if bucket is not None:
+                # The token was not used; give it back.
+                bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+            SHED.inc((priority, "overload"))
+            return 503, ADMISSION_RETRY_AFTER, "Service overloaded, retry later"
+
+        self.in_flight += 1
+        ADMITTED.inc()
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+        ADMITTED.dec()
+
+
+admission_controller = AdmissionController()
+
+
+# ------------------------------------------------
+#                   Middleware
+# ------------------------------------------------
+
+
+class AdmissionMiddleware(object):
+    """
+    Pure ASGI middleware. Refusals are sent before the request body is read or any route runs.
+    """
+
+    def __init__(self, app, engine=None, controller=None):
+        self.app = app
+        self.controller = controller if controller is not None else admission_controller
+        self.controller.configure(engine)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization")
+        if authorization:
+            client = hashlib.sha256(authorization).hexdigest()
+        else:
+            client = (scope.get("client") or ("unknown",))[0]
+
+        priority = classify(scope["method"], scope["path"])
+        refusal = self.controller.admit(priority, client)
+        if refusal is not None:
+            status, retry_after, detail = refusal
+            body = b'{"detail":"' + detail.encode() + b'"}'
+            await send({"type": "http.response.start", "status": status, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -0,0 +1,44 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################       Fast JSON Listings      ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# The listing endpoints used to load full ORM objects, have FastAPI validate each one into the response_model (a
+# second pydantic pass, run in the threadpool), walk the result with jsonable_encoder and finally dump it with the
+# stdlib json module. project_rows() instead selects exactly the Read model's columns and turns each row straight into a
+# dict, which the endpoint returns through an ORJSONResponse. Returning a Response skips FastAPI's response_model
+# processing entirely, so those endpoints keep their response_model purely for the OpenAPI docs. The statement is built
+# with SQLAlchemy's own select(): sqlmodel's Select subclass opts out of the compiled statement cache.
+from sqlalchemy import select
+
+READ_COLUMNS = {}
+
+
+def read_columns(table, read_model):
+    """
+    The table columns backing each field of read_model, in the model's field order (which is the order the fields
+    appear in the JSON), computed once per pair.
+    :return: list of (field name, column)
+    """
+    key = (table, read_model)
+    columns = READ_COLUMNS.get(key)
+    if columns is None:
+        columns = READ_COLUMNS[key] = [
+            (name, table.__table__.c[name]) for name in read_model.__fields__ if name in table.__table__.c
+        ]
+    return columns
+
+
+def project_rows(session, table, read_model, *criteria, skip=0, limit=100):
+    """
+    Runs SELECT <read_model columns> FROM <table> WHERE <criteria> with the usual skip/limit paging.
+    :return: list of plain dicts shaped like read_model
+    """
+    columns = read_columns(table, read_model)
+    statement = select(*[column for _, column in columns])
+    if criteria:
+        statement = statement.where(*criteria)
+    rows = session.execute(statement.offset(skip).limit(limit)).all()
+
+    names = [name for name, _ in columns]
+    return [dict(zip(names, row)) for row in rows]
@@ -8,10 +8,25 @@ from typing import Optional, List
 
 from .sqlmodels import (
     User, UserRead, UserCreate, UserUpdate, UserAuth,
-    UserRole, UserRoleRead, UserRoleCreate, UserRoleUpdate
+    UserRole, UserRoleRead, UserRoleCreate, UserRoleUpdate,
+    OutboxEventRead
+)
+from .admission import AdmissionMiddleware
+from .compression import CompressionMiddleware
+from .idempotency import IdempotencyMiddleware
+from .dbstats import QueryStatsMiddleware, slow_queries
+from .fastjson import project_rows
+from .metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from .outbox import latest_event_id, read_events, start_relay, track
+from .tracing import TracingMiddleware
+from .warmup import is_ready, start_warmup
+from .profiling import (
+    ProfilingMiddleware, collapse, profile_dump, profile_report, require_profiling_token, sample_stacks
 )
 
 from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session, create_engine, SQLModel
 from werkzeug.security import generate_password_hash
 
@@ -19,6 +34,15 @@ SQLALCHEMY_DATABASE_URL = os.getenv('DB_ACCESS_URI') or "mysql+pymysql://root:ro
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 app = FastAPI()
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AdmissionMiddleware, engine=engine)
+app.add_middleware(ProfilingMiddleware)
+
+track(User, UserRole)
 
 
 # ######################################################################################################################
@@ -46,6 +70,8 @@ def get_session():
 @app.on_event("startup")
 def on_startup():
     SQLModel.metadata.create_all(engine)
+    start_warmup(app, engine)
+    start_relay(engine)
 
 
 # ------------------------------------------------
@@ -78,6 +104,113 @@ def health_check():
     return {"msg": "Healthy"}
 
 
+# ------------------------------------------------
+#                   Readiness
+# ------------------------------------------------
+
+
+@app.get("/ready",
+         tags=["infrastructure"],
+         summary="Readiness check url for EKS")
+def readiness_check():
+    """
+    Unlike /health this stays 503 until the startup warm-up has opened the database pool and primed the caches, so
+    traffic is only routed to an instance once its first requests will be fast.
+
+    :return: Generic readiness message JSON.
+    """
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="Warming up"
+        )
+    return {"msg": "Ready"}
+
+
+# ------------------------------------------------
+#                    Metrics
+# ------------------------------------------------
+
+
+@app.get("/metrics",
+         tags=["infrastructure"],
+         summary="Prometheus scrape url",
+         include_in_schema=False)
+async def metrics():
+    """
+    Request counts, in-flight requests, latency and response size histograms per route template, in the Prometheus
+    text format. Async on purpose: rendering then runs on the event loop thread, the only thread that updates them.
+
+    :return: Prometheus text exposition.
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+# ------------------------------------------------
+#                  Slow Queries
+# ------------------------------------------------
+
+
+@app.get("/debug/slow_queries",
+         tags=["infrastructure"],
+         summary="Recently logged slow SQL statements",
+         include_in_schema=False,
+         dependencies=[Depends(require_profiling_token)])
+async def get_slow_queries():
+    """
+    The most recent statements that ran longer than DB_SLOW_QUERY_MS, normalized so that no literal values leak.
+    Requires PROFILING_TOKEN to be set and sent back in the X-Profile-Token header.
+
+    :return: List of statement shapes with their duration in milliseconds, oldest first.
+    """
+    return list(slow_queries)
+
+
+# ------------------------------------------------
+#                   Profiling
+# ------------------------------------------------
+
+
+@app.get("/debug/profile",
+         tags=["infrastructure"],
+         summary="Sample every thread's stack for a while",
+         include_in_schema=False,
+         dependencies=[Depends(require_profiling_token)])
+async def profile_service(
+        seconds: float = Query(default=10, gt=0, le=60),
+        interval_ms: float = Query(default=5, ge=1, le=1000),
+        idle: bool = False):
+    """
+    Runs the sampling profiler across all threads for the given number of seconds. Requires PROFILING_TOKEN to be set
+    and sent back in the X-Profile-Token header.
+
+    :return: Collapsed stacks, one "frame;frame;... count" line per distinct stack.
+    """
+    counts = await run_in_threadpool(sample_stacks, seconds, interval_ms / 1000, idle)
+    return PlainTextResponse(collapse(counts))
+
+
+@app.get("/debug/profile/{profile_id}",
+         tags=["infrastructure"],
+         summary="Report of a request profiled with X-Profile",
+         include_in_schema=False,
+         dependencies=[Depends(require_profiling_token)])
+async def get_request_profile(
+        profile_id: str,
+        sort: str = Query(default="cumulative", regex="^(cumulative|tottime|ncalls)$"),
+        raw: bool = False):
+    """
+    :return: The pstats report of the request, or the binary pstats file when raw is set.
+    """
+    if raw:
+        return Response(
+            profile_dump(profile_id),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'}
+        )
+    return PlainTextResponse(profile_report(profile_id, sort))
+
+
 # ------------------------------------------------
 #                       Users
 # ------------------------------------------------
@@ -178,11 +311,7 @@ def get_user_by_username(username: str, session: Session = Depends(get_session))
 def get_users(skip: int = 0,
               limit: int = Query(default=100, lte=100),
               session: Session = Depends(get_session)):
-    users = session         \
-        .query(User)        \
-        .offset(skip)       \
-        .limit(limit)       \
-        .all()
+    users = project_rows(session, User, UserRead, skip=skip, limit=limit)
 
     # In python, an empty list is treated as a boolean False, so triggers if users is empty
     if not users:
@@ -191,7 +320,7 @@ def get_users(skip: int = 0,
             detail="No users found."
         )
 
-    return users
+    return ORJSONResponse(users)
 
 
 @app.get("/api/v2/users/role_id/{role_id}", response_model=List[UserRead], tags=["users"])
@@ -429,3 +558,22 @@ def delete_user_role(role_id: int, session: Session = Depends(get_session)):
     session.commit()
 
     return {'ok': True}
+
+
+# ------------------------------------------------
+#                  Change Events
+# ------------------------------------------------
+
+
+@app.get("/api/v2/events/", response_model=List[OutboxEventRead], tags=["events"])
+def get_events(after: int = 0,
+               entity: List[str] = Query(default=None),
+               limit: int = Query(default=500, le=1000),
+               session: Session = Depends(get_session)):
+    events, cursor = read_events(session, after, entity, limit)
+    return ORJSONResponse(events, headers={"X-Events-Cursor": str(cursor)})
+
+
+@app.get("/api/v2/events/latest", tags=["events"])
+def get_latest_event(session: Session = Depends(get_session)):
+    return {"id": latest_event_id(session)}
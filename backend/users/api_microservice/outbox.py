@@ -0,0 +1,294 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################       Transactional Outbox     ##############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Change events for the rows this service owns, so other services and the admin frontend can drop exactly the cached
+# copies that went stale instead of expiring everything on a short TTL.
+#
+# Every flush of an ORM session that creates, changes or deletes an instance of a tracked model writes one
+# outbox row per instance on the flush's own connection - so an event is committed together with its change, and
+# rolled back with it. Events carry the entity (table name), its primary key, the action and, for updates, the names
+# (never the values) of the changed fields. Bulk UPDATE/DELETE statements bypass the ORM and record no events.
+#
+# The outbox table is the durable, ordered log. The services share a database, so each has its own table
+# (<service>_outbox_event) that only it reads and prunes. Consumers outside the process read it through the service's
+# /api/v2/events/ feed with a cursor, optionally narrowed to some entities. Inside the process a relay thread tails it
+# every OUTBOX_POLL_SECONDS and hands each batch to the transport chosen by OUTBOX_TRANSPORT:
+#
+#   - local: calls the callbacks registered with subscribe() in this process
+#   - file:  does the same, and also appends each event once, as a JSON line, to OUTBOX_FILE for other processes to tail
+#
+# Other transports (a message broker) plug in through register_transport(). The relay only starts when something
+# receives its events, so not for a local transport without subscribers. Delivery is at least once and in id order;
+# subscribers must tolerate repeats. Events older than OUTBOX_RETENTION_HOURS are pruned.
+#
+# Ids are taken when a transaction inserts its events but only become visible when it commits, so an event can turn up
+# below ids a reader has already passed. Readers therefore only go as far as the settled id: the end of the run of ids
+# above their cursor with no gap in it. A gap is waited for until the event after it is OUTBOX_GAP_SECONDS old - the
+# missing one was then inserted by a transaction open at least that long, or rolled back - and is skipped after that.
+# The feed returns the cursor to carry on from in its X-Events-Cursor header.
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from .sqlmodels import OutboxEvent
+
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS') or 1)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE') or 500)
+OUTBOX_RETENTION_HOURS = float(os.getenv('OUTBOX_RETENTION_HOURS') or 24)
+OUTBOX_TRANSPORT = os.getenv('OUTBOX_TRANSPORT') or "local"
+OUTBOX_FILE = os.getenv('OUTBOX_FILE') or f"{OutboxEvent.__tablename__}.jsonl"
+OUTBOX_GAP_SECONDS = float(os.getenv('OUTBOX_GAP_SECONDS') or 60)
+
+PRUNE_INTERVAL_SECONDS = 3600
+
+logger = logging.getLogger(__name__)
+
+# model class -> entity name
+tracked_models = {}
+
+
+def track(*models):
+    for model in models:
+        tracked_models[model] = model.__tablename__
+
+
+# ------------------------------------------------
+#                   Recording
+# ------------------------------------------------
+
+
+def event_row(instance, action, changed=None):
+    mapper = inspect(instance).mapper
+    key = mapper.primary_key_from_instance(instance)
+    return {
+        "entity": tracked_models[type(instance)],
+        "entity_id": ":".join(str(part) for part in key),
+        "action": action,
+        "payload": json.dumps({"changed": changed} if changed is not None else {}),
+        "created_at": datetime.datetime.utcnow(),
+    }
+
+
+def changed_fields(instance):
+    state = inspect(instance)
+    return sorted(attribute.key for attribute in state.mapper.column_attrs
+                  if state.attrs[attribute.key].history.has_changes())
+
+
+@event.listens_for(Session, "after_flush")
+def record_changes(session, flush_context):
+    # After the flush new rows have their keys, while new/dirty/deleted and the attribute history still describe it.
+    rows = []
+    for instance in session.new:
+        if type(instance) in tracked_models:
+            rows.append(event_row(instance, "created"))
+    for instance in session.dirty:
+        if type(instance) in tracked_models:
+            changed = changed_fields(instance)
+            if changed:
+                rows.append(event_row(instance, "updated", changed))
+    for instance in session.deleted:
+        if type(instance) in tracked_models:
+            rows.append(event_row(instance, "deleted"))
+
+    if rows:
+        session.connection().execute(insert(OutboxEvent.__table__), rows)
+
+
+def gap_cutoff(now=None):
+    return (now or datetime.datetime.utcnow()) - datetime.timedelta(seconds=OUTBOX_GAP_SECONDS)
+
+
+def settled_id(session, after, limit=OUTBOX_BATCH_SIZE, now=None):
+    """
+    :return: the id up to which the next limit events above after have no gap still worth waiting for
+    """
+    cutoff = gap_cutoff(now)
+    rows = session.execute(
+        select(OutboxEvent.id, OutboxEvent.created_at)
+        .where(OutboxEvent.id > after)
+        .order_by(OutboxEvent.id)
+        .limit(limit)
+    ).all()
+    settled = after
+    for event_id, created_at in rows:
+        if event_id != settled + 1 and created_at > cutoff:
+            break
+        settled = event_id
+    return settled
+
+
+def read_events(session, after=0, entity=None, limit=OUTBOX_BATCH_SIZE, now=None):
+    """
+    :return: the settled events with ids above after (of the given entities, if any), oldest first, as plain dicts, and
+    the cursor to read on from
+    """
+    settled = settled_id(session, after, limit, now)
+    statement = select(OutboxEvent) \
+        .where(OutboxEvent.id > after, OutboxEvent.id <= settled) \
+        .order_by(OutboxEvent.id) \
+        .limit(limit)
+    if entity:
+        statement = statement.where(OutboxEvent.entity.in_(entity))
+    events = [
+        {
+            "id": row.id, "entity": row.entity, "entity_id": row.entity_id, "action": row.action,
+            "payload": json.loads(row.payload), "created_at": row.created_at,
+        }
+        for row in session.execute(statement).scalars()
+    ]
+    return events, events[-1]["id"] if len(events) == limit else settled
+
+
+def latest_event_id(session, now=None):
+    """
+    :return: the settled id of the newest events, where a reader starting now begins
+    """
+    # Below the newest event older than the gap window every gap is given up on, so settling starts from there.
+    anchor = session.execute(
+        select(func.max(OutboxEvent.id)).where(OutboxEvent.created_at <= gap_cutoff(now))
+    ).scalar() or 0
+    while True:
+        settled = settled_id(session, anchor, now=now)
+        if settled == anchor:
+            return settled
+        anchor = settled
+
+
+# ------------------------------------------------
+#                   Transports
+# ------------------------------------------------
+
+
+class LocalTransport(object):
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+
+    def publish(self, events):
+        for callback in self.subscribers:
+            try:
+                callback(events)
+            except Exception:
+                logger.exception("Outbox subscriber %r failed", callback)
+
+
+class FileTransport(LocalTransport):
+    """
+    Every worker's relay tails the same events, so the file is appended under an exclusive lock and only with events
+    beyond the last id already written, which is kept in a companion .last file.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def publish(self, events):
+        with open(self.path + ".last", "a+") as last:
+            fcntl.flock(last, fcntl.LOCK_EX)
+            last.seek(0)
+            written = int(last.read() or 0)
+            new = [item for item in events if item["id"] > written]
+            if new:
+                with open(self.path, "a") as log:
+                    for item in new:
+                        log.write(json.dumps(item, default=str) + "\n")
+                last.seek(0)
+                last.truncate()
+                last.write(str(new[-1]["id"]))
+        super().publish(events)
+
+
+transports = {
+    "local": LocalTransport,
+    "file": lambda: FileTransport(OUTBOX_FILE),
+}
+
+
+def register_transport(name, factory):
+    transports[name] = factory
+
+
+# ------------------------------------------------
+#                     Relay
+# ------------------------------------------------
+
+
+class OutboxRelay(object):
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.cursor = None
+        self.pruned_at = 0.0
+
+    def poll(self, session):
+        """
+        Publishes the next batch of events. The first poll starts at the newest event: nothing cached in this process
+        predates it.
+        :return: the number of events published
+        """
+        if self.cursor is None:
+            self.cursor = latest_event_id(session)
+            return 0
+
+        events, self.cursor = read_events(session, self.cursor)
+        if events:
+            self.transport.publish(events)
+        return len(events)
+
+    def prune(self, session):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=OUTBOX_RETENTION_HOURS)
+        session.execute(delete(OutboxEvent.__table__).where(OutboxEvent.created_at < cutoff))
+        session.commit()
+
+    def run(self, engine):
+        failing = False
+        while True:
+            try:
+                with Session(engine) as session:
+                    published = self.poll(session)
+                    if time.monotonic() - self.pruned_at > PRUNE_INTERVAL_SECONDS:
+                        self.prune(session)
+                        self.pruned_at = time.monotonic()
+                failing = False
+            except Exception as e:
+                if not failing:
+                    logger.warning("Outbox relay cannot read events, retrying every %ss: %r", OUTBOX_POLL_SECONDS, e)
+                failing = True
+                published = 0
+            if published < OUTBOX_BATCH_SIZE:
+                time.sleep(OUTBOX_POLL_SECONDS)
+
+
+relay = OutboxRelay(transports[OUTBOX_TRANSPORT]())
+
+
+def subscribe(callback):
+    """
+    Registers callback(events) for every batch the relay publishes; usable as a decorator.
+    """
+    return relay.transport.subscribe(callback)
+
+
+def start_relay(engine):
+    """
+    :return: the relay thread, or None when a local transport has no subscribers to publish to
+    """
+    if type(relay.transport) is LocalTransport and not relay.transport.subscribers:
+        return None
+    thread = threading.Thread(target=relay.run, args=(engine,), name="outbox-relay", daemon=True)
+    thread.start()
+    return thread
@@ -1,5 +1,7 @@
+from datetime import datetime
 from typing import Optional, List
 
+from sqlalchemy import Column, Text
 from sqlmodel import Field, SQLModel, Relationship
 
 
@@ -74,3 +76,26 @@ class UserRoleRead(UserRoleBase):
 
 class UserRoleUpdate(SQLModel):
     name: Optional[str] = None
+
+
+# ------------------------------------------------
+#                 Outbox Events
+# ------------------------------------------------
+
+
+class OutboxEventBase(SQLModel):
+    entity: str = Field(index=True, max_length=64)
+    entity_id: str = Field(max_length=64)
+    action: str = Field(max_length=16)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class OutboxEvent(OutboxEventBase, table=True):
+    __tablename__ = "users_outbox_event"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    payload: str = Field(default="{}", sa_column=Column(Text, nullable=False))
+
+
+class OutboxEventRead(OutboxEventBase):
+    id: int
+    payload: dict
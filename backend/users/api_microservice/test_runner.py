@@ -92,6 +92,20 @@ def test_health_check(client: TestClient):
     assert response.json() == {"msg": "Healthy"}
 
 
+def test_metrics(client: TestClient):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in response.text
+
+
+def test_query_stats_headers(client: TestClient):
+    response = client.get("/api/v2/users/1")
+    assert response.status_code == 404
+    assert response.headers["x-db-query-count"] == "1"
+    assert "x-db-time-ms" in response.headers
+
+
 # ------------------------------------------------
 #                     Empty DB
 # ------------------------------------------------
@@ -165,6 +179,23 @@ def test_create_existing_user(client: TestClient):
     assert response.json() == {"detail": "That email is already in use."}
 
 
+def test_user_create_retried_with_idempotency_key(client: TestClient, session: Session):
+    client.post("/api/v2/user_roles/", json={"name": "admin"})
+    headers = {"Idempotency-Key": "create-user-1"}
+
+    first = client.post("/api/v2/users/", json=test_user_data, headers=headers)
+    retry = client.post("/api/v2/users/", json=test_user_data, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.headers["x-db-query-count"] == "0"
+    assert session.query(User).count() == 1
+
+    response = client.post("/api/v2/users/", json=test_user_data_2, headers=headers)
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Idempotency-Key was already used for a different request"}
+
+
 # --------------------   Read   ------------------
 
 
@@ -286,6 +317,19 @@ def test_update_user(client: TestClient):
     assert data["id"] is not None
 
 
+def test_update_user_records_change_event(client: TestClient):
+    client.post("/api/v2/user_roles/", json={"name": "admin"})
+    client.post("/api/v2/user_roles/", json={"name": "guest"})
+    client.post("/api/v2/users/", json=test_user_data)
+    after = client.get("/api/v2/events/latest").json()["id"]
+
+    client.patch("/api/v2/users/1", json={"phone": "555-765-4321"})
+
+    events = client.get("/api/v2/events/", params={"after": after}).json()
+    assert [(event["entity"], event["entity_id"], event["action"]) for event in events] == [("user", "1", "updated")]
+    assert events[0]["payload"] == {"changed": ["phone"]}
+
+
 # --------------------  Delete  ------------------
 
 
@@ -6,6 +6,8 @@
 # ########################################                               ###############################################
 # ######################################################################################################################
 from config import Config
+from events import start_event_feeds
+from tracing import init_tracing
 
 from flask_bootstrap import Bootstrap
 from flask import Flask
@@ -14,6 +16,8 @@ app = Flask(__name__)
 app.config.from_object(Config)
 
 bootstrap = Bootstrap(app)
+init_tracing(app)
+start_event_feeds()
 
 # Adding the routes to the app
 from routes import *
@@ -0,0 +1,66 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################         Fragment Cache        ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+import os
+import time
+from threading import Lock
+
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL") or 300)
+
+
+class FragmentCache(object):
+    """
+    Small in-process cache for rendered HTML fragments.
+
+    Entries expire after their TTL and can be dropped early with invalidate(). Each gunicorn worker holds its own
+    cache; the backends' change events (events.py) invalidate it in every worker, and the TTL bounds staleness should
+    an event be missed.
+    """
+
+    def __init__(self, ttl=FRAGMENT_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self.invalidate(key)
+            return None
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+
+    def get_or_render(self, key, render, ttl=None):
+        """
+        Returns the cached fragment for key, calling render() and caching its result on a miss. Exceptions raised by
+        render() propagate and nothing is cached, so fallback content is never stored.
+        """
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value, ttl)
+
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,75 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################         Change Events         ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# Keeps every gunicorn worker's fragment cache in step with the backends. Each worker runs a thread that reads the
+# services' change-event feeds (/v2/events/) every EVENT_POLL_SECONDS, from the newest event at the time it started,
+# and drops the fragments rendered from any entity an event names - whichever worker, or whichever other client, made
+# the change. Reads ask only for the entities cached here, and each carries on from the cursor the feed returns in
+# X-Events-Cursor rather than from the last event: the feed holds back events behind a transaction still committing,
+# which the last id would step over. A feed is read until its cursor stops moving, so a burst of other changes cannot
+# hold invalidations back. While a service cannot be reached its fragments fall back on the cache TTL.
+import os
+import threading
+import time
+
+from cache import fragment_cache
+from networking import FLIGHTS_API, USERS_API
+from tracing import http
+
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS") or 2)
+
+# service API -> {entity: fragment cache key}
+FRAGMENTS_BY_ENTITY = {
+    FLIGHTS_API: {"airport": "airport", "airplane_type": "airplane_type"},
+    USERS_API: {"user_role": "user_role"},
+}
+
+
+class EventFeed(object):
+
+    def __init__(self, api, fragments):
+        self.api = api
+        self.fragments = fragments
+        self.cursor = None
+
+    def poll(self):
+        """
+        :return: whether the cursor moved, so there may be more to read
+        """
+        if self.cursor is None:
+            response = http.get(f"{self.api}/v2/events/latest", timeout=5)
+            response.raise_for_status()
+            self.cursor = response.json()["id"]
+            return False
+
+        params = {"after": self.cursor, "entity": sorted(self.fragments)}
+        response = http.get(f"{self.api}/v2/events/", params=params, timeout=5)
+        response.raise_for_status()
+        events = response.json()
+        stale = {self.fragments[event["entity"]] for event in events if event["entity"] in self.fragments}
+        if stale:
+            fragment_cache.invalidate(*stale)
+        cursor = int(response.headers["X-Events-Cursor"])
+        moved, self.cursor = cursor != self.cursor, cursor
+        return moved
+
+
+def follow(feeds):
+    while True:
+        for feed in feeds:
+            try:
+                while feed.poll():
+                    pass
+            except Exception:
+                # The service is down or restarting; the fragment TTL covers the gap.
+                pass
+        time.sleep(EVENT_POLL_SECONDS)
+
+
+def start_event_feeds():
+    feeds = [EventFeed(api, fragments) for api, fragments in FRAGMENTS_BY_ENTITY.items()]
+    thread = threading.Thread(target=follow, args=(feeds,), name="event-feeds", daemon=True)
+    thread.start()
+    return thread
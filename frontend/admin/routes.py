@@ -1,11 +1,13 @@
 import os
 from functools import wraps
+from cache import fragment_cache
 from forms import *
 from networking import *
+from tracing import http
 
 import jwt
-import requests
 from flask import render_template, request, redirect, url_for, make_response, jsonify
+from markupsafe import Markup
 from app import app
 
 
@@ -23,7 +25,7 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms="HS256")
-            db_user = jsonify(requests.get(f"{USERS_API}/users/{data['user_id']}"))
+            db_user = jsonify(http.get(f"{USERS_API}/users/{data['user_id']}"))
             identity = db_user.username
         except Exception as e:
             response_obj = {
@@ -54,15 +56,74 @@ def register():
     return render_template('register.html', title='Register', form=form)
 
 
-@app.route('/airport')
-def airport():
+def fetch_list(url):
+    response = http.get(url, timeout=5)
+
+    # The backends answer an empty listing with a 404, which for a management page simply means "nothing yet".
+    if response.status_code == 404:
+        return []
+
+    response.raise_for_status()
+    return response.json()
+
+
+def render_fragment(key, template, fetch, fallback):
+    """
+    Renders a reference-data table fragment through the fragment cache. When the backend call fails the fallback
+    rows are rendered instead and left uncached, so the next view retries the backend.
+    """
+    name = key + 's'
+
+    def render():
+        return render_template(template, **{name: fetch()})
+
     try:
-        airports = requests.get(f"{FLIGHTS_API}/airport/all")
+        fragment = fragment_cache.get_or_render(key, render)
     except Exception as e:
         print("Error loading values follows:")
         print(e)
         print("Loading dummy data...")
-        airports = [
+        fragment = render_template(template, **{name: fallback})
+
+    return Markup(fragment)
+
+
+def submit_change(method, url, cache_key, **kwargs):
+    try:
+        response = method(url, timeout=5, **kwargs)
+        response.raise_for_status()
+    except Exception as e:
+        print("Error submitting change follows:")
+        print(e)
+
+    fragment_cache.invalidate(cache_key)
+
+
+@app.route('/airport', methods=['GET', 'POST'])
+def airport():
+    form1 = AirportRegistrationForm(prefix='register')
+    form2 = AirportDeletionForm(prefix='delete')
+
+    if form1.submit.data and form1.validate():
+        submit_change(http.post, f"{FLIGHTS_API}/v2/airports/", 'airport', json={
+            'iata_id': form1.iata_id.data,
+            'city': form1.city.data,
+            'name': form1.name.data,
+            'longitude': form1.longitude.data,
+            'latitude': form1.latitude.data,
+            'elevation': form1.elevation.data
+        })
+        return redirect(url_for('airport'))
+
+    if form2.submit.data and form2.validate():
+        submit_change(http.delete, f"{FLIGHTS_API}/v2/airports/{form2.iata_id.data}", 'airport')
+        return redirect(url_for('airport'))
+
+    airport_table = render_fragment(
+        'airport',
+        'fragments/airport_table.html',
+        lambda: fetch_list(f"{FLIGHTS_API}/v2/airports/"),
+        [
             {
                 'iata_id': 'CLE',
                 'city': 'Cleveland, OH',
@@ -80,15 +141,14 @@ def airport():
                 'elevation': 13
             }
         ]
-    form1 = AirportRegistrationForm()
-    form2 = AirportDeletionForm()
-    return render_template('airport.html', title="Airport Management", form1=form1, form2=form2, airports=airports)
+    )
+    return render_template('airport.html', title="Airport Management", form1=form1, form2=form2, airport_table=airport_table)
 
 
 @app.route('/airplane')
 def airplane():
     try:
-        airplanes = requests.get(f"{FLIGHTS_API}/airplane/all")
+        airplanes = http.get(f"{FLIGHTS_API}/airplane/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -112,45 +172,55 @@ def airplane():
     return render_template('airplane.html', title="Airplane Management", form1=form1, form2=form2, airplanes=airplanes)
 
 
-@app.route('/airplane_type')
+@app.route('/airplane_type', methods=['GET', 'POST'])
 def airplane_type():
-    try:
-        airplane_types = requests.get(f"{FLIGHTS_API}/airplane_type/all")
-    except Exception as e:
-        print("Error loading values follows:")
-        print(e)
-        print("Loading dummy data...")
-        airplane_types = [
+    form1 = AirplaneTypeRegistrationForm(prefix='register')
+    form2 = AirplaneTypeDeletionForm(prefix='delete')
+
+    if form1.submit.data and form1.validate():
+        submit_change(http.post, f"{FLIGHTS_API}/v2/airplane_types/", 'airplane_type', json={
+            'max_capacity': form1.max_capacity.data
+        })
+        return redirect(url_for('airplane_type'))
+
+    if form2.submit.data and form2.validate():
+        submit_change(http.delete, f"{FLIGHTS_API}/v2/airplane_types/{form2.type_id.data}", 'airplane_type')
+        return redirect(url_for('airplane_type'))
+
+    airplane_type_table = render_fragment(
+        'airplane_type',
+        'fragments/airplane_type_table.html',
+        lambda: fetch_list(f"{FLIGHTS_API}/v2/airplane_types/"),
+        [
             {
-                'type_id': 737,
+                'id': 737,
                 'max_capacity': 188
             },
             {
-                'type_id': 747,
+                'id': 747,
                 'max_capacity': 515
             },
             {
-                'type_id': 767,
+                'id': 767,
                 'max_capacity': 247
             },
             {
-                'type_id': 777,
+                'id': 777,
                 'max_capacity': 380
             },
             {
-                'type_id': 787,
+                'id': 787,
                 'max_capacity': 274
             }
         ]
-    form1 = AirplaneTypeRegistrationForm()
-    form2 = AirplaneTypeDeletionForm()
-    return render_template('airplane_type.html', title="Airplane Type Management", form1=form1, form2=form2, airplane_types=airplane_types)
+    )
+    return render_template('airplane_type.html', title="Airplane Type Management", form1=form1, form2=form2, airplane_type_table=airplane_type_table)
 
 
 @app.route('/booking')
 def booking():
     try:
-        bookings = requests.get(f"{BOOKS_API}/booking/all")
+        bookings = http.get(f"{BOOKS_API}/booking/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -164,7 +234,7 @@ def booking():
 @app.route('/booking_guest')
 def booking_guest():
     try:
-        booking_guests = requests.get(f"{BOOKS_API}/booking_guest/all")
+        booking_guests = http.get(f"{BOOKS_API}/booking_guest/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -178,7 +248,7 @@ def booking_guest():
 @app.route('/booking_payment')
 def booking_payment():
     try:
-        booking_payments = requests.get(f"{BOOKS_API}/booking_payment/all")
+        booking_payments = http.get(f"{BOOKS_API}/booking_payment/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -192,7 +262,7 @@ def booking_payment():
 @app.route('/flight')
 def flight():
     try:
-        flights = requests.get(f"{FLIGHTS_API}/flight/all")
+        flights = http.get(f"{FLIGHTS_API}/flight/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -206,7 +276,7 @@ def flight():
 @app.route('/user')
 def user():
     try:
-        users = requests.get(f"{USERS_API}/user/all")
+        users = http.get(f"{USERS_API}/user/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -217,15 +287,26 @@ def user():
     return render_template('user.html', title="User Management", form1=form1, form2=form2, users=users)
 
 
-@app.route('/user_role')
+@app.route('/user_role', methods=['GET', 'POST'])
 def user_role():
-    try:
-        user_roles = requests.get(f"{FLIGHTS_API}/user_role/all")
-    except Exception as e:
-        print("Error loading values follows:")
-        print(e)
-        print("Loading dummy data...")
-        user_roles = [
+    form1 = UserRoleRegistrationForm(prefix='register')
+    form2 = UserRoleDeletionForm(prefix='delete')
+
+    if form1.submit.data and form1.validate():
+        submit_change(http.post, f"{USERS_API}/v2/user_roles/", 'user_role', json={
+            'name': form1.name.data
+        })
+        return redirect(url_for('user_role'))
+
+    if form2.submit.data and form2.validate():
+        submit_change(http.delete, f"{USERS_API}/v2/user_roles/{form2.id.data}", 'user_role')
+        return redirect(url_for('user_role'))
+
+    user_role_table = render_fragment(
+        'user_role',
+        'fragments/user_role_table.html',
+        lambda: fetch_list(f"{USERS_API}/v2/user_roles/"),
+        [
             {
                 'id': 1,
                 'name': 'admin'
@@ -239,15 +320,14 @@ def user_role():
                 'name': 'user'
             }
         ]
-    form1 = UserRoleRegistrationForm()
-    form2 = UserRoleDeletionForm()
-    return render_template('user_role.html', title="User Role Management", form1=form1, form2=form2, user_roles=user_roles)
+    )
+    return render_template('user_role.html', title="User Role Management", form1=form1, form2=form2, user_role_table=user_role_table)
 
 
 @app.route('/passenger')
 def passenger():
     try:
-        passengers = requests.get(f"{BOOKS_API}/passenger/all")
+        passengers = http.get(f"{BOOKS_API}/passenger/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -261,7 +341,7 @@ def passenger():
 @app.route('/route')
 def route():
     try:
-        routes = requests.get(f"{FLIGHTS_API}/route/all")
+        routes = http.get(f"{FLIGHTS_API}/route/all")
     except Exception as e:
         print("Error loading values follows:")
         print(e)
@@ -1,6 +1,11 @@
 import requests
 import json
 import unittest
+from unittest import mock
+
+import routes
+from app import app
+from cache import FragmentCache, fragment_cache
 
 
 class ApiTests(unittest.TestCase):
@@ -74,5 +79,82 @@ class ApiTests(unittest.TestCase):
     # ------------------------------------------------
 
 
+class FragmentCacheTests(unittest.TestCase):
+
+    def test_entries_expire_after_ttl(self):
+        cache = FragmentCache(ttl=60)
+        with mock.patch("cache.time.monotonic", return_value=1000.0):
+            cache.set('airport', '<table/>')
+            self.assertEqual(cache.get('airport'), '<table/>')
+        with mock.patch("cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get('airport'))
+
+    def test_invalidate_drops_only_named_keys(self):
+        cache = FragmentCache()
+        cache.set('airport', 'a')
+        cache.set('user_role', 'u')
+        cache.invalidate('airport', 'missing')
+        self.assertIsNone(cache.get('airport'))
+        self.assertEqual(cache.get('user_role'), 'u')
+
+    def test_get_or_render_renders_once(self):
+        cache = FragmentCache()
+        render = mock.Mock(return_value='<table/>')
+        self.assertEqual(cache.get_or_render('airport', render), '<table/>')
+        self.assertEqual(cache.get_or_render('airport', render), '<table/>')
+        render.assert_called_once()
+
+    def test_get_or_render_caches_nothing_on_failure(self):
+        cache = FragmentCache()
+        with self.assertRaises(RuntimeError):
+            cache.get_or_render('airport', mock.Mock(side_effect=RuntimeError))
+        self.assertIsNone(cache.get('airport'))
+
+
+class FragmentRenderingTests(unittest.TestCase):
+
+    airports = [{'iata_id': 'JFK', 'city': 'New York, NY', 'name': 'John F. Kennedy International',
+                 'longitude': 40.64, 'latitude': -73.78, 'elevation': 13}]
+
+    def setUp(self):
+        fragment_cache.clear()
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+        fragment_cache.clear()
+
+    def render(self, fetch, fallback=()):
+        return str(routes.render_fragment('airport', 'fragments/airport_table.html', fetch, list(fallback)))
+
+    def test_fragment_is_cached_until_a_change_is_submitted(self):
+        fetch = mock.Mock(return_value=self.airports)
+        self.assertIn('JFK', self.render(fetch))
+        self.assertIn('JFK', self.render(fetch))
+        self.assertEqual(fetch.call_count, 1)
+
+        post = mock.Mock()
+        routes.submit_change(post, "http://flights/api/v2/airports/", 'airport', json={})
+        post.assert_called_once()
+
+        self.render(fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_change_still_invalidates(self):
+        fetch = mock.Mock(return_value=self.airports)
+        self.render(fetch)
+        routes.submit_change(mock.Mock(side_effect=requests.ConnectionError), "http://flights", 'airport')
+        self.render(fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_fallback_is_rendered_and_not_cached(self):
+        fallback = [dict(self.airports[0], iata_id='CLE')]
+        self.assertIn('CLE', self.render(mock.Mock(side_effect=requests.ConnectionError), fallback))
+        self.assertIsNone(fragment_cache.get('airport'))
+
+        self.assertIn('JFK', self.render(mock.Mock(return_value=self.airports)))
+
+
 if __name__ == "__main__":
     unittest.main()
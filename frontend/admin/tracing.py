@@ -0,0 +1,228 @@
+# ######################################################################################################################
+# ########################################                               ###############################################
+# ########################################            Tracing            ###############################################
+# ########################################                               ###############################################
+# ######################################################################################################################
+# W3C trace context (https://www.w3.org/TR/trace-context/) for the admin frontend. Each page view becomes a server
+# span and every backend call made through `http` a client span whose traceparent header the FastAPI services continue,
+# so one admin page load can be followed from Flask through the services down to their SQL statements.
+#
+# The sampling decision is made here, at the root, with probability TRACE_SAMPLE_RATE (or inherited from an incoming
+# traceparent), and travels downstream in the header's flags: the backends never sample a request the frontend did not.
+# Exporters are picked by TRACE_EXPORTER (none, memory or file) exactly as in the backend services.
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from flask import g, has_request_context, request
+
+SERVICE_NAME = os.getenv("SERVICE_NAME") or "admin"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE") or 0.01)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER") or "none"
+TRACE_FILE = os.getenv("TRACE_FILE") or "traces.jsonl"
+
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+SAMPLED_FLAG = 0x01
+
+
+# ------------------------------------------------
+#                     Spans
+# ------------------------------------------------
+
+
+class Span(object):
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "status",
+                 "sampled")
+
+    def __init__(self, trace_id, parent_id, name, kind="internal", attributes=None, sampled=True):
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.sampled = sampled
+
+    def child(self, name, kind="internal", attributes=None):
+        return Span(self.trace_id, self.span_id, name, kind, attributes, self.sampled)
+
+    def finish(self):
+        self.end = time.time_ns()
+        if self.sampled:
+            exporter.export(self)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            "service": SERVICE_NAME,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start,
+            "duration_ms": round((self.end - self.start) / 1e6, 3) if self.end else None,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+def parse_traceparent(header):
+    """
+    :return: (trace_id, parent span_id, sampled) from a traceparent header, or None when it is missing or malformed
+    """
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+def current_span():
+    return g.get("trace_span") if has_request_context() else None
+
+
+# ------------------------------------------------
+#                   Exporters
+# ------------------------------------------------
+
+
+class NoopExporter(object):
+
+    def export(self, span):
+        pass
+
+
+class MemoryExporter(object):
+
+    def __init__(self, size=10000):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+    def clear(self):
+        self.spans.clear()
+
+
+class FileExporter(object):
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self.lock = Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self.lock:
+            with open(self.path, "a") as handle:
+                handle.write(line)
+
+
+EXPORTERS = {"none": NoopExporter, "memory": MemoryExporter, "file": FileExporter}
+
+exporter = EXPORTERS[TRACE_EXPORTER]()
+
+
+def set_exporter(new_exporter):
+    global exporter
+    exporter = new_exporter
+    return new_exporter
+
+
+# ------------------------------------------------
+#                  Flask Hooks
+# ------------------------------------------------
+
+
+def init_tracing(app):
+    """
+    Opens a span for every request the Flask app handles. Unsampled requests still get a (cheap, never exported) span
+    so that their trace id and "not sampled" decision reach the backends.
+    """
+
+    @app.before_request
+    def start_request_span():
+        parent = parse_traceparent(request.headers.get("traceparent"))
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = "%032x" % random.getrandbits(128), None, random.random() < TRACE_SAMPLE_RATE
+
+        g.trace_span = Span(trace_id, parent_id, f"{request.method} {request.url_rule or request.path}", "server", {
+            "http.method": request.method,
+            "http.target": request.path,
+        }, sampled)
+
+    @app.after_request
+    def record_response(response):
+        span = current_span()
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+            if response.status_code >= 500:
+                span.status = "error"
+            if span.sampled:
+                response.headers["traceresponse"] = span.traceparent()
+        return response
+
+    @app.teardown_request
+    def finish_request_span(exception):
+        span = g.pop("trace_span", None)
+        if span is not None:
+            if exception is not None:
+                span.status = "error"
+            span.finish()
+
+    return app
+
+
+# ------------------------------------------------
+#               Outbound Requests
+# ------------------------------------------------
+
+
+class TracedSession(requests.Session):
+    """
+    requests.Session that wraps each call in a client span and sends its traceparent. Outside a Flask request it
+    behaves like a plain session. Being a session, it also keeps connections to the backends alive between calls.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        parent = current_span()
+        if parent is None:
+            return super().request(method, url, *args, **kwargs)
+
+        span = parent.child(f"{method.upper()} {urlsplit(url).netloc}", "client", {
+            "http.method": method.upper(),
+            "http.url": url,
+        })
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["traceparent"] = span.traceparent()
+
+        try:
+            response = super().request(method, url, *args, headers=headers, **kwargs)
+        except Exception:
+            span.status = "error"
+            raise
+        else:
+            span.attributes["http.status_code"] = response.status_code
+            if response.status_code >= 500:
+                span.status = "error"
+            return response
+        finally:
+            span.finish()
+
+
+http = TracedSession()